@@ -0,0 +1,126 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import perf_counters
+from main import DataMem, SimConfig, Simulator
+
+# cycles simulated between wall-clock checks
+TIMEOUT_CHECK_CYCLES = 10000
+
+COLUMNS = ['name', 'status', 'cycles', 'instructions', 'ipc', 'rf_md5', 'dm_md5', 'seconds'] + \
+          list(perf_counters.NAMES)
+
+
+def words_md5(words):
+    # same digest as md5sum of rf_result.txt / data_mem.txt from main()
+    return hashlib.md5(''.join(f'{word}\n' for word in words).encode()).hexdigest()
+
+
+def read_instructions(path):
+    with open(path, 'r') as f:
+        return f.read().split()
+
+
+def run_job(job):
+    # Runs one manifest entry entirely in memory, so jobs need no working
+    # directory of their own. Config holds SimConfig fields plus the run
+    # limits: a job is stopped after max_cycles cycles or timeout seconds,
+    # whichever comes first.
+    start = time.monotonic()
+    result = {'name': job['name']}
+    try:
+        # everything but the run limits is a SimConfig field
+        config = dict(job.get('config', {}))
+        max_cycles = config.pop('max_cycles', None)
+        timeout = config.pop('timeout', None)
+        if 'forwarding' in config:
+            config['forwarding'] = tuple(config['forwarding'])
+        simulator = Simulator(instructions=read_instructions(job['ins_mem']),
+                              data=DataMem.read_text(job['data_mem']),
+                              config=SimConfig(**config))
+        # the counters are part of every result row
+        simulator.attach_counters()
+
+        status = 'ok'
+        while not simulator.finished:
+            if max_cycles is not None and simulator.cycle >= max_cycles:
+                status = 'cycle limit'
+                break
+            if timeout is not None and time.monotonic() - start > timeout:
+                status = 'timeout'
+                break
+            chunk = TIMEOUT_CHECK_CYCLES
+            if max_cycles is not None:
+                chunk = min(chunk, max_cycles - simulator.cycle)
+            simulator.run(chunk)
+
+        stats = simulator.stats()
+        result.update(status=status,
+                      cycles=stats.cycles,
+                      instructions=stats.instruction_count,
+                      ipc=stats.ipc,
+                      rf_md5=words_md5(simulator.rf.registers),
+                      dm_md5=words_md5(simulator.data_mem.data_mem_array))
+        result.update(zip(perf_counters.NAMES, simulator.counters.counts))
+    except Exception as e:
+        result['status'] = f'error: {e}'
+    result['seconds'] = round(time.monotonic() - start, 3)
+    return result
+
+
+def load_manifest(path, defaults):
+    # A JSON list of {"name", "ins_mem", "data_mem", "config"}; paths are
+    # relative to the manifest, config keys missing from a job come from
+    # defaults.
+    with open(path, 'r') as f:
+        jobs = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    for idx, job in enumerate(jobs):
+        job.setdefault('name', f'job{idx}')
+        job['ins_mem'] = os.path.join(base, job['ins_mem'])
+        job['data_mem'] = os.path.join(base, job['data_mem'])
+        job['config'] = {**defaults, **job.get('config', {})}
+    return jobs
+
+
+def run_batch(jobs, workers=None):
+    # results come back in manifest order
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run_job, jobs))
+
+
+def write_table(results, out):
+    writer = csv.DictWriter(out, fieldnames=COLUMNS, extrasaction='ignore')
+    writer.writeheader()
+    writer.writerows(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='run a manifest of CAS jobs in parallel')
+    parser.add_argument('manifest', help='JSON list of {"name", "ins_mem", "data_mem", "config"}')
+    parser.add_argument('-o', '--output', help='CSV file for the results (default: stdout)')
+    parser.add_argument('-j', '--workers', type=int, help='worker processes (default: one per core)')
+    parser.add_argument('--timeout', type=float, help='default per-job wall-clock limit in seconds')
+    parser.add_argument('--max-cycles', type=int, help='default per-job cycle limit')
+    args = parser.parse_args()
+
+    defaults = {}
+    if args.timeout is not None:
+        defaults['timeout'] = args.timeout
+    if args.max_cycles is not None:
+        defaults['max_cycles'] = args.max_cycles
+
+    results = run_batch(load_manifest(args.manifest, defaults), workers=args.workers)
+    if args.output is None:
+        write_table(results, sys.stdout)
+    else:
+        with open(args.output, 'w', newline='') as f:
+            write_table(results, f)
+    if any(result['status'] != 'ok' for result in results):
+        sys.exit(1)
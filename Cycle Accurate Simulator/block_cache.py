@@ -0,0 +1,146 @@
+# alu() results as Python expressions of `a` (rs) and `b` (rt or the
+# immediate); every result is masked to 32 bits like alu() does
+ALU_EXPRESSIONS = {
+    0: '({a} + {b}) & 0xffffffff',
+    1: '({a} - {b}) & 0xffffffff',
+    2: '{a} & {b} & 0xffffffff',
+    3: '({a} | {b}) & 0xffffffff',
+    4: '1 if {a} < {b} else 0',
+    5: '1 if {a} > {b} else 0',
+    6: '~({a} | {b}) & 0xffffffff',
+    7: '({a} ^ {b}) & 0xffffffff',
+    8: '({b} << {shamt}) & 0xffffffff',
+    9: '({b} >> {shamt}) & 0xffffffff',
+}
+
+
+class Block:
+    __slots__ = ('start', 'length', 'instruction_count', 'leading_nops',
+                 'trailing_nops', 'run', 'source')
+
+    def __init__(self, start, length, instruction_count, leading_nops, trailing_nops, run, source):
+        self.start = start
+        self.length = length
+        self.instruction_count = instruction_count
+        self.leading_nops = leading_nops
+        self.trailing_nops = trailing_nops
+        # run(registers, data_mem_array) executes the block and returns the next PC
+        self.run = run
+        self.source = source
+
+
+class BlockCache:
+    # Straight-line code from a start PC up to and including the next branch
+    # or jump (or up to the next branch target) is compiled once into a Python
+    # function. Blocks are cached by start PC and dropped whenever the
+    # instruction memory version changes.
+    def __init__(self, ins_mem, ins_mem_size, max_nop_count):
+        self.ins_mem = ins_mem
+        self.pc_mask = ins_mem_size - 1
+        self.max_nop_count = max_nop_count
+        self.blocks = {}
+        self.version = None
+        self.leaders = set()
+
+    def invalidate(self):
+        self.blocks.clear()
+        self.leaders = self.find_leaders()
+        self.version = self.ins_mem.version
+
+    def find_leaders(self):
+        leaders = set()
+        for pc, instruction in enumerate(self.ins_mem.instructions):
+            control = instruction.control
+            next_pc = (pc + 1) & self.pc_mask
+            if control.branch:
+                leaders.add((next_pc + instruction.target) & self.pc_mask)
+                leaders.add(next_pc)
+            elif control.pc_src:
+                if control.jump:
+                    leaders.add(instruction.target)
+                leaders.add(next_pc)
+        return leaders
+
+    def get(self, pc):
+        if self.version != self.ins_mem.version:
+            self.invalidate()
+        block = self.blocks.get(pc)
+        if block is None:
+            block = self.blocks[pc] = self.translate(pc)
+        return block
+
+    def translate(self, start):
+        instructions = self.ins_mem.instructions
+        lines = ['def block(r, dm):']
+        pc = start
+        length = instruction_count = leading_nops = nop_run = 0
+        next_pc = start
+        terminator = False
+
+        while length <= self.pc_mask:
+            instruction = instructions[pc]
+            if length and pc in self.leaders:
+                break
+            if not instruction.word:
+                # a NOP run long enough to end the program must be seen by
+                # the caller, so never hide one inside a block
+                if nop_run + 1 >= self.max_nop_count and instruction_count:
+                    break
+                nop_run += 1
+                if not instruction_count:
+                    leading_nops += 1
+                length += 1
+                pc = next_pc = (pc + 1) & self.pc_mask
+                continue
+
+            nop_run = 0
+            instruction_count += 1
+            length += 1
+            next_pc = (pc + 1) & self.pc_mask
+            terminator = self.emit(lines, instruction, next_pc)
+            pc = next_pc
+            if terminator:
+                break
+
+        if not terminator:
+            lines.append(f'    return {next_pc}')
+
+        source = '\n'.join(lines) + '\n'
+        namespace = {}
+        exec(compile(source, f'<block {start}>', 'exec'), namespace)
+        return Block(start, length, instruction_count, leading_nops, nop_run, namespace['block'], source)
+
+    def emit(self, lines, instruction, next_pc):
+        # appends the Python statements for one instruction; returns True if
+        # it ends the block
+        control = instruction.control
+        rs = f'r[{instruction.rs}]'
+        rt = f'r[{instruction.rt}]'
+
+        if control.branch:
+            taken = (next_pc + instruction.target) & self.pc_mask
+            compare = '!=' if instruction.I_26 else '=='
+            lines.append(f'    return {taken} if {rs} {compare} {rt} else {next_pc}')
+            return True
+
+        if control.pc_src and not control.jump:  # jr reads its target first
+            lines.append(f'    target = {rs} & {self.pc_mask}')
+
+        operand2 = repr(instruction.imm) if control.alu_src else rt
+        alu_result = ALU_EXPRESSIONS.get(control.alu_op, '0').format(a=rs, b=operand2, shamt=instruction.shamt)
+
+        if control.mem_write:
+            lines.append(f'    dm[{alu_result}] = {rt}')
+        elif control.reg_write:
+            write_register = (instruction.rt, instruction.rd, 31)[control.reg_dst]
+            if write_register != 0:
+                write_data = (alu_result, f'dm[{alu_result}]', str(next_pc))[control.mem_to_reg]
+                lines.append(f'    r[{write_register}] = {write_data}')
+
+        if control.jump:
+            lines.append(f'    return {instruction.target}')
+            return True
+        if control.pc_src:
+            lines.append('    return target')
+            return True
+        return False
@@ -0,0 +1,239 @@
+import argparse
+from array import array
+
+# Direction predictors implement predict(pc) -> 0/1, update(pc, taken) and
+# state()/load_state(words) for checkpoints. Target buffers implement
+# lookup(pc) -> target or None, update(pc, target) and the same state calls.
+
+
+def saturate(counter, taken):
+    if taken:
+        return counter + 1 if counter < 3 else 3
+    return counter - 1 if counter > 0 else 0
+
+
+class Bimodal:
+    # 2-bit saturating counters indexed by PC; the RTL scheme
+    def __init__(self, size=256, initial=1):
+        self.mask = size - 1
+        self.table = [initial] * size
+
+    def predict(self, pc):
+        return self.table[pc & self.mask] >> 1
+
+    def update(self, pc, taken):
+        index = pc & self.mask
+        self.table[index] = saturate(self.table[index], taken)
+
+    def state(self):
+        return list(self.table)
+
+    def load_state(self, words):
+        self.table = list(words)
+
+
+class GShare:
+    # 2-bit counters indexed by PC xor the global outcome history
+    def __init__(self, size=256, history_bits=8, initial=1):
+        self.mask = size - 1
+        self.history_mask = (1 << history_bits) - 1
+        self.history = 0
+        self.table = [initial] * size
+
+    def predict(self, pc):
+        return self.table[(pc ^ self.history) & self.mask] >> 1
+
+    def update(self, pc, taken):
+        index = (pc ^ self.history) & self.mask
+        self.table[index] = saturate(self.table[index], taken)
+        self.history = ((self.history << 1) | taken) & self.history_mask
+
+    def state(self):
+        return self.table + [self.history]
+
+    def load_state(self, words):
+        self.table = list(words[:-1])
+        self.history = words[-1]
+
+
+class Tournament:
+    # per-PC 2-bit chooser between a bimodal and a gshare predictor; a
+    # chooser value of 2 or 3 selects gshare
+    def __init__(self, size=256, history_bits=8, initial=1):
+        self.mask = size - 1
+        self.local = Bimodal(size, initial)
+        self.global_ = GShare(size, history_bits, initial)
+        self.chooser = [1] * size
+
+    def predict(self, pc):
+        if self.chooser[pc & self.mask] >> 1:
+            return self.global_.predict(pc)
+        return self.local.predict(pc)
+
+    def update(self, pc, taken):
+        local_correct = self.local.predict(pc) == taken
+        global_correct = self.global_.predict(pc) == taken
+        if local_correct != global_correct:
+            index = pc & self.mask
+            self.chooser[index] = saturate(self.chooser[index], global_correct)
+        self.local.update(pc, taken)
+        self.global_.update(pc, taken)
+
+    def state(self):
+        return self.local.state() + self.global_.state() + self.chooser
+
+    def load_state(self, words):
+        size = self.mask + 1
+        self.local.load_state(words[:size])
+        self.global_.load_state(words[size:2 * size + 1])
+        self.chooser = list(words[2 * size + 1:])
+
+
+class PerPCBTB:
+    # one entry per instruction address, so it never misses once trained;
+    # the RTL scheme
+    def __init__(self, size=256):
+        self.mask = size - 1
+        self.targets = [0] * size
+        self.valid = [0] * size
+
+    def lookup(self, pc):
+        return self.targets[pc] if self.valid[pc] else None
+
+    def update(self, pc, target):
+        self.targets[pc] = target
+        self.valid[pc] = 1
+
+    def state(self):
+        return self.targets + self.valid
+
+    def load_state(self, words):
+        size = self.mask + 1
+        self.targets = list(words[:size])
+        self.valid = list(words[size:])
+
+
+class FiniteBTB:
+    # direct-mapped and tagged with the upper PC bits
+    def __init__(self, entries=16):
+        self.mask = entries - 1
+        self.shift = entries.bit_length() - 1
+        self.targets = [0] * entries
+        self.tags = [-1] * entries
+
+    def lookup(self, pc):
+        index = pc & self.mask
+        return self.targets[index] if self.tags[index] == pc >> self.shift else None
+
+    def update(self, pc, target):
+        index = pc & self.mask
+        self.targets[index] = target
+        self.tags[index] = pc >> self.shift
+
+    def state(self):
+        return self.targets + self.tags
+
+    def load_state(self, words):
+        entries = self.mask + 1
+        self.targets = list(words[:entries])
+        self.tags = list(words[entries:])
+
+
+def make_predictor(spec, size=256, initial=1):
+    # 'bimodal', 'gshare[:history_bits]' or 'tournament[:history_bits]'
+    name, _, arg = spec.partition(':')
+    if name == 'bimodal':
+        return Bimodal(size, initial)
+    if name == 'gshare':
+        return GShare(size, int(arg or 8), initial)
+    if name == 'tournament':
+        return Tournament(size, int(arg or 8), initial)
+    raise ValueError(f'unknown branch predictor: {spec}')
+
+
+def make_btb(entries=None, size=256):
+    # entries=None is the per-PC table
+    if entries is None:
+        return PerPCBTB(size)
+    if entries & (entries - 1):
+        raise ValueError('BTB entries must be a power of two')
+    return FiniteBTB(entries)
+
+
+class BranchStream:
+    # Resolved branches as seen by the BPU, one word each:
+    # pc | target << 16 | taken << 31. Recorded once from a CAS run and
+    # replayed through any number of predictors.
+    def __init__(self, words=None):
+        self.words = array('L') if words is None else words
+
+    def attach(self, bpu):
+        # shadows bpu.update with an instance attribute, like the tracer does
+        update = bpu.update
+        append = self.words.append
+
+        def recording_update(pc, branch_taken, target):
+            update(pc, branch_taken, target)
+            append(pc | target << 16 | (1 << 31 if branch_taken else 0))
+
+        bpu.update = recording_update
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            self.words.tofile(f)
+
+    @classmethod
+    def load(cls, path):
+        words = array('L')
+        with open(path, 'rb') as f:
+            words.frombytes(f.read())
+        return cls(words)
+
+    def __len__(self):
+        return len(self.words)
+
+
+def evaluate(stream, predictor, btb=None):
+    # Trace-driven: each branch is predicted and then trained before the
+    # next one, so it ignores the fetch-to-resolve delay of the pipeline.
+    # As in the BPU, a branch without a BTB entry is predicted not taken;
+    # btb_misses counts the taken predictions lost that way.
+    mispredicts = btb_misses = 0
+    predict = predictor.predict
+    update = predictor.update
+    for word in stream.words:
+        pc = word & 0xffff
+        target = (word >> 16) & 0x7fff
+        taken = word >> 31
+        prediction = predict(pc)
+        if prediction and btb is not None and btb.lookup(pc) is None:
+            prediction = 0
+            btb_misses += 1
+        if prediction != taken:
+            mispredicts += 1
+        update(pc, taken)
+        if btb is not None and taken:
+            btb.update(pc, target)
+    branches = len(stream)
+    return {'branches': branches,
+            'mispredicts': mispredicts,
+            'accuracy': 1 - mispredicts / branches if branches else 1.0,
+            'btb_misses': btb_misses}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='replay a recorded branch stream through predictors')
+    parser.add_argument('stream', help='file written by main.py --record-branches')
+    parser.add_argument('--predictor', nargs='+', default=['bimodal', 'gshare', 'tournament'],
+                        metavar='SPEC', help='bimodal, gshare[:bits], tournament[:bits]')
+    parser.add_argument('--btb-entries', type=int, nargs='+', default=[None], metavar='N',
+                        help='finite BTB sizes to evaluate (default: one entry per PC)')
+    args = parser.parse_args()
+
+    stream = BranchStream.load(args.stream)
+    print(f'{"predictor":<16}{"btb":>6}{"mispredicts":>13}{"accuracy":>10}{"btb misses":>12}')
+    for spec in args.predictor:
+        for entries in args.btb_entries:
+            result = evaluate(stream, make_predictor(spec), make_btb(entries))
+            print(f'{spec:<16}{entries or "pc":>6}{result["mispredicts"]:>13}'
+                  f'{result["accuracy"]:>10.4f}{result["btb_misses"]:>12}')
@@ -0,0 +1,162 @@
+import argparse
+import queue
+import struct
+import sys
+import threading
+from array import array
+
+MAGIC = b'CASTRC02'
+# magic, level, data memory words, DM words rendered, issue width
+HEADER = struct.Struct('<8sBIIB')
+# kind, register, pc/address, cycle/value, fetched words
+RECORD = struct.Struct('<BxHIqQ')
+
+CYCLE = 1
+RF_WRITE = 2
+DM_WRITE = 3
+# two more fetched words of the preceding CYCLE record, for lanes past the
+# second
+FETCH = 4
+
+TRACE_OFF = 0
+TRACE_FETCH = 1   # PC and fetched instructions every cycle
+TRACE_WRITES = 2  # plus every RF and DM write
+
+
+class TraceWriter:
+    # Records are packed into a fixed-size buffer on the simulator thread and
+    # handed to a background thread that writes them out. At most
+    # max_pending buffers are queued; beyond that the simulator waits.
+    def __init__(self, path, level=TRACE_WRITES, buffer_records=8192, max_pending=16):
+        self.level = level
+        self.file = open(path, 'wb')
+        self.buffer = bytearray(RECORD.size * buffer_records)
+        self.offset = 0
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def write_loop(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                break
+            self.file.write(chunk)
+
+    def write_header(self, registers, data_mem_array, dm_read, width):
+        # the initial RF and DM let the decoder rebuild the state of any cycle
+        self.queue.put(HEADER.pack(MAGIC, self.level, len(data_mem_array), dm_read, width) +
+                       array('q', registers).tobytes() + array('q', data_mem_array).tobytes())
+
+    def attach(self, rf, data_mem, dm_read, width=2):
+        self.write_header(rf.registers, data_mem.data_mem_array, dm_read, width)
+        if self.level < TRACE_WRITES:
+            return
+
+        # instance attributes shadow the methods, so untraced runs pay nothing
+        write_rf = rf.write_rf
+        write_dm = data_mem.write_dm
+
+        def traced_write_rf(reg_num, write_data):
+            write_rf(reg_num, write_data)
+            if reg_num != 0:
+                self.record(RF_WRITE, reg_num, 0, write_data, 0)
+
+        def traced_write_dm(address, data):
+            write_dm(address, data)
+            self.record(DM_WRITE, 0, address, data, 0)
+
+        rf.write_rf = traced_write_rf
+        data_mem.write_dm = traced_write_dm
+
+    def record(self, kind, register, address, value, extra):
+        RECORD.pack_into(self.buffer, self.offset, kind, register, address, value, extra)
+        self.offset += RECORD.size
+        if self.offset == len(self.buffer):
+            self.queue.put(bytes(self.buffer))
+            self.offset = 0
+
+    def cycle(self, cycle, pc, words):
+        # words are the fetched instructions, one per lane, packed two to a
+        # record
+        self.record(CYCLE, 0, pc, cycle, pair(words, 0))
+        for lane in range(2, len(words), 2):
+            self.record(FETCH, 0, 0, 0, pair(words, lane))
+
+    def close(self):
+        if self.offset:
+            self.queue.put(bytes(self.buffer[:self.offset]))
+            self.offset = 0
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+
+
+def pair(words, lane):
+    # the words of `lane` and the lane after it in one 64-bit field
+    second = words[lane + 1] if lane + 1 < len(words) else 0
+    return (words[lane] << 32) | second
+
+
+def read_trace(path):
+    # returns (level, registers, data_mem_array, dm_read, width, records)
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, level, n_dm, dm_read, width = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('not a CAS trace')
+    offset = HEADER.size
+    registers = array('q')
+    registers.frombytes(data[offset:offset + 32 * 8])
+    offset += 32 * 8
+    data_mem_array = array('q')
+    data_mem_array.frombytes(data[offset:offset + n_dm * 8])
+    offset += n_dm * 8
+    return level, registers.tolist(), data_mem_array.tolist(), dm_read, width, RECORD.iter_unpack(data[offset:])
+
+
+def render(path, out):
+    # writes the CYCLE_START/CYCLE_END text that parser_cas.py understands.
+    # A cycle is written once its FETCH records have been read, since RF and
+    # DM writes only follow them.
+    level, registers, data_mem_array, dm_read, width, records = read_trace(path)
+    cycle = None
+    for kind, register, address, value, extra in records:
+        if kind == FETCH:
+            cycle[2].extend((extra >> 32, extra & 0xffffffff))
+            continue
+        if cycle is not None:
+            write_cycle(out, level, registers, data_mem_array, dm_read, width, *cycle)
+            cycle = None
+        if kind == RF_WRITE:
+            registers[register] = value
+        elif kind == DM_WRITE:
+            data_mem_array[address] = value
+        elif kind == CYCLE:
+            cycle = (value, address, [extra >> 32, extra & 0xffffffff])
+    if cycle is not None:
+        write_cycle(out, level, registers, data_mem_array, dm_read, width, *cycle)
+
+
+def write_cycle(out, level, registers, data_mem_array, dm_read, width, cycle, pc, words):
+    out.write('CYCLE_START\n')
+    out.write(f'cycle: {cycle}, PC: {pc}\n')
+    for lane in range(width):
+        out.write(f'Instruction{lane + 1}(Fetch): {hex(words[lane])}\n')
+    if level >= TRACE_WRITES:
+        out.write(f'RF: {registers}\n')
+        out.write(f'DM: {data_mem_array[0:dm_read]}\n')
+    out.write('CYCLE_END\n\n\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='render a binary CAS trace as cas_out.txt text')
+    parser.add_argument('trace')
+    parser.add_argument('-o', '--output', help='output file (default: stdout)')
+    args = parser.parse_args()
+
+    if args.output:
+        with open(args.output, 'w') as out:
+            render(args.trace, out)
+    else:
+        render(args.trace, sys.stdout)
@@ -0,0 +1,54 @@
+import argparse
+import sys
+from array import array
+
+import batch
+import checkpoint
+from main import FORWARDING_PATHS, DataMem, SimConfig, Simulator
+
+
+def snapshot(simulator):
+    return (simulator.cycle, simulator.instruction_count, simulator.nop_count, simulator.pc.cur_pc,
+            checkpoint.latch_words(simulator.state), list(simulator.rf.registers),
+            array('q', simulator.data_mem.data_mem_array), simulator.branch_predictor.state_words(),
+            array('q', simulator.counters.counts), simulator.counters.in_flight, simulator.counters.bubble)
+
+
+FIELDS = ('cycle', 'instruction_count', 'nop_count', 'pc', 'latches', 'registers', 'data memory',
+          'branch predictor', 'counters', 'in_flight', 'bubble')
+
+
+def check(instructions, data, config=None, max_cycles=None):
+    # Runs Simulator.step() and the generated step() side by side and compares
+    # the whole simulator state after every cycle. Returns None if they agree
+    # throughout, else (cycle, field) of the first difference.
+    reference = Simulator(instructions=instructions, data=data, config=config)
+    generated = Simulator(instructions=instructions, data=data, config=config)
+    generated.use_generated_step()
+    reference.attach_counters()
+    generated.attach_counters()
+    while not reference.finished and (max_cycles is None or reference.cycle < max_cycles):
+        reference.step()
+        generated.step()
+        for field, expected, actual in zip(FIELDS, snapshot(reference), snapshot(generated)):
+            if expected != actual:
+                return reference.cycle, field
+    return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='compare the generated step() with Simulator.step() cycle by cycle')
+    parser.add_argument('ins_mem', nargs='?', default='ins_mem.txt')
+    parser.add_argument('data_mem', nargs='?', default='data_mem.txt')
+    parser.add_argument('--forwarding', nargs='*', default=FORWARDING_PATHS, choices=FORWARDING_PATHS,
+                        metavar='PATH', help='enabled forwarding paths, any of M1 M2 W1 W2 (default: all)')
+    parser.add_argument('--width', type=int, default=2, metavar='LANES', help='issue lanes (default: 2)')
+    parser.add_argument('--max-cycles', type=int)
+    args = parser.parse_args()
+
+    mismatch = check(batch.read_instructions(args.ins_mem), DataMem.read_text(args.data_mem),
+                     SimConfig(forwarding=tuple(args.forwarding), width=args.width), args.max_cycles)
+    if mismatch is not None:
+        print(f'cycle {mismatch[0]}: {mismatch[1]} differs')
+        sys.exit(1)
+    print('identical')
@@ -0,0 +1,88 @@
+import struct
+import zlib
+from array import array
+
+MAGIC = b'CASCKPT4'
+HEADER = struct.Struct('<8sqqqqIIII')
+
+
+def latch_words(state):
+    # every latch field of every lane in __slots__ order; decoded
+    # instructions are stored as their 32-bit word
+    words = array('q')
+    for latch_name in state.__slots__:
+        for latch in getattr(state, latch_name):
+            for field in latch.__slots__:
+                value = getattr(latch, field)
+                words.append(value.word if field == 'instruction' else value)
+    return words
+
+
+def load_latch_words(state, words, decode):
+    idx = 0
+    for latch_name in state.__slots__:
+        for latch in getattr(state, latch_name):
+            for field in latch.__slots__:
+                value = words[idx]
+                setattr(latch, field, decode(value) if field == 'instruction' else value)
+                idx += 1
+
+
+def snapshot(state, rf, data_mem, pc, branch_predictor, counters, cycle, instruction_count, nop_count):
+    latches = latch_words(state)
+    registers = array('q', rf.registers)
+    dm = array('q', data_mem.data_mem_array)
+    bpu = array('q', branch_predictor.state_words())
+    # perf counters, so a resumed run reports the whole program
+    perf = array('q', counters.state_words() if counters is not None else ())
+
+    header = HEADER.pack(MAGIC, cycle, instruction_count, nop_count, pc.cur_pc,
+                         len(latches), len(dm), len(bpu), len(perf))
+    payload = latches.tobytes() + registers.tobytes() + dm.tobytes() + bpu.tobytes() + perf.tobytes()
+    return header + zlib.compress(payload)
+
+
+def restore(data, state, rf, data_mem, pc, branch_predictor, counters, decode):
+    magic, cycle, instruction_count, nop_count, cur_pc, n_latch, n_dm, n_bpu, n_perf = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('not a CAS checkpoint')
+
+    words = array('q')
+    words.frombytes(zlib.decompress(data[HEADER.size:]))
+    if len(words) != n_latch + 32 + n_dm + n_bpu + n_perf:
+        raise ValueError('truncated CAS checkpoint')
+
+    if n_latch != len(latch_words(state)):
+        raise ValueError('checkpoint issue width does not match')
+    load_latch_words(state, words[:n_latch], decode)
+    offset = n_latch
+    rf.registers[:] = words[offset:offset + 32]
+    offset += 32
+    if n_dm != len(data_mem.data_mem_array):
+        raise ValueError('checkpoint data memory size does not match')
+    # written in place so a memory-mapped data memory stays mapped
+    data_mem.data_mem_array[:] = words[offset:offset + n_dm]
+    offset += n_dm
+    if n_bpu != len(branch_predictor.state_words()):
+        raise ValueError('checkpoint branch predictor does not match')
+    branch_predictor.load_state_words(words[offset:offset + n_bpu].tolist())
+    offset += n_bpu
+    if counters is not None:
+        if not n_perf:
+            raise ValueError('checkpoint was saved without perf counters')
+        if n_perf != len(counters.state_words()):
+            raise ValueError('checkpoint perf counters do not match')
+        counters.load_state_words(words[offset:offset + n_perf])
+    pc.cur_pc = cur_pc
+
+    return cycle, instruction_count, nop_count
+
+
+def save_checkpoint(path, *args, **kwargs):
+    with open(path, 'wb') as f:
+        f.write(snapshot(*args, **kwargs))
+
+
+def load_checkpoint(path, *args, **kwargs):
+    with open(path, 'rb') as f:
+        return restore(f.read(), *args, **kwargs)
@@ -0,0 +1,103 @@
+MISSING = object()
+
+
+class CycleView:
+    # One cycle of a Simulator.cycles() run. The same object is updated in
+    # place every cycle and holds references, not copies: state is the latch
+    # bank the cycle wrote, registers and data_mem are read-only memoryviews
+    # of the live RF and DM. Anything read from it is only valid until the
+    # generator is resumed; copy what must outlive the cycle.
+    __slots__ = ('cycle', 'pc', 'words', 'stall', 'hdu', 'state', 'registers', 'data_mem')
+
+    def __init__(self):
+        self.cycle = 0
+        # fetch PC and the fetched word of every lane
+        self.pc = 0
+        self.words = None
+        # perf_counters stall category of the ID stage, 0 if none
+        self.stall = 0
+        self.hdu = None
+        self.state = None
+        self.registers = None
+        self.data_mem = None
+
+    @property
+    def mispredicted(self):
+        return bool(self.hdu.flush_EX)
+
+    @property
+    def flushed(self):
+        # a misprediction or a jump flushed IF_ID
+        return bool(self.hdu.flush_IF_ID)
+
+
+class FetchRecorder:
+    # takes the tracer's place while a cycles() generator runs, and passes
+    # every cycle on to the tracer it replaced
+    __slots__ = ('view', 'tracer')
+
+    def __init__(self, view, tracer):
+        self.view = view
+        self.tracer = tracer
+
+    def cycle(self, cycle, pc, words):
+        view = self.view
+        view.pc = pc
+        view.words = words
+        if self.tracer is not None:
+            self.tracer.cycle(cycle, pc, words)
+
+
+def cycles(simulator, max_cycles=None):
+    # Generator behind Simulator.cycles(): steps the simulator until the
+    # program ends or max_cycles cycles have passed, yielding the CycleView
+    # after every cycle. The fetch and HDU hooks are only installed while it
+    # runs, so other runs pay nothing for it.
+    view = CycleView()
+    recorder = FetchRecorder(view, simulator.tracer)
+    # the HDU hook rides on counters.record_cycle, so a simulator without
+    # counters gets them for the duration of the run
+    attached = simulator.counters is None
+    counters = simulator.attach_counters() if attached else simulator.counters
+    saved_record_cycle = counters.__dict__.get('record_cycle', MISSING)
+    record_cycle = counters.record_cycle
+
+    def viewed_record_cycle(stall, words, hdu):
+        record_cycle(stall, words, hdu)
+        view.stall = stall
+        view.hdu = hdu
+
+    counters.record_cycle = viewed_record_cycle
+    simulator.tracer = recorder
+    registers = data_mem_array = None
+    end = None if max_cycles is None else simulator.cycle + max_cycles
+    try:
+        while not simulator.finished and (end is None or simulator.cycle < end):
+            simulator.step()
+            # a checkpoint or DataMem.close() may have replaced the arrays
+            if simulator.rf.registers is not registers:
+                if view.registers is not None:
+                    view.registers.release()
+                registers = simulator.rf.registers
+                view.registers = memoryview(registers).toreadonly()
+            if simulator.data_mem.data_mem_array is not data_mem_array:
+                if view.data_mem is not None:
+                    view.data_mem.release()
+                data_mem_array = simulator.data_mem.data_mem_array
+                view.data_mem = memoryview(data_mem_array).toreadonly()
+            view.cycle = simulator.cycle - 1
+            view.state = simulator.state
+            yield view
+    finally:
+        simulator.tracer = recorder.tracer
+        if attached:
+            simulator.counters = None
+        elif saved_record_cycle is MISSING:
+            del counters.record_cycle
+        else:
+            counters.record_cycle = saved_record_cycle
+        # exported buffers would keep an mmap'd data memory from closing
+        if view.registers is not None:
+            view.registers.release()
+        if view.data_mem is not None:
+            view.data_mem.release()
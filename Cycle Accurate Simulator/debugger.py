@@ -0,0 +1,207 @@
+import argparse
+from collections import namedtuple
+
+import batch
+from main import DataMem, Simulator
+
+# kind: 'pc', 'cycle', 'dm_read', 'dm_write', 'rf_read' or 'rf_write';
+# target: the PC, cycle, address or register; old is the value a write replaced
+Hit = namedtuple('Hit', ['kind', 'cycle', 'target', 'value', 'old'])
+
+MISSING = object()
+
+
+class Debugger:
+    # PC and cycle breakpoints and DM/RF watchpoints for a Simulator.
+    # Breakpoints are checked by run() between cycles, so Simulator.step() and
+    # Simulator.run() are untouched. Watchpoints wrap read_dm/write_dm and
+    # read_rf/write_rf with instance attributes, the same way the tracer and
+    # the state hash do, and only the kinds that have a watch are wrapped.
+    # A breakpoint or watch with a callback calls it with the Hit and stops
+    # only if it returns True; one without a callback always stops. run()
+    # finishes the cycle in which the stopping hit happened and returns.
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.pc_breakpoints = {}
+        self.cycle_breakpoints = {}
+        # {address or register: callback}, one dict per access kind
+        self.watches = {'dm_read': {}, 'dm_write': {}, 'rf_read': {}, 'rf_write': {}}
+        self.saved = {}
+        self.stops = []
+
+    def break_at_pc(self, pc, callback=None):
+        # hits when a packet containing pc is fetched into IF_ID
+        self.pc_breakpoints[pc] = callback
+
+    def break_at_cycle(self, cycle, callback=None):
+        # hits when the simulator reaches `cycle`, before that cycle runs
+        self.cycle_breakpoints[cycle] = callback
+
+    def watch_dm(self, address, read=False, write=True, callback=None):
+        if read:
+            self.watches['dm_read'][address] = callback
+        if write:
+            self.watches['dm_write'][address] = callback
+        self.install()
+
+    def watch_rf(self, reg_num, read=False, write=True, callback=None):
+        if read:
+            self.watches['rf_read'][reg_num] = callback
+        if write:
+            self.watches['rf_write'][reg_num] = callback
+        self.install()
+
+    def clear(self):
+        self.pc_breakpoints.clear()
+        self.cycle_breakpoints.clear()
+        for watches in self.watches.values():
+            watches.clear()
+        self.install()
+
+    def hit(self, callbacks, kind, target, value, old=None):
+        hit = Hit(kind, self.simulator.cycle, target, value, old)
+        callback = callbacks[target]
+        if callback is None or callback(hit):
+            self.stops.append(hit)
+
+    def install(self):
+        # wraps the accessors that have watches and restores the others
+        rf = self.simulator.rf
+        data_mem = self.simulator.data_mem
+        wrappers = {'dm_read': (data_mem, 'read_dm', self.watched_read_dm),
+                    'dm_write': (data_mem, 'write_dm', self.watched_write_dm),
+                    'rf_read': (rf, 'read_rf', self.watched_read_rf),
+                    'rf_write': (rf, 'write_rf', self.watched_write_rf)}
+        for kind, (target, name, wrap) in wrappers.items():
+            if self.watches[kind] and kind not in self.saved:
+                self.saved[kind] = target.__dict__.get(name, MISSING)
+                setattr(target, name, wrap(getattr(target, name)))
+            elif not self.watches[kind] and kind in self.saved:
+                saved = self.saved.pop(kind)
+                if saved is MISSING:
+                    delattr(target, name)
+                else:
+                    setattr(target, name, saved)
+
+    def watched_read_dm(self, read_dm):
+        watches = self.watches['dm_read']
+
+        def read(address):
+            value = read_dm(address)
+            if address in watches:
+                self.hit(watches, 'dm_read', address, value)
+            return value
+
+        return read
+
+    def watched_write_dm(self, write_dm):
+        watches = self.watches['dm_write']
+        data_mem = self.simulator.data_mem
+
+        def write(address, data):
+            if address in watches:
+                self.hit(watches, 'dm_write', address, data, data_mem.data_mem_array[address])
+            write_dm(address, data)
+
+        return write
+
+    def watched_read_rf(self, read_rf):
+        watches = self.watches['rf_read']
+
+        def read(reg_num):
+            value = read_rf(reg_num)
+            if reg_num in watches:
+                self.hit(watches, 'rf_read', reg_num, value)
+            return value
+
+        return read
+
+    def watched_write_rf(self, write_rf):
+        watches = self.watches['rf_write']
+        rf = self.simulator.rf
+
+        def write(reg_num, write_data):
+            # writes to r0 are dropped by write_rf and never hit
+            if reg_num in watches and reg_num != 0:
+                self.hit(watches, 'rf_write', reg_num, write_data, rf.registers[reg_num])
+            write_rf(reg_num, write_data)
+
+        return write
+
+    def fetched(self, fetch_pc):
+        # PCs of the packet the last cycle fetched into IF_ID, if it did
+        simulator = self.simulator
+        if_id = simulator.state.if_id
+        if if_id[0].pc != fetch_pc:
+            return ()
+        return tuple(pc for pc, latch in zip(simulator.fetch_addresses(if_id), if_id)
+                     if latch.instruction.word)
+
+    def run(self, max_cycles=None):
+        # Steps until a hit stops the run, the program ends or max_cycles
+        # cycles have passed. Returns the stopping hits, [] otherwise; the
+        # simulator holds the full state at the end of the last cycle run.
+        simulator = self.simulator
+        pc_breakpoints = self.pc_breakpoints
+        cycle_breakpoints = self.cycle_breakpoints
+        self.stops = []
+        end = None if max_cycles is None else simulator.cycle + max_cycles
+        while not simulator.finished and (end is None or simulator.cycle < end):
+            fetch_pc = simulator.pc.cur_pc
+            simulator.step()
+            if pc_breakpoints:
+                for pc in self.fetched(fetch_pc):
+                    if pc in pc_breakpoints:
+                        self.hit(pc_breakpoints, 'pc', pc, pc)
+            if simulator.cycle in cycle_breakpoints:
+                self.hit(cycle_breakpoints, 'cycle', simulator.cycle, simulator.pc.cur_pc)
+            if self.stops:
+                break
+        return self.stops
+
+
+def describe(hit):
+    if hit.kind == 'pc':
+        return f'cycle {hit.cycle}: fetched PC {hit.target}'
+    if hit.kind == 'cycle':
+        return f'cycle {hit.cycle}: reached, PC {hit.value}'
+    where = f'DM[{hit.target}]' if hit.kind.startswith('dm') else f'r{hit.target}'
+    if hit.kind.endswith('read'):
+        return f'cycle {hit.cycle}: read {where} = {hit.value}'
+    return f'cycle {hit.cycle}: write {where} {hit.old} -> {hit.value}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='run a program under breakpoints and watchpoints')
+    parser.add_argument('ins_mem', nargs='?', default='ins_mem.txt')
+    parser.add_argument('data_mem', nargs='?', default='data_mem.txt')
+    parser.add_argument('--break-pc', type=int, nargs='+', default=(), metavar='PC')
+    parser.add_argument('--break-cycle', type=int, nargs='+', default=(), metavar='CYCLE')
+    parser.add_argument('--watch-dm', type=int, nargs='+', default=(), metavar='ADDRESS')
+    parser.add_argument('--watch-rf', type=int, nargs='+', default=(), metavar='REGISTER')
+    parser.add_argument('--reads', action='store_true', help='watch reads as well as writes')
+    parser.add_argument('--stop', action='store_true',
+                        help='stop at the first hit and print PC and registers instead of logging every hit')
+    args = parser.parse_args()
+
+    simulator = Simulator(instructions=batch.read_instructions(args.ins_mem), data=DataMem.read_text(args.data_mem))
+    debugger = Debugger(simulator)
+    # without --stop every hit is printed by its callback and the run goes on
+    log = None if args.stop else (lambda hit: print(describe(hit)))
+    for pc in args.break_pc:
+        debugger.break_at_pc(pc, log)
+    for cycle in args.break_cycle:
+        debugger.break_at_cycle(cycle, log)
+    for address in args.watch_dm:
+        debugger.watch_dm(address, read=args.reads, callback=log)
+    for reg_num in args.watch_rf:
+        debugger.watch_rf(reg_num, read=args.reads, callback=log)
+
+    stops = debugger.run()
+    for hit in stops:
+        print(describe(hit))
+    if stops:
+        print(f'PC: {simulator.pc.cur_pc}')
+        print(f'RF: {simulator.rf.registers.tolist()}')
+    else:
+        print(f'finished at cycle {simulator.cycle}')
@@ -0,0 +1,233 @@
+import argparse
+import sys
+import time
+import types
+
+import numpy as np
+
+import batch
+import perf_counters
+import step_codegen
+from main import STEP_NAMESPACE, DataMem, SimConfig, Simulator
+
+MASK32 = 2**32 - 1
+
+
+def alu(operand1, operand2, alu_shamt, op_sel):
+    # main.alu() applied to whole int64 vectors; int64 holds both the signed
+    # and the unsigned form of every word the CAS produces
+    match op_sel:
+        case 0:  # add
+            result = operand1 + operand2
+        case 1:  # sub
+            result = operand1 - operand2
+        case 2:  # and
+            result = operand1 & operand2
+        case 3:  # or
+            result = operand1 | operand2
+        case 4:  # slt
+            result = np.less(operand1, operand2).astype(np.int64)
+        case 5:  # sgt
+            result = np.greater(operand1, operand2).astype(np.int64)
+        case 6:  # nor
+            result = ~(operand1 | operand2)
+        case 7:  # xor
+            result = operand1 ^ operand2
+        case 8:  # sll
+            result = operand2 << alu_shamt
+        case 9:  # srl
+            result = operand2 >> alu_shamt
+        case _:
+            result = np.zeros_like(operand1)
+    return result & MASK32
+
+
+def uniform(values):
+    return np.ndim(values) == 0 or bool((values == values[0]).all())
+
+
+def first(values):
+    # the value every instance agrees on, as a plain int
+    return int(np.ravel(values)[0])
+
+
+# globals of the vector step() generated by step_codegen
+VECTOR_NAMESPACE = {**STEP_NAMESPACE, 'alu': alu, 'uniform': uniform, 'first': first}
+
+
+class VectorRF:
+    # registers[reg_num] holds that register for every instance of a group
+    def __init__(self, registers):
+        self.registers = registers
+
+    def read_rf(self, reg_num):
+        # a copy, since the row is overwritten in place by later writes
+        return self.registers[reg_num].copy()
+
+    def write_rf(self, reg_num, write_data):
+        if reg_num != 0:
+            self.registers[reg_num] = write_data
+
+
+class VectorDataMem:
+    # data_mem_array[instance] is the data memory of one instance
+    def __init__(self, data_mem_array):
+        self.data_mem_array = data_mem_array
+        self.instances = np.arange(len(data_mem_array))
+
+    def read_dm(self, address):
+        return self.data_mem_array[self.instances, address]
+
+    def write_dm(self, address, data):
+        self.data_mem_array[self.instances, address] = data
+
+
+def select_state(source, target, mask):
+    # copies every latch of source into target, keeping only the instances
+    # selected by mask from the per-instance fields
+    for name in source.__slots__:
+        for source_latch, target_latch in zip(getattr(source, name), getattr(target, name)):
+            for field in source_latch.__slots__:
+                value = getattr(source_latch, field)
+                setattr(target_latch, field, value[mask] if np.ndim(value) else value)
+
+
+class LockstepGroup(Simulator):
+    # A set of instances that have taken the same path so far. Everything the
+    # control path depends on (PC, decoded instructions, stalls, forwarding
+    # selects, predictor, counters) is shared and kept as plain ints, exactly
+    # as in Simulator; only the datapath values are vectors with one entry per
+    # instance. Data reaches the control path in just two places, branch
+    # outcomes and jr targets, the Control nodes of step_codegen.datapath().
+    # step() is generated from that description with the vector backend: it
+    # returns None after a cycle, or, before any side effect that cannot be
+    # repeated, a per-instance key when the instances disagree on a Control
+    # value. The caller splits the group on it and steps again.
+    def __init__(self, instructions, members, registers, data_mem_array, config=None):
+        super().__init__(instructions=instructions, data=[], config=config)
+        self.members = members
+        self.rf = VectorRF(registers)
+        self.data_mem = VectorDataMem(data_mem_array)
+        self.attach_counters()
+        step = step_codegen.load_step(step_codegen.datapath(self.config.forwarding, self.width), VECTOR_NAMESPACE,
+                                      vector=True)
+        self.step = types.MethodType(step, self)
+
+    def split(self, mask):
+        # moves the instances selected by mask into a new group that continues
+        # from the same cycle
+        group = LockstepGroup([instruction.word for instruction in self.ins_mem.instructions],
+                              self.members[mask], self.rf.registers[:, mask], self.data_mem.data_mem_array[mask],
+                              self.config)
+        select_state(self.state, group.state, mask)
+        select_state(self.new_state, group.new_state, mask)
+        group.pc.cur_pc = self.pc.cur_pc
+        group.branch_predictor.load_state_words(self.branch_predictor.state_words())
+        group.counters.load_state_words(self.counters.state_words())
+        group.cycle = self.cycle
+        group.enable = self.enable
+        group.instruction_count = self.instruction_count
+        group.nop_count = self.nop_count
+
+        keep = ~mask
+        self.members = self.members[keep]
+        self.rf = VectorRF(self.rf.registers[:, keep])
+        self.data_mem = VectorDataMem(self.data_mem.data_mem_array[keep])
+        select_state(self.state, self.state, keep)
+        select_state(self.new_state, self.new_state, keep)
+        return group
+
+
+def run_lockstep(instructions, data_sets, config=None, max_cycles=None):
+    # Runs one instruction image over every data memory in data_sets and
+    # returns one batch.run_job()-style result per data set, in order. All
+    # instances start in one group; a group is split whenever its instances
+    # take different paths, and groups never merge again.
+    config = SimConfig() if config is None else config
+    start = time.monotonic()
+    data_mem_array = np.array([DataMem.to_array(data, config.data_mem_size) for data in data_sets], dtype=np.int64)
+    registers = np.zeros((32, len(data_sets)), dtype=np.int64)
+    groups = [LockstepGroup(instructions, np.arange(len(data_sets)), registers, data_mem_array, config)]
+    results = [None] * len(data_sets)
+
+    while groups:
+        group = groups.pop()
+        status = 'ok'
+        try:
+            while not group.finished:
+                if max_cycles is not None and group.cycle >= max_cycles:
+                    status = 'cycle limit'
+                    break
+                key = group.step()
+                if key is not None:
+                    for value in np.unique(key)[1:]:
+                        groups.append(group.split(key == value))
+        except Exception as e:
+            status = f'error: {e}'
+
+        stats = group.stats()
+        for idx, member in enumerate(group.members):
+            result = {'status': status}
+            if not status.startswith('error'):
+                result.update(cycles=stats.cycles,
+                              instructions=stats.instruction_count,
+                              ipc=stats.ipc,
+                              rf_md5=batch.words_md5(group.rf.registers[:, idx].tolist()),
+                              dm_md5=batch.words_md5(group.data_mem.data_mem_array[idx].tolist()))
+                result.update(zip(perf_counters.NAMES, group.counters.counts))
+            results[member] = result
+
+    seconds = round(time.monotonic() - start, 3)
+    for result in results:
+        result['seconds'] = seconds
+    return results
+
+
+def check(instructions, data_sets, results, config=None, max_cycles=None):
+    # differential check against one serial Simulator run per data set;
+    # returns the indices of the data sets whose results differ
+    mismatches = []
+    for idx, data in enumerate(data_sets):
+        simulator = Simulator(instructions=instructions, data=data, config=config)
+        simulator.attach_counters()
+        simulator.run(max_cycles)
+        stats = simulator.stats()
+        expected = {'cycles': stats.cycles,
+                    'instructions': stats.instruction_count,
+                    'rf_md5': batch.words_md5(simulator.rf.registers),
+                    'dm_md5': batch.words_md5(simulator.data_mem.data_mem_array)}
+        expected.update(zip(perf_counters.NAMES, simulator.counters.counts))
+        if any(results[idx].get(key) != value for key, value in expected.items()):
+            mismatches.append(idx)
+    return mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='run one program over many data memories in lockstep')
+    parser.add_argument('ins_mem', help='instruction image, one binary word per line')
+    parser.add_argument('data_mem', nargs='+', help='data memory images, one word per line')
+    parser.add_argument('-o', '--output', help='CSV file for the results (default: stdout)')
+    parser.add_argument('--max-cycles', type=int, help='per-instance cycle limit')
+    parser.add_argument('--check', action='store_true',
+                        help='also run every data set on the serial simulator and compare the results')
+    args = parser.parse_args()
+
+    instructions = batch.read_instructions(args.ins_mem)
+    data_sets = [DataMem.read_text(path) for path in args.data_mem]
+    results = run_lockstep(instructions, data_sets, max_cycles=args.max_cycles)
+    for path, result in zip(args.data_mem, results):
+        result['name'] = path
+
+    if args.output is None:
+        batch.write_table(results, sys.stdout)
+    else:
+        with open(args.output, 'w', newline='') as f:
+            batch.write_table(results, f)
+    if args.check:
+        mismatches = check(instructions, data_sets, results, max_cycles=args.max_cycles)
+        for idx in mismatches:
+            print(f'mismatch: {args.data_mem[idx]}', file=sys.stderr)
+        if mismatches:
+            sys.exit(1)
+    if any(result['status'] != 'ok' for result in results):
+        sys.exit(1)
@@ -1,8 +1,21 @@
+import argparse
 import logging
-import logging.handlers
-import queue
-import threading
-from copy import deepcopy
+import mmap
+import types
+from array import array
+from collections import namedtuple
+
+import branch_predictors
+import cas_trace
+import checkpoint
+import cycle_view
+import packed_pipes
+import perf_counters
+import pipeview
+import state_hash
+import step_codegen
+import time_travel
+from block_cache import BlockCache
 
 INS_MEM_SIZE = 256
 DATA_MEM_SIZE = 4096
@@ -10,45 +23,77 @@ DATA_MEM_READ = 50
 
 MAX_NOP_COUNT = 10
 
-# log_queue = queue.Queue()
-# queue_handler = logging.handlers.QueueHandler(log_queue)
+# EX-stage forwarding sources: MEM and WB of the first and second lane; later
+# lanes follow the second
+FORWARDING_PATHS = ('M1', 'M2', 'W1', 'W2')
+
 logger = logging.getLogger(__name__)
-# logger.addHandler(queue_handler)
 
 
-# def log_writer():
-#     with open('cas_out.txt', 'w', buffering=1024*1024) as f:
-#         while True:
-#             record = log_queue.get()
-#             if record is None:  # Exit signal
-#                 break
-#             f.write(record.getMessage() + "\n")
+class Instruction:
+    # Decoded once when the instruction memory is loaded; the pipeline only
+    # reads fields from it and never re-parses the binary string.
+    __slots__ = ('word', 'op_code', 'funct', 'rs', 'rt', 'rd', 'shamt', 'imm',
+                 'I_26', 'target', 'is_jr', 'control')
+
+    def __init__(self, word=0):
+        self.word = word
+        self.op_code = word >> 26
+        self.funct = word & 0x3f
+        self.rs = (word >> 21) & 0x1f
+        self.rt = (word >> 16) & 0x1f
+        self.rd = (word >> 11) & 0x1f
+        self.shamt = (word >> 6) & 0x1f
+        imm = word & 0xffff
+        self.imm = imm - 2 ** 16 if imm >> 15 else imm
+        self.I_26 = self.op_code & 1
+        # low 8 bits serve as both the branch offset and the jump target
+        self.target = word & 0xff
+        self.is_jr = self.op_code == 0x0 and self.funct == 0x8
+        self.control = cu(cu_op_code=self.op_code, cu_funct=self.funct, cu_stall=0)
 
+    def __copy__(self):
+        return self
 
-# thread = threading.Thread(target=log_writer, daemon=True)
-# thread.start()
+    def __deepcopy__(self, memo):
+        return self
 
-logfile_handler = logging.FileHandler("cas_out.txt", mode='w')
-logger.addHandler(logfile_handler)
+    def __str__(self):
+        return format(self.word, '032b')
 
 
 class MEM_WB:
+    __slots__ = ('pc_plus_2', 'reg_write', 'mem_to_reg', 'alu_result',
+                 'memory_read_data', 'write_register', 'instruction')
+
     def __init__(self):
+        self.reset()
+
+    def reset(self):
         self.pc_plus_2 = 0
         self.reg_write = 0
         self.mem_to_reg = 0
         self.alu_result = 0
         self.memory_read_data = 0
         self.write_register = 0
-        self.instruction = '00000000000000000000000000000000'
+        self.instruction = NOP
 
     def flush(self, flush):
-        if flush: 
-            self.__init__()
+        if flush:
+            self.reset()
 
 
 class EX_MEM:
+    __slots__ = ('pc', 'pc_plus_1', 'pc_plus_2', 'branch_adder_result',
+                 'reg_write', 'mem_to_reg', 'mem_write', 'mem_read', 'rs',
+                 'rt', 'branch', 'I_26', 'prediction', 'alu_result',
+                 'forward_A_mux_out', 'forward_B_mux_out', 'write_register',
+                 'instruction')
+
     def __init__(self):
+        self.reset()
+
+    def reset(self):
         self.pc = 0
         self.pc_plus_1 = 0
         self.pc_plus_2 = 0
@@ -66,15 +111,24 @@ class EX_MEM:
         self.forward_A_mux_out = 0
         self.forward_B_mux_out = 0
         self.write_register = 0
-        self.instruction = '00000000000000000000000000000000'
+        self.instruction = NOP
 
     def flush(self, flush):
-        if flush: 
-            self.__init__()
+        if flush:
+            self.reset()
 
 
 class ID_EX:
+    __slots__ = ('pc', 'pc_plus_1', 'pc_plus_2', 'branch_adder_result', 'I_26',
+                 'branch', 'mem_read', 'mem_write', 'mem_to_reg', 'reg_write',
+                 'alu_op', 'reg_dst', 'alu_src', 'read_data1', 'read_data2',
+                 'ext_imm', 'rs', 'rt', 'rd', 'shamt', 'prediction',
+                 'instruction')
+
     def __init__(self):
+        self.reset()
+
+    def reset(self):
         self.pc = 0
         self.pc_plus_1 = 0
         self.pc_plus_2 = 0
@@ -96,49 +150,66 @@ class ID_EX:
         self.rd = 0
         self.shamt = 0
         self.prediction = 0
-        self.instruction = '00000000000000000000000000000000'
+        self.instruction = NOP
+
+    def set_control(self, control):
+        self.branch = control.branch
+        self.mem_read = control.mem_read
+        self.mem_write = control.mem_write
+        self.mem_to_reg = control.mem_to_reg
+        self.reg_write = control.reg_write
+        self.alu_op = control.alu_op
+        self.reg_dst = control.reg_dst
+        self.alu_src = control.alu_src
 
     def flush(self, flush):
-        if flush: 
-            self.__init__()
+        if flush:
+            self.reset()
 
 
 class IF_ID:
+    # one lane of the fetched packet; only the first lane latches the PCs
+    __slots__ = ('pc', 'pc_plus_1', 'pc_plus_2', 'branch_adder_result',
+                 'prediction', 'instruction')
+
     def __init__(self):
+        self.reset()
+
+    def reset(self):
         self.pc = 0
         self.pc_plus_1 = 0
         self.pc_plus_2 = 0
-        self.branch_adder_result1 = 0
-        self.branch_adder_result2 = 0
-        self.prediction1 = 0
-        self.prediction2 = 0
-        self.instruction1 = '00000000000000000000000000000000'
-        self.instruction2 = '00000000000000000000000000000000'
+        self.branch_adder_result = 0
+        self.prediction = 0
+        self.instruction = NOP
 
     def flush(self, flush):
-        if flush: 
-            self.__init__()
+        if flush:
+            self.reset()
+
+    def copy_from(self, other):
+        for field in self.__slots__:
+            setattr(self, field, getattr(other, field))
 
 
 class State:
-    def __init__(self):
-        self.if_id = IF_ID()
-        self.id_ex1 = ID_EX()
-        self.id_ex2 = ID_EX()
-        self.ex_mem1 = EX_MEM()
-        self.ex_mem2 = EX_MEM()
-        self.mem_wb1 = MEM_WB()
-        self.mem_wb2 = MEM_WB()
+    # every pipe register as a list with one latch per issue lane
+    __slots__ = ('if_id', 'id_ex', 'ex_mem', 'mem_wb')
+
+    def __init__(self, width=2):
+        self.if_id = [IF_ID() for _ in range(width)]
+        self.id_ex = [ID_EX() for _ in range(width)]
+        self.ex_mem = [EX_MEM() for _ in range(width)]
+        self.mem_wb = [MEM_WB() for _ in range(width)]
 
     def print(self):
         pass
 
 
 class RF:
+    # int64 words, like DataMem, so views of the register file need no copy
     def __init__(self):
-        self.registers = []
-        for _ in range(32):
-            self.registers.append(0)
+        self.registers = array('q', [0] * 32)
 
     def read_rf(self, reg_num):
         return int(self.registers[reg_num])
@@ -147,56 +218,124 @@ class RF:
         if reg_num != 0:
             self.registers[reg_num] = write_data
 
-    def out_rf(self):
-        with open('rf_result.txt', 'w') as f:
+    def out_rf(self, path='rf_result.txt'):
+        with open(path, 'w') as f:
             for idx in range(32):
                 f.write(str(self.registers[idx]) + '\n')
 
     def print_rf(self):
-        logger.warning(f'RF: {self.registers}')
+        logger.warning(f'RF: {self.registers.tolist()}')
 
 
 class DataMem:
-    def __init__(self):
-        self.data_mem_array = []
-        self.init_dm()
-
-    def init_dm(self):
-        with open('data_mem.txt', 'r') as f:
-            read_data = f.readlines()
-        self.data_mem_array = list(map(int, read_data))
+    # Words are kept in a typed int64 array rather than 32-bit words: values
+    # loaded from the text image stay signed while ALU results stay unsigned,
+    # and both must round-trip unchanged. With image_path the array is a
+    # memory-mapped binary image, so persisting only writes the dirty pages.
+    def __init__(self, data=None, image_path=None, size=DATA_MEM_SIZE):
+        self.image = None
+        self.size = size
+        self.data_mem_array = array('q')
+        if image_path is not None and data is None:
+            self.map_image(image_path)
+        elif data is None:
+            self.init_dm()
+        else:
+            self.data_mem_array = self.to_array(data, size)
+            if image_path is not None:
+                self.write_image(image_path)
+                self.map_image(image_path)
+
+    @staticmethod
+    def to_array(data, size=DATA_MEM_SIZE):
+        words = array('q', data)
+        words.extend([0] * (size - len(words)))
+        return words
+
+    @staticmethod
+    def read_text(path='data_mem.txt'):
+        with open(path, 'r') as f:
+            return list(map(int, f.readlines()))
+
+    def init_dm(self, path='data_mem.txt'):
+        self.data_mem_array = self.to_array(self.read_text(path), self.size)
+
+    def write_image(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.data_mem_array.tobytes())
+
+    def map_image(self, path):
+        with open(path, 'r+b') as f:
+            self.image = mmap.mmap(f.fileno(), 0)
+        self.data_mem_array = memoryview(self.image).cast('q')
+
+    def sync(self):
+        # msync only writes back the pages touched since the last sync
+        if self.image is not None:
+            self.image.flush()
+
+    def close(self):
+        if self.image is not None:
+            data = self.data_mem_array.tolist()
+            self.data_mem_array.release()
+            self.image.close()
+            self.image = None
+            self.data_mem_array = array('q', data)
+
+    def persist(self):
+        if self.image is not None:
+            self.sync()
+        else:
+            self.dm_to_file()
 
     def read_dm(self, address):
         return self.data_mem_array[address]
     
     def print_dm(self):
-        logger.warning(f'DM: {self.data_mem_array[0:DATA_MEM_READ]}')
+        logger.warning(f'DM: {self.data_mem_array[0:DATA_MEM_READ].tolist()}')
 
     def write_dm(self, address, data):
         self.data_mem_array[address] = data
     
-    def dm_to_file(self):
-        with open('data_mem.txt', 'w') as file_handler:
-            for idx in range(DATA_MEM_SIZE):
+    def dm_to_file(self, path='data_mem.txt'):
+        with open(path, 'w') as file_handler:
+            for idx in range(len(self.data_mem_array)):
                 file_handler.write(str(self.data_mem_array[idx]) + '\n')
 
 
 class InsMem:
-    def __init__(self):
-        with open('ins_mem.txt', 'r') as f:
-            read_data = f.read().split('\n')
-        self.instructions = read_data
+    def __init__(self, instructions=None, size=INS_MEM_SIZE):
+        # instructions: 32-bit words or binary strings; read from ins_mem.txt
+        # when omitted
+        if instructions is None:
+            with open('ins_mem.txt', 'r') as f:
+                instructions = f.read().split()
+        self.instructions = self.decode(instructions, size)
+        # bumped on every change so translated blocks can be invalidated
+        self.version = 0
+
+    @staticmethod
+    def decode(lines, size=INS_MEM_SIZE):
+        instructions = [decode_instruction(int(line, 2) if isinstance(line, str) else line)
+                        for line in lines]
+        if any(instruction.word for instruction in instructions[size:]):
+            raise ValueError('program does not fit in instruction memory')
+        del instructions[size:]
+        instructions.extend([NOP] * (size - len(instructions)))
+        return instructions
 
     def get_instruction(self, address):
         return self.instructions[address]
 
+    def set_instruction(self, address, word):
+        self.instructions[address] = decode_instruction(word)
+        self.version += 1
+
     def get_offsets(self):
         offsets = {}
         for pc, instruction in enumerate(self.instructions):
-            op_code = instruction[:6]
-            op_code = hex(int(op_code, 2))
-            if op_code == '0x4' or op_code == '0x5':
-                offsets[str(pc)] = instruction[-8:]
+            if instruction.op_code == 0x4 or instruction.op_code == 0x5:
+                offsets[str(pc)] = format(instruction.target, '08b')
         return offsets
 
 
@@ -209,99 +348,63 @@ class PC:
 
 
 class HDU:
-    def __init__(
-            self, branch1M, branch2M, prediction_M1, prediction_M2, 
-            branch_taken1, branch_taken2, pc_src1, pc_src2):
-        self.branch1M = branch1M
-        self.branch2M = branch2M
-        self.prediction_M1 = prediction_M1
-        self.prediction_M2 = prediction_M2
-        self.branch_taken1 = branch_taken1
-        self.branch_taken2 = branch_taken2
-        self.pc_src1 = pc_src1
-        self.pc_src2 = pc_src2
-
-
-    @property
-    def flush_MEM2(self):
-        return (self.branch_taken1 ^ self.prediction_M1) & self.branch1M
+    # per lane: the branch and prediction in EX_MEM, the branch outcome and
+    # pc_src of the instruction in ID
+    def __init__(self, branch_M, prediction_M, branch_taken, pc_src):
+        self.branch_M = branch_M
+        self.prediction_M = prediction_M
+        self.branch_taken = branch_taken
+        self.pc_src = pc_src
+        self.mispredict = [(taken ^ prediction) & branch
+                           for branch, prediction, taken in zip(branch_M, prediction_M, branch_taken)]
 
     @property
     def flush_EX(self):
-        return (((self.branch_taken1 ^ self.prediction_M1) & self.branch1M) | 
-                ((self.branch_taken2 ^ self.prediction_M2) & self.branch2M))
-    
+        return any(self.mispredict)
+
     @property
     def flush_IF_ID(self):
-        return (((self.branch_taken1 ^ self.prediction_M1) & self.branch1M) | 
-                ((self.branch_taken2 ^ self.prediction_M2) & self.branch2M) | 
-                self.pc_src1 | self.pc_src2)
+        return any(self.mispredict) or any(self.pc_src)
+
+    def flush_ID_EX(self, lane):
+        # a jump squashes the younger lanes of its packet
+        return any(self.mispredict) or any(self.pc_src[:lane])
+
+    def flush_MEM_WB(self, lane):
+        # a mispredicted branch squashes the younger lanes of its packet
+        return any(self.mispredict[:lane])
 
 
 class BPU:
-    def __init__(self):
-        self.cpc_signal1 = 0
-        self.cpc_signal2 = 0
-        self.BHT = [1 for _ in range(INS_MEM_SIZE)]
-        self.BTB = [0 for _ in range(INS_MEM_SIZE)]
-        self.BTB_valid = [0] * INS_MEM_SIZE
+    # direction: a predictor from branch_predictors (bimodal by default),
+    # btb: a target buffer (one entry per PC by default)
+    def __init__(self, direction=None, btb=None):
+        self.direction = branch_predictors.Bimodal(INS_MEM_SIZE) if direction is None else direction
+        self.btb = branch_predictors.PerPCBTB(INS_MEM_SIZE) if btb is None else btb
 
     def predict(self, pc):
-        match self.BHT[pc]:
-            case 0:
-                return 0
-            case 1:
-                return 0
-            case 2:
-                return 1
-            case 3:
-                return 1
+        # Only PCs with a BTB entry can be predicted taken. A taken guess for
+        # a non-branch is never corrected, which aliasing predictors such as
+        # gshare would otherwise make; for the default bimodal/per-PC pair
+        # this changes nothing, since a counter only reaches taken together
+        # with its BTB entry.
+        if self.btb.lookup(pc) is None:
+            return 0
+        return self.direction.predict(pc)
 
     def update(self, pc, branch_taken, target):
-        match self.BHT[pc]:
-            case 0:
-                self.BHT[pc] = 1 if branch_taken else 0
-            case 1:
-                self.BHT[pc] = 2 if branch_taken else 0
-            case 2:
-                self.BHT[pc] = 3 if branch_taken else 1
-            case 3:
-                self.BHT[pc] = 3 if branch_taken else 2
-
+        self.direction.update(pc, branch_taken)
         if branch_taken:
-            self.BTB[pc] = target
-            self.BTB_valid[pc] = 1
-
-    def set_corrected_pc(
-            self, predictionM1, predictionM2, branch_taken1, branch_taken2,
-            pc_plus_1M1, pc_plus_2M1, branch_adder_resultM1,
-            branch_adder_resultM2, branchM1, branchM2
-        ):
-        self.cpc_signal1 = 0
-        self.cpc_signal2 = 0
-        self.corrected_pc1 = pc_plus_1M1
-        self.corrected_pc2 = pc_plus_2M1
-        
-        if branchM1:
-            if branch_taken1 and not predictionM1:
-                self.corrected_pc1 = branch_adder_resultM1
-                self.cpc_signal1 = 1
-            if not branch_taken1 and predictionM1:
-                self.corrected_pc1 = pc_plus_1M1
-                self.cpc_signal1 = 1
-
-        if branchM2:
-            if branch_taken2 and not predictionM2:
-                self.corrected_pc2 = branch_adder_resultM2
-                self.cpc_signal2 = 1
-            if not branch_taken2 and predictionM2:
-                self.corrected_pc2 = pc_plus_2M1
-                self.cpc_signal2 = 1
-        
-    @property
-    def cpc_signal(self):
-        return self.cpc_signal1 | self.cpc_signal2
-        
+            self.btb.update(pc, target)
+
+    def state_words(self):
+        return self.direction.state() + self.btb.state()
+
+    def load_state_words(self, words):
+        split = len(self.direction.state())
+        self.direction.load_state(words[:split])
+        self.btb.load_state(words[split:])
+
 
 def mux(sel, in1, in2, in3=None, in4=None, in5=None):
     if sel == 0:
@@ -346,7 +449,15 @@ def alu(operand1, operand2, alu_shamt, op_sel):
     return (result & (2**32 - 1)), _overflow, zero
 
 
-def cu(cu_op_code, cu_funct, cu_stall):
+ControlSignals = namedtuple(
+    'ControlSignals',
+    ['reg_dst', 'branch', 'mem_read', 'mem_to_reg', 'alu_op', 'mem_write',
+     'reg_write', 'alu_src', 'jump', 'pc_src'])
+
+STALL_SIGNALS = ControlSignals(*([0] * len(ControlSignals._fields)))
+
+
+def decode_control(cu_op_code, cu_funct):
     control_unit = {'reg_dst': 0,
                     'branch': 0,
                     'mem_read': 0,
@@ -357,11 +468,7 @@ def cu(cu_op_code, cu_funct, cu_stall):
                     'alu_src': 0,
                     'jump': 0,
                     'pc_src': 0}
-    if cu_stall:
-        return control_unit
-    cu_op_code = hex(int(cu_op_code, 2))
-    cu_funct = hex(int(cu_funct, 2))
-    if cu_op_code == '0x0':  # R-TYPE
+    if cu_op_code == 0x0:  # R-TYPE
         control_unit.update({'reg_dst': 1,
                              'branch': 0,
                              'mem_read': 0,
@@ -373,538 +480,910 @@ def cu(cu_op_code, cu_funct, cu_stall):
                              'jump': 0,
                              'pc_src': 0})
 
-        if cu_funct == '0x20':  # add
+        if cu_funct == 0x20:  # add
             control_unit.update({'alu_op': 0})
-        elif cu_funct == '0x22':  # sub
+        elif cu_funct == 0x22:  # sub
             control_unit.update({'alu_op': 1})
-        elif cu_funct == '0x24':  # and
+        elif cu_funct == 0x24:  # and
             control_unit.update({'alu_op': 2})
-        elif cu_funct == '0x25':  # or
+        elif cu_funct == 0x25:  # or
             control_unit.update({'alu_op': 3})
-        elif cu_funct == '0x2a':  # slt
+        elif cu_funct == 0x2a:  # slt
             control_unit.update({'alu_op': 4})
-        elif cu_funct == '0x14':  # sgt
+        elif cu_funct == 0x14:  # sgt
             control_unit.update({'alu_op': 5})
-        elif cu_funct == '0x27':  # nor
+        elif cu_funct == 0x27:  # nor
             control_unit.update({'alu_op': 6})
-        elif cu_funct == '0x15':  # xor
+        elif cu_funct == 0x15:  # xor
             control_unit.update({'alu_op': 7})
-        elif cu_funct == '0x0':  # sll
+        elif cu_funct == 0x0:  # sll
             control_unit.update({'alu_op': 8})
-        elif cu_funct == '0x2':  # srl
+        elif cu_funct == 0x2:  # srl
             control_unit.update({'alu_op': 9})
-        elif cu_funct == '0x8':  # jr
+        elif cu_funct == 0x8:  # jr
             control_unit.update({'pc_src': 1})
 
-    elif cu_op_code == '0x8':  # addi
+    elif cu_op_code == 0x8:  # addi
         control_unit.update({'reg_write': 1,
                              'alu_src': 1})
 
-    elif cu_op_code == '0x23':  # lw
+    elif cu_op_code == 0x23:  # lw
         control_unit.update({'mem_read': 1,
                              'mem_to_reg': 1,
                              'reg_write': 1,
                              'alu_src': 1})
 
-    elif cu_op_code == '0x2b':  # sw
+    elif cu_op_code == 0x2b:  # sw
         control_unit.update({'mem_write': 1,
                              'alu_src': 1})
 
-    elif cu_op_code == '0x4' or cu_op_code == '0x5':  # beq or bne
+    elif cu_op_code == 0x4 or cu_op_code == 0x5:  # beq or bne
         control_unit.update({'branch': 1,
                              'alu_op': 1})
 
-    elif cu_op_code == '0x3':  # jal
+    elif cu_op_code == 0x3:  # jal
         control_unit.update({'reg_dst': 2,
                              'mem_to_reg': 2,
                              'reg_write': 1,
                              'jump': 1,
                              'pc_src': 1})
 
-    elif cu_op_code == '0xd':  # ori
+    elif cu_op_code == 0xd:  # ori
         control_unit.update({'alu_op': 3,
                              'reg_write': 1,
                              'alu_src': 1})
 
-    elif cu_op_code == '0x16':  # xori
+    elif cu_op_code == 0x16:  # xori
         control_unit.update({'alu_op': 7,
                              'reg_write': 1,
                              'alu_src': 1})
 
-    elif cu_op_code == '0xc':  # andi
+    elif cu_op_code == 0xc:  # andi
         control_unit.update({'alu_op': 2,
                              'reg_write': 1,
                              'alu_src': 1})
 
-    elif cu_op_code == '0xa':  # slti
+    elif cu_op_code == 0xa:  # slti
         control_unit.update({'alu_op': 4,
                              'reg_write': 1,
                              'alu_src': 1})
 
-    elif cu_op_code == '0x2':  # j
+    elif cu_op_code == 0x2:  # j
         control_unit.update({'jump': 1,
                              'pc_src': 1})
 
-    return control_unit
-
-
-def forward(rs_E1, rt_E1, rs_E2, rt_E2, rs_M2, rt_M2, write_register_M1, 
-            write_register_M2, write_register_W1, write_register_W2, 
-            reg_write_M1, reg_write_M2, reg_write_W1, reg_write_W2, branch_M2):
-    forwardA1 = 0
-    forwardB1 = 0
-    forwardA2 = 0
-    forwardB2 = 0
-    forward_branch_A = 0
-    forward_branch_B = 0
-
-    if (reg_write_M1 and (write_register_M1 == rs_E1) and (write_register_M1 != 0)):
-        forwardA1 = 1
-    elif (reg_write_M2 and (write_register_M2 == rs_E1) and (write_register_M2 != 0) and (write_register_M1 != rs_E1)):
-        forwardA1 = 2
-    elif (reg_write_W1 and (write_register_W1 == rs_E1) and (write_register_W1 != 0) and
-            ((write_register_M1 != rs_E1 or not reg_write_M1) and (write_register_M2 != rs_E1 or not reg_write_M2))):
-        forwardA1 = 3
-    elif (reg_write_W2 and (write_register_W2 == rs_E1) and (write_register_W2 != 0) and
-            ((write_register_M1 != rs_E1 or not reg_write_M1) and (write_register_M2 != rs_E1 or not reg_write_M2)) and (write_register_M1 != rs_E1)):
-        forwardA1 = 4
-
-    if (reg_write_M1 and (write_register_M1 == rt_E1) and (write_register_M1 != 0)):
-        forwardB1 = 1
-    elif (reg_write_M2 and (write_register_M2 == rt_E1) and (write_register_M2 != 0) and (write_register_M1 != rt_E1)):
-        forwardB1 = 2
-    elif (reg_write_W1 and (write_register_W1 == rt_E1) and (write_register_W1 != 0) and
-            ((write_register_M1 != rt_E1 or not reg_write_M1) and (write_register_M2 != rt_E1 or not reg_write_M2))):
-        forwardB1 = 3
-    elif (reg_write_W2 and (write_register_W2 == rt_E1) and (write_register_W2 != 0) and
-            ((write_register_M1 != rt_E1 or not reg_write_M1) and (write_register_M2 != rt_E1 or not reg_write_M2)) and (write_register_M1 != rt_E1)):
-        forwardB1 = 4
-
-    if (reg_write_M1 and (write_register_M1 == rs_E2) and (write_register_M1 != 0)):
-        forwardA2 = 1
-    elif (reg_write_M2 and (write_register_M2 == rs_E2) and (write_register_M2 != 0) and (write_register_M1 != rs_E2)):
-        forwardA2 = 2
-    elif (reg_write_W1 and (write_register_W1 == rs_E2) and (write_register_W1 != 0) and
-            ((write_register_M1 != rs_E2 or not reg_write_M1) and (write_register_M2 != rs_E2 or not reg_write_M2))):
-        forwardA2 = 3
-    elif (reg_write_W2 and (write_register_W2 == rs_E2) and (write_register_W2 != 0) and
-            ((write_register_M1 != rs_E2 or not reg_write_M1) and (write_register_M2 != rs_E2 or not reg_write_M2)) and (write_register_M1 != rs_E2)):
-        forwardA2 = 4
-
-    if (reg_write_M1 and (write_register_M1 == rt_E2) and (write_register_M1 != 0)):
-        forwardB2 = 1
-    elif (reg_write_M2 and (write_register_M2 == rt_E2) and (write_register_M2 != 0) and (write_register_M1 != rt_E2)):
-        forwardB2 = 2
-    elif (reg_write_W1 and (write_register_W1 == rt_E2) and (write_register_W1 != 0) and
-            ((write_register_M1 != rt_E2 or not reg_write_M1) and (write_register_M2 != rt_E2 or not reg_write_M2))):
-        forwardB2 = 3
-    elif (reg_write_W2 and (write_register_W2 == rt_E2) and (write_register_W2 != 0) and
-            ((write_register_M1 != rt_E2 or not reg_write_M1) and (write_register_M2 != rt_E2 or not reg_write_M2)) and (write_register_M1 != rt_E2)):
-        forwardB2 = 4
-            
-    if(reg_write_M1 & branch_M2 and((write_register_M1 == rs_M2))):
-        forward_branch_A = 1
-    if(reg_write_M1 & branch_M2 and((write_register_M1 == rt_M2))):
-        forward_branch_B = 1
-
-    return {
-        'forwardA1': forwardA1,
-        'forwardB1': forwardB1,
-        'forwardA2': forwardA2,
-        'forwardB2': forwardB2,
-        'forward_branch_A': forward_branch_A,
-        'forward_branch_B': forward_branch_B,
-    }
-
-
-def hdu_stall(mem_read_E, write_register_E, rs_D, rt_D):
-    return (
-        mem_read_E 
-        and (write_register_E == rs_D or write_register_E == rt_D) 
-        and write_register_E != 0
-    )
-
-
-def main(): 
-    rf = RF()
-    state = State()
-    data_mem = DataMem()
-    ins_mem = InsMem()
-    pc = PC()
-    branch_predictor = BPU()
-
-    cycle = 0
-    enable = 1
+    return ControlSignals(**control_unit)
 
-    instruction_count = 0
-    nop_count = 0
-    
-    while True:
-        new_state = State()
-        # --------------------WB STAGE------------------ #
-        WB_data1 = WB_data2 = 0
-        if state.mem_wb1.reg_write == 1:
-            WB_data1 = mux(sel=state.mem_wb1.mem_to_reg,
-                           in1=state.mem_wb1.alu_result,
-                           in2=state.mem_wb1.memory_read_data,
-                           in3=(state.mem_wb1.pc_plus_2 - 1) & (INS_MEM_SIZE - 1))
-
-            rf.write_rf(reg_num=state.mem_wb1.write_register, write_data=WB_data1)
-        if state.mem_wb2.reg_write == 1:
-            WB_data2 = mux(sel=state.mem_wb2.mem_to_reg,
-                           in1=state.mem_wb2.alu_result,
-                           in2=state.mem_wb2.memory_read_data,
-                           in3=state.mem_wb1.pc_plus_2)
-
-            rf.write_rf(reg_num=state.mem_wb2.write_register, write_data=WB_data2)
 
-        # --------------------FORWARDING------------------ #
-        forward_signals = forward(rs_E1=state.id_ex1.rs, rt_E1=state.id_ex1.rt, 
-                                  rs_E2=state.id_ex2.rs, rt_E2=state.id_ex2.rt, 
-                                  rs_M2=state.ex_mem2.rs, rt_M2=state.ex_mem2.rt, 
-                                  write_register_M1=state.ex_mem1.write_register, 
-                                  write_register_M2=state.ex_mem2.write_register, 
-                                  write_register_W1=state.mem_wb1.write_register, 
-                                  write_register_W2=state.mem_wb2.write_register,
-                                  reg_write_M1=state.ex_mem1.reg_write, 
-                                  reg_write_M2=state.ex_mem2.reg_write, 
-                                  reg_write_W1=state.mem_wb1.reg_write, 
-                                  reg_write_W2=state.mem_wb2.reg_write, 
-                                  branch_M2=state.ex_mem2.branch)
+def build_cu_table():
+    # every (op_code, funct) pair maps to one shared, immutable record
+    records = {}
+    table = {}
+    for op_code in range(64):
+        for funct in range(64):
+            signals = decode_control(op_code, funct)
+            table[(op_code, funct)] = records.setdefault(signals, signals)
+    return table
 
-        # --------------------MEM STAGE------------------ #
-        if state.ex_mem1.mem_write:
-            data_mem.write_dm(address=state.ex_mem1.alu_result, data=state.ex_mem1.forward_B_mux_out)
-        elif state.ex_mem2.mem_write:
-            data_mem.write_dm(address=state.ex_mem2.alu_result, data=state.ex_mem2.forward_B_mux_out)
-        if state.ex_mem1.mem_read:
-            new_state.mem_wb1.memory_read_data = data_mem.read_dm(state.ex_mem1.alu_result)
-        if state.ex_mem2.mem_read:
-            new_state.mem_wb2.memory_read_data = data_mem.read_dm(state.ex_mem2.alu_result)
-
-        comp_source_mux_A2 = mux(sel=forward_signals.get('forward_branch_A'), 
-                                 in1=state.ex_mem2.forward_A_mux_out,
-                                 in2=state.ex_mem1.alu_result)
-        comp_source_mux_B2 = mux(sel=forward_signals.get('forward_branch_B'), 
-                                 in1=state.ex_mem2.forward_B_mux_out,
-                                 in2=state.ex_mem1.alu_result)
-
-        zero1 = state.ex_mem1.forward_A_mux_out == state.ex_mem1.forward_B_mux_out
-        zero2 = comp_source_mux_A2 == comp_source_mux_B2
-
-        branch_taken1 = state.ex_mem1.branch & ~(state.ex_mem1.I_26 ^ ~zero1)
-        branch_taken2 = state.ex_mem2.branch & ~(state.ex_mem2.I_26 ^ ~zero2)
-
-        if state.ex_mem1.branch:
-            branch_predictor.update(pc=state.ex_mem1.pc, branch_taken=branch_taken1, target=state.ex_mem1.branch_adder_result)
-        if state.ex_mem2.branch:
-            branch_predictor.update(pc=state.ex_mem1.pc_plus_1, branch_taken=branch_taken2, target=state.ex_mem2.branch_adder_result)
-
-        branch_predictor.set_corrected_pc(
-            predictionM1=state.ex_mem1.prediction,
-            predictionM2=state.ex_mem2.prediction,
-            branch_taken1=branch_taken1,
-            branch_taken2=branch_taken2,
-            pc_plus_1M1=state.ex_mem1.pc_plus_1,
-            pc_plus_2M1=state.ex_mem1.pc_plus_2,
-            branch_adder_resultM1=state.ex_mem1.branch_adder_result,
-            branch_adder_resultM2=state.ex_mem2.branch_adder_result,
-            branchM1=state.ex_mem1.branch,
-            branchM2=state.ex_mem2.branch
-        )
-
-        new_state.mem_wb1.reg_write = state.ex_mem1.reg_write
-        new_state.mem_wb1.mem_to_reg = state.ex_mem1.mem_to_reg
-        new_state.mem_wb1.alu_result = state.ex_mem1.alu_result
-        new_state.mem_wb1.write_register = state.ex_mem1.write_register
-        new_state.mem_wb1.instruction = state.ex_mem1.instruction
-        new_state.mem_wb1.pc_plus_2 = state.ex_mem1.pc_plus_2
-
-        new_state.mem_wb2.reg_write = state.ex_mem2.reg_write
-        new_state.mem_wb2.mem_to_reg = state.ex_mem2.mem_to_reg
-        new_state.mem_wb2.alu_result = state.ex_mem2.alu_result
-        new_state.mem_wb2.write_register = state.ex_mem2.write_register
-        new_state.mem_wb2.instruction = state.ex_mem2.instruction
 
-        # --------------------EX STAGE------------------ #
-        forward_mux_A1_out = mux(sel=forward_signals.get('forwardA1'),
-                                 in1=state.id_ex1.read_data1,
-                                 in2=state.ex_mem1.alu_result,
-                                 in3=state.ex_mem2.alu_result,
-                                 in4=WB_data1,
-                                 in5=WB_data2)
-        forward_mux_B1_out = mux(sel=forward_signals.get('forwardB1'),
-                                 in1=state.id_ex1.read_data2,
-                                 in2=state.ex_mem1.alu_result,
-                                 in3=state.ex_mem2.alu_result,
-                                 in4=WB_data1,
-                                 in5=WB_data2)
-        
-        forward_mux_A2_out = mux(sel=forward_signals.get('forwardA2'),
-                                 in1=state.id_ex2.read_data1,
-                                 in2=state.ex_mem1.alu_result,
-                                 in3=state.ex_mem2.alu_result,
-                                 in4=WB_data1,
-                                 in5=WB_data2)
-        forward_mux_B2_out = mux(sel=forward_signals.get('forwardB2'),
-                                 in1=state.id_ex2.read_data2,
-                                 in2=state.ex_mem1.alu_result,
-                                 in3=state.ex_mem2.alu_result,
-                                 in4=WB_data1,
-                                 in5=WB_data2)
-
-        alu_mux1 = mux(sel=state.id_ex1.alu_src,
-                       in1=forward_mux_B1_out,
-                       in2=state.id_ex1.ext_imm)
-        
-        alu_mux2 = mux(sel=state.id_ex2.alu_src,
-                       in1=forward_mux_B2_out,
-                       in2=state.id_ex2.ext_imm)
-
-        alu_result1, _, _ = alu(operand1=forward_mux_A1_out,
-                                operand2=alu_mux1,
-                                alu_shamt=state.id_ex1.shamt,
-                                op_sel=state.id_ex1.alu_op)
-        
-        alu_result2, _, _ = alu(operand1=forward_mux_A2_out,
-                                operand2=alu_mux2,
-                                alu_shamt=state.id_ex2.shamt,
-                                op_sel=state.id_ex2.alu_op)
-
-        reg_dst_mux1 = mux(sel=state.id_ex1.reg_dst,
-                           in1=state.id_ex1.rt,
-                           in2=state.id_ex1.rd,
-                           in3=31)
-        
-        reg_dst_mux2 = mux(sel=state.id_ex2.reg_dst,
-                           in1=state.id_ex2.rt,
-                           in2=state.id_ex2.rd,
-                           in3=31)
-
-        new_state.ex_mem1.pc = state.id_ex1.pc
-        new_state.ex_mem1.pc_plus_1 = state.id_ex1.pc_plus_1
-        new_state.ex_mem1.pc_plus_2 = state.id_ex1.pc_plus_2
-        new_state.ex_mem1.branch_adder_result = state.id_ex1.branch_adder_result
-        new_state.ex_mem1.reg_write = state.id_ex1.reg_write
-        new_state.ex_mem1.mem_to_reg = state.id_ex1.mem_to_reg
-        new_state.ex_mem1.mem_write = state.id_ex1.mem_write
-        new_state.ex_mem1.mem_read = state.id_ex1.mem_read
-        new_state.ex_mem1.branch = state.id_ex1.branch
-        new_state.ex_mem1.I_26 = state.id_ex1.I_26
-        new_state.ex_mem1.prediction = state.id_ex1.prediction
-        new_state.ex_mem1.alu_result = alu_result1
-        new_state.ex_mem1.forward_B_mux_out = forward_mux_B1_out
-        new_state.ex_mem1.forward_A_mux_out = forward_mux_A1_out
-        new_state.ex_mem1.write_register = reg_dst_mux1
-        new_state.ex_mem1.instruction = state.id_ex1.instruction
-
-        new_state.ex_mem2.branch_adder_result = state.id_ex2.branch_adder_result
-        new_state.ex_mem2.reg_write = state.id_ex2.reg_write
-        new_state.ex_mem2.mem_to_reg = state.id_ex2.mem_to_reg
-        new_state.ex_mem2.mem_write = state.id_ex2.mem_write
-        new_state.ex_mem2.mem_read = state.id_ex2.mem_read
-        new_state.ex_mem2.rs = state.id_ex2.rs
-        new_state.ex_mem2.rt = state.id_ex2.rt
-        new_state.ex_mem2.branch = state.id_ex2.branch
-        new_state.ex_mem2.I_26 = state.id_ex2.I_26
-        new_state.ex_mem2.prediction = state.id_ex2.prediction
-        new_state.ex_mem2.alu_result = alu_result2
-        new_state.ex_mem2.forward_B_mux_out = forward_mux_B2_out
-        new_state.ex_mem2.forward_A_mux_out = forward_mux_A2_out
-        new_state.ex_mem2.write_register = reg_dst_mux2
-        new_state.ex_mem2.instruction = state.id_ex2.instruction
+CU_TABLE = build_cu_table()
 
-        # --------------------ID STAGE------------------ #
-        op_code1 = state.if_id.instruction1[:6]
-        funct1 = state.if_id.instruction1[-6:]
-        rs1 = int(state.if_id.instruction1[6:11], 2)
-        rt1 = int(state.if_id.instruction1[11:16], 2)
-        rd1 = int(state.if_id.instruction1[16:21], 2)
-        shamt1 = int(state.if_id.instruction1[21:26], 2)
-        imm1 = int(state.if_id.instruction1[-16:], 2)
-        if imm1 >> 15 == 1:
-            imm1 = imm1 - 2 ** 16
-        I_26_1 = int(op_code1[-1])
-
-        op_code2 = state.if_id.instruction2[:6]
-        funct2 = state.if_id.instruction2[-6:]
-        rs2 = int(state.if_id.instruction2[6:11], 2)
-        rt2 = int(state.if_id.instruction2[11:16], 2)
-        rd2 = int(state.if_id.instruction2[16:21], 2)
-        shamt2 = int(state.if_id.instruction2[21:26], 2)
-        imm2 = int(state.if_id.instruction2[-16:], 2)
-        if imm2 >> 15 == 1:
-            imm2 = imm2 - 2 ** 16
-        I_26_2 = int(op_code2[-1])
-
-        stall = (
-            hdu_stall(state.id_ex1.mem_read, reg_dst_mux1, rs1, rt1) or 
-            hdu_stall(state.id_ex2.mem_read, reg_dst_mux2, rs1, rt1) or 
-            hdu_stall(state.id_ex1.mem_read, reg_dst_mux1, rs2, rt2) or 
-            hdu_stall(state.id_ex2.mem_read, reg_dst_mux2, rs2, rt2)
-        )
-
-        jr_stall = (op_code1 == '000000' and funct1 == '001000') and (reg_dst_mux1 == rs1 and reg_dst_mux1 != 0 or reg_dst_mux2 == rs1 and reg_dst_mux2 != 0)
-        jr_stall = jr_stall or ((op_code2 == '000000' and funct2 == '001000') and (reg_dst_mux1 == rs2 and reg_dst_mux1 != 0 or reg_dst_mux2 == rs2 and reg_dst_mux2 != 0))
-        jr_stall = jr_stall or ((op_code1 == '000000' and funct1 == '001000') and (state.ex_mem1.write_register == rs1 and state.ex_mem1.write_register != 0 or state.ex_mem2.write_register == rs1 and state.ex_mem2.write_register != 0))
-        jr_stall = jr_stall or ((op_code2 == '000000' and funct2 == '001000') and (state.ex_mem1.write_register == rs2 and state.ex_mem1.write_register != 0 or state.ex_mem2.write_register == rs2 and state.ex_mem2.write_register != 0))
-
-        stall = stall or jr_stall
-
-        control_signals1 = cu(cu_op_code=op_code1, cu_funct=funct1, cu_stall=stall)
-        control_signals2 = cu(cu_op_code=op_code2, cu_funct=funct2, cu_stall=stall)
-
-        read_data1 = rf.read_rf(rs1)
-        read_data2 = rf.read_rf(rt1)
-
-        read_data3 = rf.read_rf(rs2)
-        read_data4 = rf.read_rf(rt2)
-        
-        new_state.id_ex1.branch_adder_result = state.if_id.branch_adder_result1
-        new_state.id_ex1.I_26 = I_26_1
-        new_state.id_ex1.branch = control_signals1.get('branch')
-        new_state.id_ex1.mem_read = control_signals1.get('mem_read')
-        new_state.id_ex1.mem_write = control_signals1.get('mem_write')
-        new_state.id_ex1.mem_to_reg = control_signals1.get('mem_to_reg')
-        new_state.id_ex1.reg_write = control_signals1.get('reg_write')
-        new_state.id_ex1.alu_op = control_signals1.get('alu_op')
-        new_state.id_ex1.reg_dst = control_signals1.get('reg_dst')
-        new_state.id_ex1.alu_src = control_signals1.get('alu_src')
-        new_state.id_ex1.read_data1 = read_data1
-        new_state.id_ex1.read_data2 = read_data2
-        new_state.id_ex1.ext_imm = imm1
-        new_state.id_ex1.rs = rs1
-        new_state.id_ex1.rt = rt1
-        new_state.id_ex1.rd = rd1
-        new_state.id_ex1.shamt = shamt1
-        new_state.id_ex1.prediction = state.if_id.prediction1
-        new_state.id_ex1.instruction = state.if_id.instruction1
-        new_state.id_ex1.pc = state.if_id.pc
-        new_state.id_ex1.pc_plus_1 = state.if_id.pc_plus_1
-        new_state.id_ex1.pc_plus_2 = state.if_id.pc_plus_2
-
-        new_state.id_ex2.branch_adder_result = state.if_id.branch_adder_result2
-        new_state.id_ex2.I_26 = I_26_2
-        new_state.id_ex2.branch = control_signals2.get('branch')
-        new_state.id_ex2.mem_read = control_signals2.get('mem_read')
-        new_state.id_ex2.mem_write = control_signals2.get('mem_write')
-        new_state.id_ex2.mem_to_reg = control_signals2.get('mem_to_reg')
-        new_state.id_ex2.reg_write = control_signals2.get('reg_write')
-        new_state.id_ex2.alu_op = control_signals2.get('alu_op')
-        new_state.id_ex2.reg_dst = control_signals2.get('reg_dst')
-        new_state.id_ex2.alu_src = control_signals2.get('alu_src')
-        new_state.id_ex2.read_data1 = read_data3
-        new_state.id_ex2.read_data2 = read_data4
-        new_state.id_ex2.ext_imm = imm2
-        new_state.id_ex2.rs = rs2
-        new_state.id_ex2.rt = rt2
-        new_state.id_ex2.rd = rd2
-        new_state.id_ex2.shamt = shamt2
-        new_state.id_ex2.prediction = state.if_id.prediction2
-        new_state.id_ex2.instruction = state.if_id.instruction2
 
-        # --------------------IF STAGE------------------ #
-        pc_plus_1 = (pc.cur_pc + 1) & (INS_MEM_SIZE - 1)
-
-        prediction1 = branch_predictor.predict(pc=pc.cur_pc)
-        prediction2 = branch_predictor.predict(pc=pc_plus_1)
-
-        instruction1 = ins_mem.get_instruction(address=pc.cur_pc)
+def cu(cu_op_code, cu_funct, cu_stall):
+    if cu_stall:
+        return STALL_SIGNALS
+    return CU_TABLE[(cu_op_code, cu_funct)]
+
+
+NOP = Instruction()
+DECODED_INSTRUCTIONS = {0: NOP}
+
+
+def decode_instruction(word):
+    # identical words share one record
+    instruction = DECODED_INSTRUCTIONS.get(word)
+    if instruction is None:
+        instruction = DECODED_INSTRUCTIONS[word] = Instruction(word)
+    return instruction
+
+
+# one-hot register masks; register 0 maps to 0 since it is never forwarded
+# and never causes a stall
+REG_BIT = [0] + [1 << reg_num for reg_num in range(1, 32)]
+
+
+def written_register(instruction):
+    # REG_BIT of the register an instruction writes, 0 if none
+    control = instruction.control
+    if not control.reg_write:
+        return 0
+    return REG_BIT[mux(sel=control.reg_dst, in1=instruction.rt, in2=instruction.rd, in3=31)]
+
+
+def splits(instruction, earlier):
+    # Lanes past the second end the packet when they could not run alongside
+    # the earlier lanes: the RTL pair relies on the program being scheduled
+    # for two lanes, and the only path inside a packet is the lane 2 branch
+    # comparator. A split lane is fetched again next cycle as lane 1. The RTL
+    # has no third lane, so these rules are the model's own.
+    reads = REG_BIT[instruction.rs] | REG_BIT[instruction.rt]
+    writes = written_register(instruction)
+    control = instruction.control
+    for other in earlier:
+        other_control = other.control
+        if other_control.pc_src:
+            return True
+        if written_register(other) & (reads | writes):
+            return True
+        if control.mem_write and (other_control.mem_write or other_control.mem_read):
+            return True
+        if control.mem_read and other_control.mem_write:
+            return True
+        if control.branch and other_control.branch:
+            return True
+    return False
+
+
+class ForwardingUnit:
+    # Each stage is reduced to a bitmask of the register it writes, so every
+    # forwarding select and stall condition is a couple of mask intersections
+    # instead of chains of register compares. The sources are every MEM lane,
+    # then every WB lane: select 0 is the register file and select i the
+    # (i-1)th source, so two lanes give the RTL's M1, M2, W1, W2 = 1..4.
+    # Paths missing from `paths` are never needed: stall() holds the consumer
+    # in ID until the value can come from an enabled path or the register
+    # file. Lanes past the second follow the second lane's entry in `paths`.
+    __slots__ = ('width', 'forward_A', 'forward_B', 'forward_branch_A', 'forward_branch_B', 'dst_M',
+                 'written_M', 'no_M', 'no_W', 'checks_paths')
+
+    def __init__(self, width=2, paths=FORWARDING_PATHS):
+        self.width = width
+        self.forward_A = [0] * width
+        self.forward_B = [0] * width
+        # per lane: the older MEM lane the branch comparator takes rs/rt from
+        self.forward_branch_A = [None] * width
+        self.forward_branch_B = [None] * width
+        self.dst_M = 0
+        self.written_M = [0] * width
+        self.no_M = [f'M{min(lane, 1) + 1}' not in paths for lane in range(width)]
+        self.no_W = [f'W{min(lane, 1) + 1}' not in paths for lane in range(width)]
+        self.checks_paths = any(self.no_M) or any(self.no_W)
+
+    def forward(self, state):
+        ex_mem = state.ex_mem
+        written_M = self.written_M
+        dst_M = 0
+        for lane, latch in enumerate(ex_mem):
+            dst = REG_BIT[latch.write_register]
+            dst_M |= dst
+            written_M[lane] = dst if latch.reg_write else 0
+        self.dst_M = dst_M
+
+        # Earlier sources take priority. With two lanes, M2 and W2 are also
+        # blocked by the lane 1 MEM destination even when it does not write,
+        # as in the RTL. A stall bubble carries its instruction's rt there,
+        # which at other widths would land on live values that programs
+        # scheduled for two lanes never put in its way. Every source writes
+        # at most one register, so `selects` maps its REG_BIT to the select.
+        blocked = REG_BIT[ex_mem[0].write_register] if self.width == 2 else 0
+        selects = {}
+        higher = 0
+        idx = 1
+        for written in written_M:
+            if written & ~higher and not (idx == 2 and written & blocked):
+                selects[written] = idx
+            higher |= written
+            idx += 1
+        for lane, latch in enumerate(state.mem_wb):
+            written = REG_BIT[latch.write_register] if latch.reg_write else 0
+            if written & ~higher and not (lane == 1 and written & blocked):
+                selects[written] = idx
+            higher |= written
+            idx += 1
+
+        forward_A = self.forward_A
+        forward_B = self.forward_B
+        for lane, latch in enumerate(state.id_ex):
+            forward_A[lane] = selects.get(REG_BIT[latch.rs], 0)
+            forward_B[lane] = selects.get(REG_BIT[latch.rt], 0)
+
+        # the branch comparator path does match register 0; the selects are
+        # only set for branch lanes, the only ones that read them
+        for lane, latch in enumerate(ex_mem):
+            if latch.branch:
+                source_A = source_B = None
+                for older in range(lane):
+                    if ex_mem[older].reg_write:
+                        if ex_mem[older].write_register == latch.rs:
+                            source_A = older
+                        if ex_mem[older].write_register == latch.rt:
+                            source_B = older
+                self.forward_branch_A[lane] = source_A
+                self.forward_branch_B[lane] = source_B
+
+    def stall(self, id_ex, write_registers_E, decoded):
+        dst_E = [REG_BIT[write_register] for write_register in write_registers_E]
+        reads = 0
+        jr_D = 0
+        for instruction in decoded:
+            reads |= REG_BIT[instruction.rs] | REG_BIT[instruction.rt]
+            if instruction.is_jr:
+                jr_D |= REG_BIT[instruction.rs]
+
+        # load-use: a load in EX writes a register read in ID
+        loads_E = 0
+        any_E = 0
+        for dst, latch in zip(dst_E, id_ex):
+            if latch.mem_read:
+                loads_E |= dst
+            any_E |= dst
+        if loads_E & reads:
+            return perf_counters.LOAD_USE_STALL
+
+        # jr reads its target in ID, so it waits for any EX or MEM destination
+        if jr_D & (any_E | self.dst_M):
+            return perf_counters.JR_STALL
+
+        # EX producers reach the consumer through M next cycle, MEM producers
+        # through W
+        if self.checks_paths:
+            waits = 0
+            for lane, latch in enumerate(id_ex):
+                if latch.reg_write and self.no_M[lane]:
+                    waits |= dst_E[lane]
+                if self.no_W[lane]:
+                    waits |= self.written_M[lane]
+            if waits & reads:
+                return perf_counters.FORWARD_STALL
+        return 0
+
+
+# globals of the step() generated by step_codegen
+STEP_NAMESPACE = {'NOP': NOP, 'STALL_SIGNALS': STALL_SIGNALS, 'HDU': HDU, 'REG_BIT': REG_BIT, 'logger': logger,
+                  'splits': splits, 'LOAD_USE_STALL': perf_counters.LOAD_USE_STALL,
+                  'JR_STALL': perf_counters.JR_STALL, 'FORWARD_STALL': perf_counters.FORWARD_STALL}
+
+SimStats = namedtuple('SimStats', ['cycles', 'instruction_count', 'ipc'])
+
+# Microarchitecture parameters; the defaults are the RTL design. predictor
+# is a branch_predictors.make_predictor() spec, btb_entries None means one
+# BTB entry per PC, forwarding lists the enabled FORWARDING_PATHS, width is
+# the number of issue lanes.
+SimConfig = namedtuple('SimConfig', ['ins_mem_size', 'data_mem_size', 'bht_initial', 'predictor',
+                                     'btb_entries', 'forwarding', 'width'],
+                       defaults=[INS_MEM_SIZE, DATA_MEM_SIZE, 1, 'bimodal', None, FORWARDING_PATHS, 2])
+
+
+class Simulator:
+    # Superscalar pipeline model that can be driven in-process. Instruction
+    # and data images are given as lists of words; when omitted they are read
+    # from ins_mem.txt / data_mem.txt. Nothing is written to disk unless
+    # dump_interval is set (log the PC and persist data memory every that many
+    # cycles) or the caller asks for it. dm_image backs data memory with a
+    # memory-mapped binary image file. config is a SimConfig;
+    # branch_predictor replaces the BPU it describes.
+    #
+    # Every latch is a list of lanes and each stage is one loop over them.
+    # Two lanes are the RTL design; its lane asymmetries generalise as "lane
+    # k behaves as lane 2 does":
+    #   - lane k fetches from the BTB target after a predicted-taken lane k-1;
+    #   - lane k updates the BPU for packet PC + k - 1;
+    #   - only lane 1 latches the PCs, and jal in lane k links to packet PC + k;
+    #   - the first storing lane writes memory;
+    #   - a mispredict in lane j flushes the MEM_WB lanes after j;
+    #   - a jump in lane j flushes the ID_EX lanes after j;
+    #   - the youngest jump or misprediction picks the next PC.
+    # Lanes past the second also split the packet (see splits()), so a
+    # program scheduled for two lanes computes the same result at any width.
+    def __init__(self, instructions=None, data=None, dump_interval=None, dm_image=None,
+                 config=None, branch_predictor=None):
+        self.config = SimConfig() if config is None else config
+        # branch offsets are 8-bit and wrap modulo 256, which only works for
+        # power-of-two sizes up to 256
+        size = self.config.ins_mem_size
+        if size & (size - 1) or not 0 < size <= 256:
+            raise ValueError('ins_mem_size must be a power of two no larger than 256')
+        self.pc_mask = self.config.ins_mem_size - 1
+        self.width = self.config.width
+        if self.width < 1:
+            raise ValueError('width must be at least 1')
+        self.rf = RF()
+        self.data_mem = DataMem(data, image_path=dm_image, size=self.config.data_mem_size)
+        self.ins_mem = InsMem(instructions, size=self.config.ins_mem_size)
+        self.pc = PC()
+        if branch_predictor is None:
+            branch_predictor = BPU(
+                direction=branch_predictors.make_predictor(self.config.predictor, self.config.ins_mem_size,
+                                                           self.config.bht_initial),
+                btb=branch_predictors.make_btb(self.config.btb_entries, self.config.ins_mem_size))
+        self.branch_predictor = branch_predictor
+        self.forwarding_unit = ForwardingUnit(self.width, self.config.forwarding)
+        # Two latch banks: the current cycle reads `state` and writes
+        # `new_state`, then they are swapped instead of copied.
+        self.state = State(self.width)
+        self.new_state = State(self.width)
+        self.dump_interval = dump_interval
+        self.tracer = None
+        self.state_hash = None
+        self.hash_interval = None
+        self.time_travel = None
+        self.pipeview = None
+        self.pipe_dump = None
+        self.counters = None
+
+        self.cycle = 0
+        self.enable = 1
+        self.instruction_count = 0
+        self.nop_count = 0
 
-        inst2_address = (
-            branch_predictor.BTB[(pc.cur_pc)]
-            if prediction1 and branch_predictor.BTB_valid[(pc.cur_pc)]
-            else pc_plus_1
-        )
-        instruction2 = ins_mem.get_instruction(address=inst2_address)
+    @property
+    def finished(self):
+        # MAX_NOP_COUNT NOP lanes are five cycles of fetch at two lanes, which
+        # lets the last instruction write back; every width waits as long
+        return self.nop_count * 2 >= MAX_NOP_COUNT * self.width
+
+    def stats(self):
+        cycles = self.cycle - MAX_NOP_COUNT / 2 if self.finished else self.cycle
+        return SimStats(cycles=self.cycle,
+                        instruction_count=self.instruction_count,
+                        ipc=self.instruction_count / cycles if cycles > 0 else 0.0)
+
+    def run(self, max_cycles=None):
+        # runs until the program ends or max_cycles more cycles have passed
+        if max_cycles is None:
+            while not self.finished:
+                self.step()
+        else:
+            for _ in range(max_cycles):
+                if self.finished:
+                    break
+                self.step()
+        return self.stats()
+
+    def cycles(self, max_cycles=None):
+        # runs like run(), yielding a zero-copy view of every cycle; see
+        # cycle_view.py
+        return cycle_view.cycles(self, max_cycles)
+
+    def attach_tracer(self, tracer):
+        # per-cycle binary tracing, see cas_trace.py
+        tracer.attach(self.rf, self.data_mem, DATA_MEM_READ, self.width)
+        self.tracer = tracer
+
+    def attach_pipeview(self, path):
+        # streams a Konata pipeline log of every instruction; see pipeview.py
+        self.pipeview = pipeview.PipeView(path)
+        self.pipeview.attach(self)
+        return self.pipeview
+
+    def attach_pipe_dump(self, path):
+        # writes every pipe register as packed in processor.v after every
+        # cycle; see packed_pipes.py
+        self.pipe_dump = packed_pipes.PipeDump(path)
+        self.pipe_dump.attach(self)
+        return self.pipe_dump
+
+    def attach_counters(self):
+        # per-cycle CPI stack counters, see perf_counters.py; runs without
+        # them skip record_cycle() entirely
+        self.counters = perf_counters.PerfCounters(self.width)
+        return self.counters
+
+    def attach_state_hash(self, interval):
+        # logs a digest of PC, RF and DM every `interval` cycles; see state_hash.py
+        self.state_hash = state_hash.StateHash(self.rf, self.data_mem)
+        self.state_hash.attach()
+        self.hash_interval = interval
+
+    def attach_time_travel(self, interval=10000, capacity=64):
+        # periodic in-memory snapshots for goto(cycle) and last-write queries;
+        # see time_travel.py
+        self.time_travel = time_travel.TimeTravel(self, decode_instruction, interval, capacity)
+        self.time_travel.attach()
+        return self.time_travel
+
+    def use_generated_step(self, cache_dir=step_codegen.CACHE_DIR):
+        # replaces step() with the flattened version generated from
+        # step_codegen.datapath(); check_step.py compares the two
+        step = step_codegen.load_step(step_codegen.datapath(self.config.forwarding, self.width), STEP_NAMESPACE,
+                                      cache_dir)
+        self.step = types.MethodType(step, self)
+
+    def fetch_addresses(self, if_id):
+        # the address each lane of a packet in IF_ID was fetched from, as the
+        # IF stage chose them; lanes cut off by a split hold a NOP
+        pc_mask = self.pc_mask
+        cur_pc = if_id[0].pc
+        addresses = [cur_pc]
+        address = lookup_pc = cur_pc
+        for lane in range(1, len(if_id)):
+            target = self.branch_predictor.btb.lookup(lookup_pc) if if_id[lane - 1].prediction else None
+            address = (address + 1) & pc_mask if target is None else target
+            lookup_pc = address if lane > 1 else (cur_pc + 1) & pc_mask
+            addresses.append(address)
+        return addresses
+
+    def save_checkpoint(self, path):
+        checkpoint.save_checkpoint(path, self.state, self.rf, self.data_mem, self.pc, self.branch_predictor,
+                                   self.counters, self.cycle, self.instruction_count, self.nop_count)
+
+    def load_checkpoint(self, path):
+        self.cycle, self.instruction_count, self.nop_count = checkpoint.load_checkpoint(
+            path, self.state, self.rf, self.data_mem, self.pc, self.branch_predictor, self.counters,
+            decode=decode_instruction)
+        if self.state_hash is not None:
+            self.state_hash.reset()
+
+    def step(self):
+        rf = self.rf
+        state = self.state
+        new_state = self.new_state
+        data_mem = self.data_mem
+        ins_mem = self.ins_mem
+        pc = self.pc
+        branch_predictor = self.branch_predictor
+        forwarding_unit = self.forwarding_unit
+        cycle = self.cycle
+        enable = self.enable
+        instruction_count = self.instruction_count
+        nop_count = self.nop_count
+        pc_mask = self.pc_mask
+        width = self.width
 
-        pc_plus_2 = (pc.cur_pc + 2) & (INS_MEM_SIZE - 1)
-        branch_adder_result1 = (pc_plus_1 + int(instruction1[-8:], 2)) & (INS_MEM_SIZE - 1)
-        branch_adder_result2 = (pc_plus_2 + int(instruction2[-8:], 2)) & (INS_MEM_SIZE - 1)
+        # --------------------WB STAGE------------------ #
+        # a write to r0 is dropped and never forwarded, so it is not computed
+        WB_data = [0] * width
+        link = state.mem_wb[0].pc_plus_2 - 1
+        for lane, latch in enumerate(state.mem_wb):
+            if latch.reg_write == 1 and latch.write_register:
+                WB_data[lane] = mux(sel=latch.mem_to_reg,
+                                    in1=latch.alu_result,
+                                    in2=latch.memory_read_data,
+                                    in3=(link + lane) & pc_mask)
+                rf.write_rf(reg_num=latch.write_register, write_data=WB_data[lane])
 
-        jump_mux1 = mux(sel=control_signals1.get('jump'), in1=read_data1 & (INS_MEM_SIZE - 1), in2=int(state.if_id.instruction1[-8:], 2))
-        jump_mux2 = mux(sel=control_signals2.get('jump'), in1=read_data3 & (INS_MEM_SIZE - 1), in2=int(state.if_id.instruction2[-8:], 2))
-        jump_mux = mux(sel=control_signals2.get('pc_src'), in1=jump_mux1, in2=jump_mux2)
+        # --------------------FORWARDING------------------ #
+        forwarding_unit.forward(state)
 
-        branch_mux1 = mux(sel=prediction1, in1=pc_plus_2, in2=(inst2_address + 1) & (INS_MEM_SIZE - 1))
-        branch_mux = mux(sel=prediction2, in1=branch_mux1, in2=branch_adder_result2)
+        # --------------------MEM STAGE------------------ #
+        ex_mem = state.ex_mem
+        for latch in ex_mem:
+            if latch.mem_write:
+                data_mem.write_dm(address=latch.alu_result, data=latch.forward_B_mux_out)
+                break
+
+        packet_pc = ex_mem[0].pc
+        branch_taken = [0] * width
+        mispredicts = [0] * width
+        cpc_signal = 0
+        corrected_pc = 0
+        for lane, latch in enumerate(ex_mem):
+            if not latch.branch:
+                continue
+            older_A = forwarding_unit.forward_branch_A[lane]
+            older_B = forwarding_unit.forward_branch_B[lane]
+            comp_A = latch.forward_A_mux_out if older_A is None else ex_mem[older_A].alu_result
+            comp_B = latch.forward_B_mux_out if older_B is None else ex_mem[older_B].alu_result
+            zero = comp_A == comp_B
+            taken = branch_taken[lane] = latch.branch & ~(latch.I_26 ^ ~zero)
+            branch_predictor.update(pc=(packet_pc + lane) & pc_mask, branch_taken=taken,
+                                    target=latch.branch_adder_result)
+            # the youngest misprediction corrects the PC
+            if taken and not latch.prediction:
+                corrected_pc = latch.branch_adder_result
+                cpc_signal = mispredicts[lane] = 1
+            if not taken and latch.prediction:
+                corrected_pc = (packet_pc + lane + 1) & pc_mask
+                cpc_signal = mispredicts[lane] = 1
+
+        for latch, new_latch in zip(ex_mem, new_state.mem_wb):
+            new_latch.memory_read_data = data_mem.read_dm(latch.alu_result) if latch.mem_read else 0
+            new_latch.reg_write = latch.reg_write
+            new_latch.mem_to_reg = latch.mem_to_reg
+            new_latch.alu_result = latch.alu_result
+            new_latch.write_register = latch.write_register
+            new_latch.instruction = latch.instruction
+        new_state.mem_wb[0].pc_plus_2 = ex_mem[0].pc_plus_2
 
-        pc_mux = mux(sel=control_signals1.get('pc_src') | control_signals2.get('pc_src'), in1=branch_mux, in2=jump_mux)
-        cpc_mux = mux(sel=branch_predictor.cpc_signal2, in1=branch_predictor.corrected_pc1, in2=branch_predictor.corrected_pc2)
-        next_pc_mux = mux(sel=branch_predictor.cpc_signal, in1=pc_mux, in2=cpc_mux)
+        # --------------------EX STAGE------------------ #
+        # A NOP or flushed lane has r0 for every register field and reads 0,
+        # so every mux and the ALU give 0; only real instructions are computed.
+        sources = [latch.alu_result for latch in ex_mem] + WB_data
+        write_registers_E = [0] * width
+        for lane, (latch, new_latch) in enumerate(zip(state.id_ex, new_state.ex_mem)):
+            if latch.instruction is NOP:
+                forward_mux_A_out = forward_mux_B_out = alu_result = reg_dst_mux = 0
+            else:
+                select_A = forwarding_unit.forward_A[lane]
+                select_B = forwarding_unit.forward_B[lane]
+                forward_mux_A_out = sources[select_A - 1] if select_A else latch.read_data1
+                forward_mux_B_out = sources[select_B - 1] if select_B else latch.read_data2
+
+                alu_mux = mux(sel=latch.alu_src,
+                              in1=forward_mux_B_out,
+                              in2=latch.ext_imm)
+
+                alu_result, _, _ = alu(operand1=forward_mux_A_out,
+                                       operand2=alu_mux,
+                                       alu_shamt=latch.shamt,
+                                       op_sel=latch.alu_op)
+
+                reg_dst_mux = mux(sel=latch.reg_dst,
+                                  in1=latch.rt,
+                                  in2=latch.rd,
+                                  in3=31)
+            write_registers_E[lane] = reg_dst_mux
+
+            # the RTL keeps the packet PCs with lane 1 and the branch
+            # comparator's rs/rt with the later lanes
+            if lane:
+                new_latch.rs = latch.rs
+                new_latch.rt = latch.rt
+            else:
+                new_latch.pc = latch.pc
+                new_latch.pc_plus_1 = latch.pc_plus_1
+                new_latch.pc_plus_2 = latch.pc_plus_2
+            new_latch.branch_adder_result = latch.branch_adder_result
+            new_latch.reg_write = latch.reg_write
+            new_latch.mem_to_reg = latch.mem_to_reg
+            new_latch.mem_write = latch.mem_write
+            new_latch.mem_read = latch.mem_read
+            new_latch.branch = latch.branch
+            new_latch.I_26 = latch.I_26
+            new_latch.prediction = latch.prediction
+            new_latch.alu_result = alu_result
+            new_latch.forward_B_mux_out = forward_mux_B_out
+            new_latch.forward_A_mux_out = forward_mux_A_out
+            new_latch.write_register = reg_dst_mux
+            new_latch.instruction = latch.instruction
 
-        if instruction1 != '00000000000000000000000000000000':
-            instruction_count += 1
-        if instruction2 != '00000000000000000000000000000000':
-            instruction_count += 1
+        # --------------------ID STAGE------------------ #
+        if_id = state.if_id
+        decoded = [latch.instruction for latch in if_id]
+        stall = forwarding_unit.stall(id_ex=state.id_ex, write_registers_E=write_registers_E, decoded=decoded)
+
+        # the youngest jump picks the jump target
+        pc_src = [0] * width
+        jump_mux = 0
+        for lane, (latch, new_latch) in enumerate(zip(if_id, new_state.id_ex)):
+            instruction = latch.instruction
+            control_signals = STALL_SIGNALS if stall else instruction.control
+            if instruction is NOP:
+                read_data1 = read_data2 = 0
+            else:
+                read_data1 = rf.read_rf(instruction.rs)
+                read_data2 = rf.read_rf(instruction.rt)
+            if control_signals.pc_src:
+                pc_src[lane] = 1
+                jump_mux = mux(sel=control_signals.jump, in1=read_data1 & pc_mask, in2=instruction.target)
+
+            new_latch.branch_adder_result = latch.branch_adder_result
+            new_latch.I_26 = instruction.I_26
+            new_latch.set_control(control_signals)
+            new_latch.read_data1 = read_data1
+            new_latch.read_data2 = read_data2
+            new_latch.ext_imm = instruction.imm
+            new_latch.rs = instruction.rs
+            new_latch.rt = instruction.rt
+            new_latch.rd = instruction.rd
+            new_latch.shamt = instruction.shamt
+            new_latch.prediction = latch.prediction
+            new_latch.instruction = instruction
+        new_state.id_ex[0].pc = if_id[0].pc
+        new_state.id_ex[0].pc_plus_1 = if_id[0].pc_plus_1
+        new_state.id_ex[0].pc_plus_2 = if_id[0].pc_plus_2
 
-        if instruction1 == '00000000000000000000000000000000' and instruction2 == '00000000000000000000000000000000':
-            nop_count += 2
-        elif instruction2 == '00000000000000000000000000000000':
-            nop_count += 1
+        # --------------------IF STAGE------------------ #
+        cur_pc = pc.cur_pc
+        predictions = [0] * width
+        branch_adder_results = [0] * width
+        instructions = [NOP] * width
+        address = lookup_pc = cur_pc
+        fetched = width
+        for lane in range(width):
+            if lane:
+                btb_target = branch_predictor.btb.lookup(lookup_pc) if predictions[lane - 1] else None
+                address = (address + 1) & pc_mask if btb_target is None else btb_target
+            instruction = ins_mem.get_instruction(address=address)
+            if lane > 1 and splits(instruction, instructions[:lane]):
+                fetched = lane
+                break
+            # lane 2 predicts at PC + 1 even when it was fetched from a BTB
+            # target, as in the RTL; later lanes predict at their own address
+            lookup_pc = address if lane > 1 else (cur_pc + lane) & pc_mask
+            predictions[lane] = branch_predictor.predict(pc=lookup_pc)
+            instructions[lane] = instruction
+            branch_adder_results[lane] = (cur_pc + lane + 1 + instruction.target) & pc_mask
+
+        if fetched < width:
+            # the split lane starts the next packet
+            branch_mux = address
+        elif predictions[-1]:
+            branch_mux = branch_adder_results[-1]
+        else:
+            branch_mux = (address + 1) & pc_mask
+        jumped = any(pc_src)
+        pc_mux = mux(sel=jumped, in1=branch_mux, in2=jump_mux)
+        next_pc_mux = mux(sel=cpc_signal, in1=pc_mux, in2=corrected_pc)
+
+        trailing = 0
+        for instruction in instructions[:fetched]:
+            if instruction.word:
+                instruction_count += 1
+                trailing = 0
+            else:
+                trailing += 1
+        if trailing:
+            nop_count += trailing
         else:
             nop_count = 0
 
         # logger.warning(f'CYCLE_START')
-        if not cycle % 10000:
-            logger.warning(f'cycle: {cycle}, PC: {pc.cur_pc}')
-            data_mem.dm_to_file()
-        
-        enable_pc_IF_ID = (not stall) and enable or branch_predictor.cpc_signal
+        if self.dump_interval and not cycle % self.dump_interval:
+            logger.warning(f'cycle: {cycle}, PC: {cur_pc}')
+            data_mem.persist()
+
+        enable_pc_IF_ID = (not stall) and enable or cpc_signal
         if enable_pc_IF_ID:
-            new_state.if_id.pc_plus_2 = pc_plus_2
-            new_state.if_id.pc_plus_1 = pc_plus_1
-            new_state.if_id.pc = pc.cur_pc
-            new_state.if_id.branch_adder_result1 = branch_adder_result1
-            new_state.if_id.branch_adder_result2 = branch_adder_result2
-            new_state.if_id.prediction1 = prediction1
-            new_state.if_id.prediction2 = prediction2
-            new_state.if_id.instruction1 = instruction1
-            new_state.if_id.instruction2 = instruction2
+            new_if_id = new_state.if_id
+            new_if_id[0].pc_plus_2 = (cur_pc + 2) & pc_mask
+            new_if_id[0].pc_plus_1 = (cur_pc + 1) & pc_mask
+            new_if_id[0].pc = cur_pc
+            for lane, new_latch in enumerate(new_if_id):
+                new_latch.branch_adder_result = branch_adder_results[lane]
+                new_latch.prediction = predictions[lane]
+                new_latch.instruction = instructions[lane]
         else:
-            new_state.if_id = deepcopy(state.if_id)
+            for new_latch, latch in zip(new_state.if_id, if_id):
+                new_latch.copy_from(latch)
+        if self.hash_interval and not cycle % self.hash_interval:
+            logger.info(f'STATE_HASH cycle: {cycle}, PC: {cur_pc}, '
+                        f'hash: {self.state_hash.digest(cur_pc):016x}')
+        if self.tracer is not None:
+            self.tracer.cycle(cycle, cur_pc, [instruction.word for instruction in instructions])
         pc.update_pc(next_pc_mux, enable_pc_IF_ID)
 
-        hdu = HDU(
-            branch1M=state.ex_mem1.branch,
-            branch2M=state.ex_mem2.branch,
-            prediction_M1=state.ex_mem1.prediction,
-            prediction_M2=state.ex_mem2.prediction,
-            branch_taken1=branch_taken1,
-            branch_taken2=branch_taken2,
-            pc_src1=control_signals1.get('pc_src'),
-            pc_src2=control_signals2.get('pc_src')
-        )
-
-        new_state.if_id.flush(flush=hdu.flush_IF_ID)
-        new_state.id_ex1.flush(flush=hdu.flush_EX)
-        new_state.id_ex2.flush(flush=hdu.flush_EX or control_signals1.get('pc_src'))
-        new_state.ex_mem1.flush(flush=hdu.flush_EX)
-        new_state.ex_mem2.flush(flush=hdu.flush_EX)
-        new_state.mem_wb2.flush(flush=hdu.flush_MEM2)
-
-        # logger.warning(f'Instruction1(Fetch): {hex(int(instruction1, 2))}')
-        # logger.warning(f'Instruction2(Fetch): {hex(int(instruction2, 2))}')
+        # --------------------HAZARDS------------------ #
+        if cpc_signal or jumped:
+            for new_latch in new_state.if_id:
+                new_latch.reset()
+            for lane in range(width):
+                if cpc_signal:
+                    new_state.id_ex[lane].reset()
+                    new_state.ex_mem[lane].reset()
+                    if any(mispredicts[:lane]):
+                        new_state.mem_wb[lane].reset()
+                elif any(pc_src[:lane]):
+                    new_state.id_ex[lane].reset()
+        if self.counters is not None:
+            self.counters.record_cycle(stall, [instruction.word for instruction in decoded],
+                                       HDU(branch_M=[latch.branch for latch in ex_mem],
+                                           prediction_M=[latch.prediction for latch in ex_mem],
+                                           branch_taken=branch_taken,
+                                           pc_src=pc_src))
+
+        # logger.warning(f'Instruction1(Fetch): {hex(instruction1.word)}')
+        # logger.warning(f'Instruction2(Fetch): {hex(instruction2.word)}')
         # rf.print_rf()
         # data_mem.print_dm()
         # logger.warning(f'CYCLE_END')
         # logger.warning(f'\n')
 
-        # if pc.cur_pc >= INS_MEM_SIZE - 2:
-        #     break
+        self.cycle = cycle + 1
+        self.instruction_count = instruction_count
+        self.nop_count = nop_count
+        self.state, self.new_state = new_state, state
+
+
+def main(checkpoint_cycles=(), resume_path=None, dm_image='data_mem.bin', trace_path=None,
+         trace_level=cas_trace.TRACE_WRITES, counters_path=None, config=None, branch_stream_path=None,
+         state_hash_interval=None, generated_step=False, pipeview_path=None,
+         pipe_dump_path=None):
+    logger.addHandler(logging.FileHandler('cas_out.txt', mode='w'))
+    # STATE_HASH lines are logged at info level
+    logger.setLevel(logging.INFO)
+    # periodic dumps only flush the dirty pages of the binary image; the text
+    # file is exported once at the end
+    simulator = Simulator(data=DataMem.read_text(), dump_interval=10000, dm_image=dm_image, config=config)
+    if generated_step:
+        simulator.use_generated_step()
+    if counters_path is not None:
+        simulator.attach_counters()
+    if state_hash_interval:
+        simulator.attach_state_hash(state_hash_interval)
+    branch_stream = None
+    if branch_stream_path is not None:
+        branch_stream = branch_predictors.BranchStream()
+        branch_stream.attach(simulator.branch_predictor)
+    if resume_path is not None:
+        simulator.load_checkpoint(resume_path)
+    if trace_path is not None and trace_level != cas_trace.TRACE_OFF:
+        simulator.attach_tracer(cas_trace.TraceWriter(trace_path, level=trace_level))
+    if pipeview_path is not None:
+        simulator.attach_pipeview(pipeview_path)
+    if pipe_dump_path is not None:
+        simulator.attach_pipe_dump(pipe_dump_path)
+
+    for checkpoint_cycle in sorted(checkpoint_cycles):
+        if checkpoint_cycle < simulator.cycle:
+            continue
+        simulator.run(checkpoint_cycle - simulator.cycle)
+        if simulator.finished:
+            break
+        simulator.save_checkpoint(f'checkpoint_{checkpoint_cycle}.bin')
+
+    stats = simulator.run()
+    if simulator.tracer is not None:
+        simulator.tracer.close()
+    if simulator.pipeview is not None:
+        simulator.pipeview.close()
+    if simulator.pipe_dump is not None:
+        simulator.pipe_dump.close()
+    if branch_stream is not None:
+        branch_stream.save(branch_stream_path)
+
+    simulator.data_mem.sync()
+    simulator.data_mem.dm_to_file()
+    simulator.rf.out_rf()
+    simulator.rf.print_rf()
+    print(f'IPC: {stats.ipc}')
+    if counters_path is not None:
+        simulator.counters.write_json(counters_path)
+        print(simulator.counters.format_cpi_stack())
+
+
+def run_functional(rf, data_mem, ins_mem):
+    # Executes the program one instruction at a time with no pipeline model.
+    # Only the architectural state (RF, DM, PC) is kept, which matches the
+    # cycle-accurate run for programs scheduled without intra-packet
+    # dependencies. Stops after MAX_NOP_COUNT consecutive NOPs.
+    instructions = ins_mem.instructions
+    registers = rf.registers
+    write_rf = rf.write_rf
+    pc_mask = len(ins_mem.instructions) - 1
+    cur_pc = 0
+    instruction_count = 0
+    nop_count = 0
 
-        cycle += 1
+    while nop_count < MAX_NOP_COUNT:
+        instruction = instructions[cur_pc]
+        next_pc = (cur_pc + 1) & pc_mask
+        if not instruction.word:
+            nop_count += 1
+            cur_pc = next_pc
+            continue
+        nop_count = 0
+        instruction_count += 1
+
+        control = instruction.control
+        rs_data = registers[instruction.rs]
+        rt_data = registers[instruction.rt]
+
+        if control.branch:
+            if (rs_data == rt_data) != instruction.I_26:
+                next_pc = (next_pc + instruction.target) & pc_mask
+            cur_pc = next_pc
+            continue
+
+        alu_result, _, _ = alu(rs_data, instruction.imm if control.alu_src else rt_data,
+                               instruction.shamt, control.alu_op)
+        if control.mem_write:
+            data_mem.write_dm(alu_result, rt_data)
+        elif control.reg_write:
+            if control.mem_to_reg == 0:
+                write_data = alu_result
+            elif control.mem_to_reg == 1:
+                write_data = data_mem.read_dm(alu_result)
+            else:
+                write_data = next_pc
+            if control.reg_dst == 0:
+                write_rf(instruction.rt, write_data)
+            elif control.reg_dst == 1:
+                write_rf(instruction.rd, write_data)
+            else:
+                write_rf(31, write_data)
+
+        if control.jump:
+            next_pc = instruction.target
+        elif control.pc_src:  # jr
+            next_pc = rs_data & pc_mask
+        cur_pc = next_pc
+
+    return instruction_count
+
+
+def run_translated(rf, data_mem, ins_mem, block_cache=None):
+    # Same results as run_functional(), but executes whole translated basic
+    # blocks from a BlockCache instead of dispatching every instruction.
+    if block_cache is None:
+        block_cache = BlockCache(ins_mem, len(ins_mem.instructions), MAX_NOP_COUNT)
+    cur_pc = 0
+    instruction_count = 0
+    nop_count = 0
 
-        if nop_count >= MAX_NOP_COUNT:
+    while True:
+        block = block_cache.get(cur_pc)
+        if nop_count + block.leading_nops >= MAX_NOP_COUNT:
             break
+        cur_pc = block.run(rf.registers, data_mem.data_mem_array)
+        if block.instruction_count:
+            instruction_count += block.instruction_count
+            nop_count = block.trailing_nops
+        else:
+            nop_count += block.length
+
+    return instruction_count
+
+
+def functional_main(translate=True):
+    rf = RF()
+    data_mem = DataMem()
+    ins_mem = InsMem()
 
-        state = deepcopy(new_state)
+    if translate:
+        instruction_count = run_translated(rf, data_mem, ins_mem)
+    else:
+        instruction_count = run_functional(rf, data_mem, ins_mem)
 
     data_mem.dm_to_file()
     rf.out_rf()
     rf.print_rf()
-    print(f'IPC: {instruction_count/(cycle - MAX_NOP_COUNT/2)}')
+    print(f'Instructions: {instruction_count}')
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--functional', action='store_true',
+                        help='run without pipeline modelling; only the final RF and DM are produced')
+    parser.add_argument('--no-translate', action='store_true',
+                        help='with --functional, interpret one instruction at a time instead of '
+                             'running cached translated blocks')
+    parser.add_argument('--checkpoint-at', type=int, nargs='+', default=(), metavar='CYCLE',
+                        help='write checkpoint_<CYCLE>.bin at the start of each given cycle')
+    parser.add_argument('--resume', metavar='CHECKPOINT',
+                        help='continue from a checkpoint written by --checkpoint-at')
+    parser.add_argument('--trace', metavar='PATH',
+                        help='write a binary per-cycle trace; render it with cas_trace.py')
+    parser.add_argument('--trace-level', type=int, default=cas_trace.TRACE_WRITES,
+                        choices=(cas_trace.TRACE_OFF, cas_trace.TRACE_FETCH, cas_trace.TRACE_WRITES),
+                        help='0: off, 1: PC and fetched instructions, 2: also RF and DM writes (default)')
+    parser.add_argument('--pipeview', metavar='PATH',
+                        help='write a Konata pipeline log of every instruction; summarize it with pipeview.py')
+    parser.add_argument('--pipe-dump', metavar='PATH',
+                        help='write the packed pipe registers of every cycle; compare with packed_pipes.py')
+    parser.add_argument('--counters', metavar='PATH',
+                        help='write the performance counters and CPI stack as JSON and print the CPI stack')
+    parser.add_argument('--state-hash', type=int, metavar='CYCLES',
+                        help='log a 64-bit digest of PC, RF and DM every CYCLES cycles to cas_out.txt')
+    parser.add_argument('--predictor', default='bimodal', metavar='SPEC',
+                        help='bimodal (default), gshare[:history_bits] or tournament[:history_bits]')
+    parser.add_argument('--btb-entries', type=int, metavar='N',
+                        help='use a direct-mapped BTB with N entries instead of one entry per PC')
+    parser.add_argument('--bht-initial', type=int, default=1, choices=range(4),
+                        help='initial 2-bit counter value of every predictor entry (default: %(default)s)')
+    parser.add_argument('--forwarding', nargs='*', default=FORWARDING_PATHS, choices=FORWARDING_PATHS,
+                        metavar='PATH', help='enabled forwarding paths, any of M1 M2 W1 W2 (default: all)')
+    parser.add_argument('--width', type=int, default=2, metavar='LANES',
+                        help='issue lanes; 2 (default) is the RTL design, see wide.py')
+    parser.add_argument('--ins-mem-size', type=int, default=INS_MEM_SIZE, metavar='WORDS')
+    parser.add_argument('--data-mem-size', type=int, default=DATA_MEM_SIZE, metavar='WORDS')
+    parser.add_argument('--record-branches', metavar='PATH',
+                        help='record resolved branches for replay with branch_predictors.py')
+    parser.add_argument('--generated-step', action='store_true',
+                        help='run the flattened step() generated by step_codegen.py')
+    parser.add_argument('--dm-image', default='data_mem.bin', metavar='PATH',
+                        help='binary image that backs data memory during the run (default: %(default)s)')
+    args = parser.parse_args()
+
+    if args.functional:
+        functional_main(translate=not args.no_translate)
+    else:
+        main(checkpoint_cycles=args.checkpoint_at, resume_path=args.resume, dm_image=args.dm_image,
+             trace_path=args.trace, trace_level=args.trace_level, counters_path=args.counters,
+             config=SimConfig(ins_mem_size=args.ins_mem_size, data_mem_size=args.data_mem_size,
+                              bht_initial=args.bht_initial, predictor=args.predictor,
+                              btb_entries=args.btb_entries, forwarding=tuple(args.forwarding),
+                              width=args.width),
+             branch_stream_path=args.record_branches, state_hash_interval=args.state_hash,
+             generated_step=args.generated_step, pipeview_path=args.pipeview,
+             pipe_dump_path=args.pipe_dump)
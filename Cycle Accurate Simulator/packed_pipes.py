@@ -0,0 +1,264 @@
+import argparse
+from collections import namedtuple
+
+# signal: the RTL wire on the D side of the pipe instance; latch, lane and
+# attr: the CAS latch field it is packed from, state.<latch>[lane].<attr>
+Field = namedtuple('Field', ['signal', 'width', 'latch', 'lane', 'attr'])
+
+# Every pipe instance of SuperScalar/processor.v with its fields MSB first,
+# in the order of its D concatenation. The RTL groups fields differently
+# from the CAS latches: EX_MEM_2 carries lane 1's PCs, which is why the CAS
+# keeps them in ex_mem[0] and never writes the PCs of ex_mem[1] or id_ex[1].
+# Only the two-lane processor.v exists, so only width 2 can be dumped.
+PIPES = {
+    'IF_ID': (
+        Field('PCPlus2', 8, 'if_id', 0, 'pc_plus_2'),
+        Field('PCPlus1', 8, 'if_id', 0, 'pc_plus_1'),
+        Field('PC', 8, 'if_id', 0, 'pc'),
+        Field('branchAdderResult1', 8, 'if_id', 0, 'branch_adder_result'),
+        Field('branchAdderResult2', 8, 'if_id', 1, 'branch_adder_result'),
+        Field('prediction1', 1, 'if_id', 0, 'prediction'),
+        Field('prediction2', 1, 'if_id', 1, 'prediction'),
+        Field('instr1', 32, 'if_id', 0, 'instruction'),
+        Field('instr2', 32, 'if_id', 1, 'instruction'),
+    ),
+    'ID_EX_1': (
+        Field('PCD', 8, 'id_ex', 0, 'pc'),
+        Field('PCPlus1D', 8, 'id_ex', 0, 'pc_plus_1'),
+        Field('PCPlus2D', 8, 'id_ex', 0, 'pc_plus_2'),
+        Field('branchAdderResult1D', 8, 'id_ex', 0, 'branch_adder_result'),
+        Field('bit26_1', 1, 'id_ex', 0, 'I_26'),
+        Field('Branch1', 1, 'id_ex', 0, 'branch'),
+        Field('MemReadEn1', 1, 'id_ex', 0, 'mem_read'),
+        Field('MemWriteEn1', 1, 'id_ex', 0, 'mem_write'),
+        Field('MemtoReg1', 2, 'id_ex', 0, 'mem_to_reg'),
+        Field('RegWriteEn1', 1, 'id_ex', 0, 'reg_write'),
+        Field('ALUOp1', 4, 'id_ex', 0, 'alu_op'),
+        Field('RegDst1', 2, 'id_ex', 0, 'reg_dst'),
+        Field('ALUSrc1', 1, 'id_ex', 0, 'alu_src'),
+        Field('readData1', 32, 'id_ex', 0, 'read_data1'),
+        Field('readData2', 32, 'id_ex', 0, 'read_data2'),
+        Field('extImm1', 32, 'id_ex', 0, 'ext_imm'),
+        Field('rs1', 5, 'id_ex', 0, 'rs'),
+        Field('rt1', 5, 'id_ex', 0, 'rt'),
+        Field('rd1', 5, 'id_ex', 0, 'rd'),
+        Field('shamt1', 5, 'id_ex', 0, 'shamt'),
+        Field('prediction1D', 1, 'id_ex', 0, 'prediction'),
+    ),
+    'ID_EX_2': (
+        Field('branchAdderResult2D', 8, 'id_ex', 1, 'branch_adder_result'),
+        Field('bit26_2', 1, 'id_ex', 1, 'I_26'),
+        Field('Branch2', 1, 'id_ex', 1, 'branch'),
+        Field('MemReadEn2', 1, 'id_ex', 1, 'mem_read'),
+        Field('MemWriteEn2', 1, 'id_ex', 1, 'mem_write'),
+        Field('MemtoReg2', 2, 'id_ex', 1, 'mem_to_reg'),
+        Field('RegWriteEn2', 1, 'id_ex', 1, 'reg_write'),
+        Field('ALUOp2', 4, 'id_ex', 1, 'alu_op'),
+        Field('RegDst2', 2, 'id_ex', 1, 'reg_dst'),
+        Field('ALUSrc2', 1, 'id_ex', 1, 'alu_src'),
+        Field('readData3', 32, 'id_ex', 1, 'read_data1'),
+        Field('readData4', 32, 'id_ex', 1, 'read_data2'),
+        Field('extImm2', 32, 'id_ex', 1, 'ext_imm'),
+        Field('rs2', 5, 'id_ex', 1, 'rs'),
+        Field('rt2', 5, 'id_ex', 1, 'rt'),
+        Field('rd2', 5, 'id_ex', 1, 'rd'),
+        Field('shamt2', 5, 'id_ex', 1, 'shamt'),
+        Field('prediction2D', 1, 'id_ex', 1, 'prediction'),
+    ),
+    'EX_MEM': (
+        Field('branchAdderResult1E', 8, 'ex_mem', 0, 'branch_adder_result'),
+        Field('RegWriteEn1E', 1, 'ex_mem', 0, 'reg_write'),
+        Field('MemToReg1E', 2, 'ex_mem', 0, 'mem_to_reg'),
+        Field('MemWriteEn1E', 1, 'ex_mem', 0, 'mem_write'),
+        Field('MemReadEn1E', 1, 'ex_mem', 0, 'mem_read'),
+        Field('Branch1E', 1, 'ex_mem', 0, 'branch'),
+        Field('bit26_1E', 1, 'ex_mem', 0, 'I_26'),
+        Field('prediction1E', 1, 'ex_mem', 0, 'prediction'),
+        Field('ALUResult1', 32, 'ex_mem', 0, 'alu_result'),
+        Field('ForwardBMuxOut1', 32, 'ex_mem', 0, 'forward_B_mux_out'),
+        Field('ForwardAMuxOut1', 32, 'ex_mem', 0, 'forward_A_mux_out'),
+        Field('writeRegister1E', 5, 'ex_mem', 0, 'write_register'),
+    ),
+    'EX_MEM_2': (
+        Field('PCE', 8, 'ex_mem', 0, 'pc'),
+        Field('PCPlus1E', 8, 'ex_mem', 0, 'pc_plus_1'),
+        Field('branchAdderResult2E', 8, 'ex_mem', 1, 'branch_adder_result'),
+        Field('RegWriteEn2E', 1, 'ex_mem', 1, 'reg_write'),
+        Field('MemToReg2E', 2, 'ex_mem', 1, 'mem_to_reg'),
+        Field('MemWriteEn2E', 1, 'ex_mem', 1, 'mem_write'),
+        Field('MemReadEn2E', 1, 'ex_mem', 1, 'mem_read'),
+        Field('rs2E', 5, 'ex_mem', 1, 'rs'),
+        Field('rt2E', 5, 'ex_mem', 1, 'rt'),
+        Field('PCPlus2E', 8, 'ex_mem', 0, 'pc_plus_2'),
+        Field('Branch2E', 1, 'ex_mem', 1, 'branch'),
+        Field('bit26_2E', 1, 'ex_mem', 1, 'I_26'),
+        Field('prediction2E', 1, 'ex_mem', 1, 'prediction'),
+        Field('ALUResult2', 32, 'ex_mem', 1, 'alu_result'),
+        Field('ForwardBMuxOut2', 32, 'ex_mem', 1, 'forward_B_mux_out'),
+        Field('ForwardAMuxOut2', 32, 'ex_mem', 1, 'forward_A_mux_out'),
+        Field('writeRegister2E', 5, 'ex_mem', 1, 'write_register'),
+    ),
+    'MEM_WB1': (
+        Field('RegWriteEn1M', 1, 'mem_wb', 0, 'reg_write'),
+        Field('MemToReg1M', 2, 'mem_wb', 0, 'mem_to_reg'),
+        Field('PCPlus2M', 8, 'mem_wb', 0, 'pc_plus_2'),
+        Field('ALUResult1M', 32, 'mem_wb', 0, 'alu_result'),
+        Field('memoryReadData1', 32, 'mem_wb', 0, 'memory_read_data'),
+        Field('writeRegister1M', 5, 'mem_wb', 0, 'write_register'),
+    ),
+    'MEM_WB2': (
+        Field('RegWriteEn2M', 1, 'mem_wb', 1, 'reg_write'),
+        Field('MemToReg2M', 2, 'mem_wb', 1, 'mem_to_reg'),
+        Field('ALUResult2M', 32, 'mem_wb', 1, 'alu_result'),
+        Field('memoryReadData2', 32, 'mem_wb', 1, 'memory_read_data'),
+        Field('writeRegister2M', 5, 'mem_wb', 1, 'write_register'),
+    ),
+}
+
+# the size parameter of each pipe instance
+SIZES = {pipe: sum(field.width for field in fields) for pipe, fields in PIPES.items()}
+
+
+def layout(fields):
+    # (field, shift, mask) with the last field in the low bits, as Verilog
+    # packs a concatenation
+    placed = []
+    shift = sum(field.width for field in fields)
+    for field in fields:
+        shift -= field.width
+        placed.append((field, shift, (1 << field.width) - 1))
+    return tuple(placed)
+
+
+LAYOUTS = {pipe: layout(fields) for pipe, fields in PIPES.items()}
+
+
+def pack(state, pipe):
+    # the Q value the RTL pipe holds for this CAS state; words are stored as
+    # two's complement of the field width, so signed and unsigned CAS values
+    # of the same word pack the same
+    value = 0
+    for field, shift, mask in LAYOUTS[pipe]:
+        field_value = getattr(getattr(state, field.latch)[field.lane], field.attr)
+        if field.attr == 'instruction':
+            field_value = field_value.word
+        value |= (int(field_value) & mask) << shift
+    return value
+
+
+def pack_state(state):
+    # one integer per pipe instance, in PIPES order
+    return [pack(state, pipe) for pipe in PIPES]
+
+
+def unpack(pipe, value):
+    # {signal: field value} of a packed pipe, unsigned as read from the RTL
+    return {field.signal: (value >> shift) & mask for field, shift, mask in LAYOUTS[pipe]}
+
+
+def load(state, pipe, value, decode):
+    # writes a packed pipe back into the CAS latches. Words come back
+    # unsigned, so pack() gives the same value again, but slt/sgt on a word
+    # the CAS held signed can differ if the simulation is continued from it
+    for field, shift, mask in LAYOUTS[pipe]:
+        field_value = (value >> shift) & mask
+        setattr(getattr(state, field.latch)[field.lane], field.attr,
+                decode(field_value) if field.attr == 'instruction' else field_value)
+
+
+def clock(q, d, enable=1, flush=0, reset=1):
+    # Q of a pipe after a rising edge of Pipes.v: reset is active low and
+    # flush wins over enable
+    if not reset or flush:
+        return 0
+    return d if enable else q
+
+
+def diff(pipe, expected, actual):
+    # (signal, expected, actual) of every field in which two values of a pipe
+    # differ; only worth calling once the integer compare has failed. Bits
+    # above the pipe width belong to no field and are reported as 'Q'.
+    changed = expected ^ actual
+    fields = [(field.signal, (expected >> shift) & mask, (actual >> shift) & mask)
+              for field, shift, mask in LAYOUTS[pipe] if (changed >> shift) & mask]
+    if changed >> SIZES[pipe]:
+        fields.append(('Q', expected, actual))
+    return fields
+
+
+class PipeDump:
+    # Writes the packed value of every pipe after every cycle, one line per
+    # cycle: the cycle number, then one hex value per pipe in PIPES order.
+    # The processor testbench writes the same format from the Q ports of the
+    # RTL pipes, so the two files compare line by line. attach() shadows
+    # counters.record_cycle, which step() calls once the latches are written,
+    # attaching the counters if the simulator has none yet.
+    def __init__(self, path):
+        self.out = open(path, 'w', buffering=1 << 16)
+        self.simulator = None
+
+    def attach(self, simulator):
+        if simulator.width != 2:
+            raise ValueError(f'the RTL pipes hold two lanes, not {simulator.width}')
+        self.simulator = simulator
+        counters = simulator.counters
+        if counters is None:
+            counters = simulator.attach_counters()
+        record_cycle = counters.record_cycle
+
+        def dumped_record_cycle(stall, words, hdu):
+            record_cycle(stall, words, hdu)
+            self.cycle()
+
+        counters.record_cycle = dumped_record_cycle
+
+    def cycle(self):
+        simulator = self.simulator
+        values = pack_state(simulator.new_state)
+        self.out.write(f'{simulator.cycle} ' + ' '.join(f'{value:x}' for value in values) + '\n')
+
+    def close(self):
+        self.out.close()
+
+
+def read_dump(path):
+    # {cycle: [packed value per pipe]} of a file written by PipeDump or the
+    # processor testbench
+    values = {}
+    with open(path, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if fields:
+                values[int(fields[0])] = [int(value, 16) for value in fields[1:]]
+    return values
+
+
+def compare(expected, actual, max_mismatches=20):
+    # field-level differences of two dumps over the cycles both contain,
+    # as (cycle, pipe, signal, expected, actual), in cycle order
+    mismatches = []
+    for cycle in sorted(expected.keys() & actual.keys()):
+        for pipe, expected_value, actual_value in zip(PIPES, expected[cycle], actual[cycle]):
+            if expected_value != actual_value:
+                for signal, expected_field, actual_field in diff(pipe, expected_value, actual_value):
+                    mismatches.append((cycle, pipe, signal, expected_field, actual_field))
+                    if len(mismatches) >= max_mismatches:
+                        return mismatches
+    return mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='compare per-cycle pipe register dumps field by field, e.g. '
+                                                 'main.py --pipe-dump against the processor testbench')
+    parser.add_argument('expected')
+    parser.add_argument('actual')
+    parser.add_argument('--max-mismatches', type=int, default=20, metavar='N')
+    args = parser.parse_args()
+
+    expected = read_dump(args.expected)
+    actual = read_dump(args.actual)
+    mismatches = compare(expected, actual, args.max_mismatches)
+    for cycle, pipe, signal, expected_field, actual_field in mismatches:
+        print(f'cycle {cycle}: {pipe}.{signal} expected {expected_field:#x}, got {actual_field:#x}')
+    common = len(expected.keys() & actual.keys())
+    print(f'{common} cycles compared, ' + (f'{len(mismatches)} mismatches shown' if mismatches else 'identical'))
@@ -0,0 +1,126 @@
+import json
+from array import array
+
+# Issue-slot categories. Every cycle adds one slot per issue lane at the ID
+# stage; slots that issue and are later squashed move from USEFUL to the
+# flush that squashed them.
+USEFUL = 0
+LOAD_USE_STALL = 1  # also the value ForwardingUnit.stall() returns for it
+JR_STALL = 2
+FORWARD_STALL = 3  # waiting for a value whose forwarding path is disabled
+MISPREDICT_FLUSH = 4
+JUMP_FLUSH = 5
+NOP_SLOT = 6
+SECOND_SLOT_EMPTY = 7  # an empty lane after an issued one of the same packet
+SLOT_CATEGORIES = 8
+
+# plain event counts
+BRANCHES = 8
+MISPREDICTS = 9
+JUMPS = 10
+
+NAMES = ('useful', 'load_use_stall', 'jr_stall', 'forward_stall', 'mispredict_flush', 'jump_flush',
+         'nop_slot', 'second_slot_empty', 'branches', 'mispredicts', 'jumps')
+
+
+class PerfCounters:
+    # in_flight has one bit per latch lane that holds an instruction counted
+    # as useful: the ID_EX lanes in the low `width` bits, then the EX_MEM
+    # lanes, then the MEM_WB lanes
+    def __init__(self, width=2):
+        self.width = width
+        self.counts = array('q', [0] * len(NAMES))
+        self.in_flight = 0
+        # category of the bubble the ID stage sees next cycle after IF_ID is flushed
+        self.bubble = 0
+        lanes = (1 << width) - 1
+        self.id_ex_ex_mem = lanes | lanes << width
+
+    def record_cycle(self, stall, words, hdu):
+        counts = self.counts
+        width = self.width
+        if stall:
+            counts[stall] += width
+            issued = 0
+        elif self.bubble:
+            counts[self.bubble] += width
+            issued = 0
+        else:
+            issued = 0
+            for lane, word in enumerate(words):
+                if word:
+                    issued |= 1 << lane
+                    counts[USEFUL] += 1
+                elif issued:
+                    counts[SECOND_SLOT_EMPTY] += 1
+                else:
+                    counts[NOP_SLOT] += 1
+
+        # id_ex moves to ex_mem and ex_mem to mem_wb, as the latches do
+        in_flight = issued | (self.in_flight & self.id_ex_ex_mem) << width
+
+        mispredict = hdu.mispredict
+        squashed = 0
+        if any(mispredict):
+            # the MEM_WB lanes after the oldest mispredicted branch are squashed
+            younger = (1 << width) - (2 << mispredict.index(1))
+            squashed = in_flight & (self.id_ex_ex_mem | younger << 2 * width)
+            lost = bin(squashed).count('1')
+            counts[USEFUL] -= lost
+            counts[MISPREDICT_FLUSH] += lost
+            counts[MISPREDICTS] += sum(mispredict)
+            self.bubble = MISPREDICT_FLUSH
+        elif any(hdu.pc_src):
+            # a jump squashes the younger lanes of its packet
+            squashed = in_flight & ((1 << width) - (2 << hdu.pc_src.index(1)))
+            lost = bin(squashed).count('1')
+            counts[USEFUL] -= lost
+            counts[JUMP_FLUSH] += lost
+            self.bubble = JUMP_FLUSH
+        else:
+            self.bubble = 0
+        self.in_flight = in_flight & ~squashed & self.id_ex_ex_mem
+
+        counts[BRANCHES] += sum(hdu.branch_M)
+        counts[JUMPS] += sum(hdu.pc_src)
+
+    def state_words(self):
+        # counts, then the in-flight and bubble tracking, for checkpoints
+        return self.counts.tolist() + [self.in_flight, self.bubble]
+
+    def load_state_words(self, words):
+        self.counts[:] = array('q', words[:len(NAMES)])
+        self.in_flight, self.bubble = (int(word) for word in words[len(NAMES):])
+
+    def __getitem__(self, name):
+        return self.counts[NAMES.index(name)]
+
+    @property
+    def cycles(self):
+        return sum(self.counts[:SLOT_CATEGORIES]) // self.width
+
+    def cpi_stack(self):
+        # cycles per useful instruction, split by what each slot was spent on
+        useful = self.counts[USEFUL]
+        if not useful:
+            return {}
+        return {NAMES[category]: self.counts[category] / self.width / useful
+                for category in range(SLOT_CATEGORIES)}
+
+    def report(self):
+        return {'cycles': self.cycles,
+                'instructions': self.counts[USEFUL],
+                'counters': dict(zip(NAMES, self.counts)),
+                'cpi_stack': self.cpi_stack()}
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=4)
+
+    def format_cpi_stack(self):
+        stack = self.cpi_stack()
+        lines = [f'CPI stack ({self.counts[USEFUL]} instructions, {self.cycles} cycles)']
+        for name, cpi in stack.items():
+            lines.append(f'  {name:<18}{cpi:8.4f}')
+        lines.append(f'  {"total":<18}{sum(stack.values()):8.4f}')
+        return '\n'.join(lines)
@@ -0,0 +1,158 @@
+import argparse
+
+import perf_counters
+
+STALL_REASONS = {perf_counters.LOAD_USE_STALL: 'load-use',
+                 perf_counters.JR_STALL: 'jr',
+                 perf_counters.FORWARD_STALL: 'forwarding'}
+
+RETIRED = 0
+FLUSHED = 1
+
+
+class PipeView:
+    # Streams a Konata ("Kanata 0004") pipeline log: one entry per non-NOP
+    # instruction with its F/D/X/M/W cycles, its issue slot, the cycles it
+    # was held in decode by a stall and whether it retired or was flushed.
+    # Instructions are followed through IF_ID -> ID_EX -> EX_MEM -> MEM_WB in
+    # one slot per lane, so only the ones in flight are kept in memory.
+    # attach() shadows counters.record_cycle, which both step()
+    # implementations call once per cycle after the latches are written, so
+    # it attaches the counters if the simulator has none yet.
+    def __init__(self, path):
+        self.out = open(path, 'w', buffering=1 << 16)
+        self.out.write('Kanata\t0004\n')
+        self.simulator = None
+        self.next_id = 0
+        self.next_retire = 0
+        self.started = False
+        # per slot: None or the log id of the instruction in that latch
+        self.if_id = self.id_ex = self.ex_mem = self.mem_wb = []
+
+    def attach(self, simulator):
+        self.simulator = simulator
+        self.if_id = self.id_ex = self.ex_mem = self.mem_wb = [None] * simulator.width
+        counters = simulator.counters
+        if counters is None:
+            counters = simulator.attach_counters()
+        record_cycle = counters.record_cycle
+
+        def logged_record_cycle(stall, words, hdu):
+            record_cycle(stall, words, hdu)
+            self.cycle(stall, hdu)
+
+        counters.record_cycle = logged_record_cycle
+
+    def retire(self, ids, kind):
+        for log_id in ids:
+            if log_id is not None:
+                self.out.write(f'R\t{log_id}\t{self.next_retire}\t{kind}\n')
+                self.next_retire += 1
+
+    def start(self, ids, stage):
+        for log_id in ids:
+            if log_id is not None:
+                self.out.write(f'S\t{log_id}\t0\t{stage}\n')
+
+    def cycle(self, stall, hdu):
+        simulator = self.simulator
+        out = self.out
+        width = simulator.width
+        if not self.started:
+            out.write(f'C=\t{simulator.cycle}\n')
+            self.started = True
+
+        flush_IF_ID = hdu.flush_IF_ID
+        flush_EX = hdu.flush_EX
+
+        # this cycle's fetch, if it reaches IF_ID
+        fetched = [None] * width
+        if not flush_IF_ID and not stall:
+            if_id = simulator.new_state.if_id
+            addresses = simulator.fetch_addresses(if_id)
+            for slot, (pc, latch) in enumerate(zip(addresses, if_id)):
+                instruction = latch.instruction
+                if instruction.word:
+                    log_id = fetched[slot] = self.next_id
+                    self.next_id += 1
+                    out.write(f'I\t{log_id}\t{log_id}\t0\n'
+                              f'L\t{log_id}\t0\t{pc}: {instruction.word:08x} (slot {slot + 1})\n'
+                              f'S\t{log_id}\t0\tF\n')
+
+        # latch moves at the end of the cycle, as in step()
+        self.retire(self.mem_wb, RETIRED)
+        mem_wb = list(self.ex_mem)
+        for slot in range(width):
+            # a mispredicted branch squashes the younger lanes of its packet
+            if hdu.flush_MEM_WB(slot):
+                self.retire(mem_wb[slot:slot + 1], FLUSHED)
+                mem_wb[slot] = None
+        if flush_EX:
+            self.retire(self.id_ex, FLUSHED)
+            ex_mem = [None] * width
+        else:
+            ex_mem = list(self.id_ex)
+        if stall:
+            id_ex = [None] * width
+        elif flush_EX:
+            self.retire(self.if_id, FLUSHED)
+            id_ex = [None] * width
+        else:
+            id_ex = list(self.if_id)
+            for slot in range(width):
+                # a jump squashes the younger lanes of its packet
+                if hdu.flush_ID_EX(slot):
+                    self.retire(id_ex[slot:slot + 1], FLUSHED)
+                    id_ex[slot] = None
+        held = stall and not flush_IF_ID
+        if held:
+            if_id = self.if_id
+            out.write(''.join(f'L\t{log_id}\t1\tstalled at cycle {simulator.cycle + 1} ({STALL_REASONS[stall]})\n'
+                              for log_id in if_id if log_id is not None))
+        else:
+            if stall:
+                self.retire(self.if_id, FLUSHED)
+            if_id = fetched
+
+        out.write('C\t1\n')
+        self.start(if_id, 'Ds' if held else 'D')
+        self.start(id_ex, 'X')
+        self.start(ex_mem, 'M')
+        self.start(mem_wb, 'W')
+        self.if_id = if_id
+        self.id_ex = id_ex
+        self.ex_mem = ex_mem
+        self.mem_wb = mem_wb
+
+    def close(self):
+        # whatever is still in flight when the run ends never retires
+        for latch in (self.if_id, self.id_ex, self.ex_mem, self.mem_wb):
+            self.retire(latch, FLUSHED)
+        self.out.close()
+
+
+def summarize(path):
+    # packet statistics of a log written by PipeView: how many instructions
+    # retired from slot 1 and from the later slots, and how many were flushed
+    labels = {}
+    flushed = set()
+    with open(path, 'r') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if fields[0] == 'L' and fields[2] == '0':
+                labels[int(fields[1])] = fields[3]
+            elif fields[0] == 'R' and fields[3] == str(FLUSHED):
+                flushed.add(int(fields[1]))
+    retired = [log_id for log_id in labels if log_id not in flushed]
+    slot1 = sum(1 for log_id in retired if labels[log_id].endswith('(slot 1)'))
+    return {'instructions': len(labels), 'retired': len(retired), 'flushed': len(flushed),
+            'retired_slot1': slot1, 'retired_slot2': len(retired) - slot1}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='summarize a pipeline log written by main.py --pipeview; '
+                                                 'open the log itself in Konata')
+    parser.add_argument('log')
+    args = parser.parse_args()
+    for name, value in summarize(args.log).items():
+        print(f'{name:<16}{value}')
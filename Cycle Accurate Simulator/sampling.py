@@ -0,0 +1,234 @@
+import argparse
+import math
+import random
+from array import array
+
+import batch
+import perf_counters
+from block_cache import BlockCache
+from main import MAX_NOP_COUNT, DataMem, SimConfig, Simulator
+
+# z for a two-sided 95% interval
+Z_95 = 1.96
+
+
+class Checkpoint:
+    # architectural state at the start of an interval, from the functional pass
+    __slots__ = ('pc', 'registers', 'data', 'bpu')
+
+    def __init__(self, pc, registers, data, bpu):
+        self.pc = pc
+        self.registers = registers
+        self.data = data
+        self.bpu = bpu
+
+
+def functional_pass(instructions, data, config, interval, capture=()):
+    # Runs the program with translated blocks, as run_translated() does, and
+    # splits it into intervals of about `interval` instructions (an interval
+    # ends at the first block boundary past its length). Returns the
+    # basic-block vector of every interval ({block start: instructions run}),
+    # the interval lengths and a Checkpoint for each interval in capture.
+    # Every branch also trains the configured predictor, so checkpoints carry
+    # warm predictor state.
+    simulator = Simulator(instructions=instructions, data=data, config=config)
+    registers = simulator.rf.registers
+    data_mem_array = simulator.data_mem.data_mem_array
+    branch_predictor = simulator.branch_predictor
+    ins_mem = simulator.ins_mem.instructions
+    pc_mask = simulator.pc_mask
+    block_cache = BlockCache(simulator.ins_mem, len(ins_mem), MAX_NOP_COUNT)
+
+    bbvs = []
+    lengths = []
+    checkpoints = {}
+    bbv = {}
+    length = 0
+    cur_pc = 0
+    nop_count = 0
+
+    while True:
+        block = block_cache.get(cur_pc)
+        if nop_count + block.leading_nops >= MAX_NOP_COUNT:
+            break
+        if not length and len(bbvs) in capture:
+            checkpoints[len(bbvs)] = Checkpoint(cur_pc, array('q', registers), array('q', data_mem_array),
+                                                branch_predictor.state_words())
+        next_pc = block.run(registers, data_mem_array)
+        if block.instruction_count:
+            bbv[block.start] = bbv.get(block.start, 0) + block.instruction_count
+            length += block.instruction_count
+            nop_count = block.trailing_nops
+            last_pc = (block.start + block.length - 1) & pc_mask
+            last = ins_mem[last_pc]
+            if last.control.branch:
+                # a branch always ends its block and writes no register
+                taken = (registers[last.rs] == registers[last.rt]) != last.I_26
+                branch_predictor.update(last_pc, int(taken), (last_pc + 1 + last.target) & pc_mask)
+        else:
+            nop_count += block.length
+        cur_pc = next_pc
+        if length >= interval:
+            bbvs.append(bbv)
+            lengths.append(length)
+            bbv = {}
+            length = 0
+
+    if length:
+        bbvs.append(bbv)
+        lengths.append(length)
+    return bbvs, lengths, checkpoints
+
+
+def normalize(bbvs):
+    # each vector as fractions of its interval, over the blocks of all intervals
+    blocks = sorted({start for bbv in bbvs for start in bbv})
+    points = []
+    for bbv in bbvs:
+        total = sum(bbv.values())
+        points.append([bbv.get(start, 0) / total for start in blocks])
+    return points
+
+
+def distance(point, centroid):
+    return sum((a - b) ** 2 for a, b in zip(point, centroid))
+
+
+def kmeans(points, k, rng, iterations=100):
+    # k-means++ seeding, then Lloyd iterations; returns (labels, centroids, sse)
+    centroids = [list(rng.choice(points))]
+    while len(centroids) < k:
+        weights = [min(distance(point, centroid) for centroid in centroids) for point in points]
+        if not sum(weights):
+            break
+        centroids.append(list(rng.choices(points, weights)[0]))
+
+    labels = None
+    for _ in range(iterations):
+        new_labels = [min(range(len(centroids)), key=lambda c: distance(point, centroids[c])) for point in points]
+        if new_labels == labels:
+            break
+        labels = new_labels
+        for c in range(len(centroids)):
+            members = [point for point, label in zip(points, labels) if label == c]
+            if members:
+                centroids[c] = [sum(column) / len(members) for column in zip(*members)]
+    sse = sum(distance(point, centroids[label]) for point, label in zip(points, labels))
+    return labels, centroids, sse
+
+
+def cluster(points, max_clusters, seed=0, explained=0.9):
+    # the smallest k whose clustering explains `explained` of the spread of
+    # the vectors around their mean
+    rng = random.Random(seed)
+    best = kmeans(points, 1, rng)
+    total = best[2]
+    for k in range(2, min(max_clusters, len(points)) + 1):
+        if not total or best[2] <= (1 - explained) * total:
+            break
+        best = kmeans(points, k, rng)
+    return best
+
+
+def measure(instructions, config, checkpoint, length, warmup):
+    # Cycle-accurate run of one interval, starting with empty latches from a
+    # functional checkpoint. The first `warmup` instructions only refill the
+    # pipeline; cycles and fetched instructions are counted over the next
+    # `length` useful instructions.
+    simulator = Simulator(instructions=instructions, data=checkpoint.data, config=config)
+    simulator.rf.registers[:] = checkpoint.registers
+    simulator.branch_predictor.load_state_words(checkpoint.bpu)
+    simulator.pc.cur_pc = checkpoint.pc
+    counts = simulator.attach_counters().counts
+
+    while not simulator.finished and counts[perf_counters.USEFUL] < warmup:
+        simulator.step()
+    start_cycle = simulator.cycle
+    start_fetched = simulator.instruction_count
+    end = counts[perf_counters.USEFUL] + length
+    while not simulator.finished and counts[perf_counters.USEFUL] < end:
+        simulator.step()
+    return simulator.cycle - start_cycle, simulator.instruction_count - start_fetched
+
+
+def estimate(instructions, data, config=None, interval=10000, max_clusters=10, samples=2, warmup=500, seed=0):
+    # SimPoint-style sampled run. Intervals are clustered by basic-block
+    # vector and the `samples` intervals nearest each centroid are simulated
+    # in detail. Cycles and fetched instructions per useful instruction of a
+    # cluster are the mean over its samples; the whole-program totals weight
+    # each cluster by its instruction count. The error is the 95% interval of
+    # a stratified sample, from the spread of CPI within each cluster.
+    config = SimConfig() if config is None else config
+    bbvs, lengths, _ = functional_pass(instructions, data, config, interval)
+    points = normalize(bbvs)
+    labels, centroids, _ = cluster(points, max_clusters, seed)
+
+    chosen = {}
+    for c, centroid in enumerate(centroids):
+        members = sorted((idx for idx, label in enumerate(labels) if label == c),
+                         key=lambda idx: distance(points[idx], centroid))
+        if members:
+            chosen[c] = members[:samples]
+    _, _, checkpoints = functional_pass(instructions, data, config, interval,
+                                        capture={idx for members in chosen.values() for idx in members})
+
+    cycles = fetched = variance = 0.0
+    detailed = 0
+    clusters = []
+    for c, members in chosen.items():
+        size = sum(1 for label in labels if label == c)
+        weight = sum(length for length, label in zip(lengths, labels) if label == c)
+        cpis = []
+        fpis = []
+        for idx in members:
+            interval_cycles, interval_fetched = measure(instructions, config, checkpoints[idx], lengths[idx], warmup)
+            detailed += lengths[idx] + warmup
+            cpis.append(interval_cycles / lengths[idx])
+            fpis.append(interval_fetched / lengths[idx])
+        cpi = sum(cpis) / len(cpis)
+        cycles += weight * cpi
+        fetched += weight * sum(fpis) / len(fpis)
+        if len(cpis) > 1:
+            spread = sum((value - cpi) ** 2 for value in cpis) / (len(cpis) - 1)
+            variance += weight ** 2 * spread / len(cpis) * (1 - len(cpis) / size)
+        clusters.append({'intervals': size, 'instructions': weight, 'samples': members, 'cpi': cpi})
+
+    ipc = fetched / cycles
+    return {'intervals': len(lengths),
+            'instructions': sum(lengths),
+            'clusters': clusters,
+            'detailed_instructions': detailed,
+            'cycles': round(cycles),
+            'ipc': ipc,
+            'ipc_error': ipc * Z_95 * math.sqrt(variance) / cycles}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='estimate IPC from a few cycle-accurate intervals')
+    parser.add_argument('ins_mem', nargs='?', default='ins_mem.txt')
+    parser.add_argument('data_mem', nargs='?', default='data_mem.txt')
+    parser.add_argument('--interval', type=int, default=10000, metavar='INSTRUCTIONS',
+                        help='interval length (default: %(default)s)')
+    parser.add_argument('--max-clusters', type=int, default=10, metavar='K')
+    parser.add_argument('--samples', type=int, default=2, metavar='N',
+                        help='intervals simulated in detail per cluster (default: %(default)s)')
+    parser.add_argument('--warmup', type=int, default=500, metavar='INSTRUCTIONS',
+                        help='detailed warm-up before each measured interval (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--predictor', default='bimodal', metavar='SPEC')
+    parser.add_argument('--full', action='store_true', help='also run the whole program in detail to compare')
+    args = parser.parse_args()
+
+    instructions = batch.read_instructions(args.ins_mem)
+    data = DataMem.read_text(args.data_mem)
+    config = SimConfig(predictor=args.predictor)
+    result = estimate(instructions, data, config, args.interval, args.max_clusters, args.samples, args.warmup,
+                      args.seed)
+    print(f'{result["intervals"]} intervals, {len(result["clusters"])} clusters, '
+          f'{result["detailed_instructions"]} of {result["instructions"]} instructions in detail')
+    for c, cluster_result in enumerate(result['clusters']):
+        print(f'  cluster {c}: {cluster_result["intervals"]} intervals, samples {cluster_result["samples"]}, '
+              f'CPI {cluster_result["cpi"]:.4f}')
+    print(f'IPC: {result["ipc"]:.4f} +- {result["ipc_error"]:.4f}')
+    if args.full:
+        print(f'IPC (full run): {Simulator(instructions=instructions, data=data, config=config).run().ipc:.4f}')
@@ -0,0 +1,65 @@
+MASK64 = (1 << 64) - 1
+
+PC_TAG = 0
+RF_TAG = 1
+DM_TAG = 2
+
+
+def mix(x):
+    # splitmix64 finalizer
+    x = ((x ^ (x >> 30)) * 0xbf58476d1ce4e5b9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94d049bb133111eb) & MASK64
+    return x ^ (x >> 31)
+
+
+def term(tag, index, value):
+    # values are hashed as 32-bit words, so the signed and unsigned forms the
+    # CAS keeps for the same word, and the RTL's, all hash alike
+    return mix((tag << 56) | (index << 32) | (value & 0xffffffff))
+
+
+def state_hash(pc, registers, data_mem_array):
+    # The digest is the sum of one term per PC, register and memory word, so
+    # a write changes it by the difference of two terms. testbenches/
+    # test_processor.py computes the same function from the RTL.
+    total = term(PC_TAG, 0, pc)
+    for reg_num, value in enumerate(registers):
+        total += term(RF_TAG, reg_num, value)
+    for address, value in enumerate(data_mem_array):
+        total += term(DM_TAG, address, value)
+    return total & MASK64
+
+
+class StateHash:
+    # Keeps the RF and DM part of state_hash() up to date by wrapping
+    # write_rf/write_dm, the same way the tracer does.
+    def __init__(self, rf, data_mem):
+        self.rf = rf
+        self.data_mem = data_mem
+        self.total = 0
+        self.reset()
+
+    def reset(self):
+        # full recompute, e.g. after a checkpoint is restored
+        self.total = state_hash(0, self.rf.registers, self.data_mem.data_mem_array) - term(PC_TAG, 0, 0)
+
+    def attach(self):
+        rf = self.rf
+        data_mem = self.data_mem
+        write_rf = rf.write_rf
+        write_dm = data_mem.write_dm
+
+        def hashed_write_rf(reg_num, write_data):
+            if reg_num != 0:
+                self.total += term(RF_TAG, reg_num, write_data) - term(RF_TAG, reg_num, rf.registers[reg_num])
+            write_rf(reg_num, write_data)
+
+        def hashed_write_dm(address, data):
+            self.total += term(DM_TAG, address, data) - term(DM_TAG, address, data_mem.data_mem_array[address])
+            write_dm(address, data)
+
+        rf.write_rf = hashed_write_rf
+        data_mem.write_dm = hashed_write_dm
+
+    def digest(self, pc):
+        return (self.total + term(PC_TAG, 0, pc)) & MASK64
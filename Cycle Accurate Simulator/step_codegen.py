@@ -0,0 +1,523 @@
+import hashlib
+import importlib.util
+import os
+import re
+from collections import namedtuple
+
+from block_cache import ALU_EXPRESSIONS
+
+# bumped whenever generate() changes the code it emits for a description
+GENERATOR_VERSION = 3
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.step_cache')
+
+# step functions already loaded by this process, by cache file
+LOADED = {}
+
+# Datapath description. Expressions are Python; `X<lane>.field` reads a field
+# of lane <lane> (from 1) of the current latch X, and everything else is a
+# wire defined earlier, a local bound in prologue() or a name from the
+# namespace given to load_step().
+Wire = namedtuple('Wire', ['out', 'expr'])
+Mux = namedtuple('Mux', ['out', 'sel', 'inputs'])
+Alu = namedtuple('Alu', ['out', 'operand1', 'operand2', 'shamt', 'op_sel'])
+# fields is a tuple of (field, expression) written to the next latch
+Latch = namedtuple('Latch', ['latch', 'fields'])
+If = namedtuple('If', ['cond', 'then', 'otherwise'], defaults=[()])
+# a statement with side effects, e.g. an RF or DM write
+Do = namedtuple('Do', ['statement'])
+# a data value the control path depends on (a branch outcome or jr target);
+# a plain wire, except that the vector backend returns it as the split key
+# when the instances disagree on it
+Control = namedtuple('Control', ['out', 'expr'])
+Stage = namedtuple('Stage', ['name', 'nodes'])
+# what datapath() returns: the issue width and the stages of one cycle
+Datapath = namedtuple('Datapath', ['width', 'stages'])
+
+LATCHES = {'D': 'if_id', 'E': 'id_ex', 'M': 'ex_mem', 'W': 'mem_wb'}
+LATCH_READ = re.compile(r'\b([DEMW])(\d+)\.(\w+)')
+IDENTIFIER = re.compile(r'[A-Za-z_]\w*$')
+
+
+def prologue(width):
+    lanes = range(1, width + 1)
+    return [
+        'state = self.state',
+        'new_state = self.new_state',
+    ] + [f'{latch}{lane} = state.{latch}[{lane - 1}]' for latch in LATCHES.values() for lane in lanes] + \
+        [f'new_{latch}{lane} = new_state.{latch}[{lane - 1}]' for latch in LATCHES.values() for lane in lanes] + [
+        'rf = self.rf',
+        'read_rf = rf.read_rf',
+        'write_rf = rf.write_rf',
+        'data_mem = self.data_mem',
+        'read_dm = data_mem.read_dm',
+        'write_dm = data_mem.write_dm',
+        'instructions = self.ins_mem.instructions',
+        'pc = self.pc',
+        'cur_pc = pc.cur_pc',
+        'branch_predictor = self.branch_predictor',
+        'predict = branch_predictor.predict',
+        'update = branch_predictor.update',
+        'lookup = branch_predictor.btb.lookup',
+        'cycle = self.cycle',
+        'enable = self.enable',
+        'instruction_count = self.instruction_count',
+        'nop_count = self.nop_count',
+        'pc_mask = self.pc_mask',
+    ]
+
+
+EPILOGUE = [
+    'self.cycle = cycle + 1',
+    'self.instruction_count = instruction_count',
+    'self.nop_count = nop_count',
+    'self.state, self.new_state = new_state, state',
+]
+
+
+def joined(terms, operator=' | ', empty='0'):
+    return operator.join(terms) if terms else empty
+
+
+def forward_select(src, name, sources):
+    # the first source in priority order that writes src, as
+    # ForwardingUnit.forward()
+    return Wire(name, ' else '.join(f'{idx} if {src} & from_{source}' for idx, source in enumerate(sources, 1)) +
+                ' else 0')
+
+
+def ex_lane(lane, sources):
+    E = f'E{lane}'
+    return If(f'{E}.instruction is NOP', (
+        Wire(f'forward_mux_A{lane}_out', '0'),
+        Wire(f'forward_mux_B{lane}_out', '0'),
+        Wire(f'alu_result{lane}', '0'),
+        Wire(f'reg_dst_mux{lane}', '0'),
+    ), (
+        Mux(f'forward_mux_A{lane}_out', f'forwardA{lane}', (f'{E}.read_data1',) + sources),
+        Mux(f'forward_mux_B{lane}_out', f'forwardB{lane}', (f'{E}.read_data2',) + sources),
+        Mux(f'alu_mux{lane}', f'{E}.alu_src', (f'forward_mux_B{lane}_out', f'{E}.ext_imm')),
+        Alu(f'alu_result{lane}', f'forward_mux_A{lane}_out', f'alu_mux{lane}', f'{E}.shamt', f'{E}.alu_op'),
+        Mux(f'reg_dst_mux{lane}', f'{E}.reg_dst', (f'{E}.rt', f'{E}.rd', '31')),
+    ))
+
+
+def id_ex_fields(lane, decoded, control, read_data):
+    return (
+        ('I_26', f'{decoded}.I_26'),
+        ('branch', f'{control}.branch'),
+        ('mem_read', f'{control}.mem_read'),
+        ('mem_write', f'{control}.mem_write'),
+        ('mem_to_reg', f'{control}.mem_to_reg'),
+        ('reg_write', f'{control}.reg_write'),
+        ('alu_op', f'{control}.alu_op'),
+        ('reg_dst', f'{control}.reg_dst'),
+        ('alu_src', f'{control}.alu_src'),
+        ('read_data1', read_data[0]),
+        ('read_data2', read_data[1]),
+        ('ext_imm', f'{decoded}.imm'),
+        ('rs', f'{decoded}.rs'),
+        ('rt', f'{decoded}.rt'),
+        ('rd', f'{decoded}.rd'),
+        ('shamt', f'{decoded}.shamt'),
+        ('prediction', f'D{lane}.prediction'),
+        ('instruction', f'D{lane}.instruction'),
+    )
+
+
+def count_nops(fetched):
+    # nop_count of Simulator.step(): the trailing NOPs of the packet are
+    # added, a packet ending in an instruction resets it
+    node = Do(f'nop_count += {fetched}')
+    for lane in range(1, fetched + 1):
+        node = If(f'instruction{lane}.word',
+                  (Do('nop_count = 0' if lane == fetched else f'nop_count += {fetched - lane}'),), (node,))
+    return (node,)
+
+
+def fetch_lane(lane, width):
+    # Lane 1 fetches at the PC and lane 2 after it, or at lane 1's BTB
+    # target. A later lane is fetched after the lane before it and may split
+    # the packet (main.splits()); the lanes from the split on hold a NOP and
+    # the PC moves to the split lane.
+    if lane > width:
+        return (
+            Mux('branch_mux', f'prediction{width}', (f'(address{width} + 1) & pc_mask', f'branch_adder_result{width}')),
+        ) + count_nops(width)
+    predicted = (
+        # lane 2 predicts at PC + 1 even when it was fetched from a BTB
+        # target, as in the RTL; later lanes predict at their own address
+        Wire(f'prediction{lane}', f'predict({predict_pc(lane)})'),
+        Wire(f'branch_adder_result{lane}', f'(cur_pc + {lane} + instruction{lane}.target) & pc_mask'),
+    ) + fetch_lane(lane + 1, width)
+    if lane == 1:
+        return (Wire('address1', 'cur_pc'), Wire('instruction1', 'instructions[cur_pc]')) + predicted
+    fetch = (
+        Wire(f'btb_target{lane}', f'lookup({predict_pc(lane - 1)}) if prediction{lane - 1} else None'),
+        Wire(f'address{lane}', f'(address{lane - 1} + 1) & pc_mask if btb_target{lane} is None else btb_target{lane}'),
+        Wire(f'instruction{lane}', f'instructions[address{lane}]'),
+    )
+    if lane == 2:
+        return fetch + predicted
+    earlier = ', '.join(f'instruction{other}' for other in range(1, lane))
+    split = tuple(node for other in range(lane, width + 1) for node in (
+        Wire(f'instruction{other}', 'NOP'),
+        Wire(f'prediction{other}', '0'),
+        Wire(f'branch_adder_result{other}', '0'),
+    )) + (Wire('branch_mux', f'address{lane}'),) + count_nops(lane - 1)
+    return fetch + (If(f'splits(instruction{lane}, [{earlier}])', split, predicted),)
+
+
+def predict_pc(lane):
+    return 'cur_pc' if lane == 1 else 'pc_plus_1' if lane == 2 else f'address{lane}'
+
+
+def youngest(values, selects, oldest):
+    # the value of the youngest lane whose select is set, else `oldest`
+    return ' else '.join([f'{value} if {select}' for value, select in reversed(list(zip(values, selects)))] +
+                         [oldest])
+
+
+def datapath(forwarding_paths, width=2):
+    # The pipeline of Simulator.step() for `width` lanes, with
+    # ForwardingUnit, the corrected PC and the HDU flushes written out as
+    # wires. Only the stall checks for disabled forwarding paths depend on
+    # the configuration. Every side effect that cannot be repeated
+    # (predictor training, PC, counters, tracing) comes after the last
+    # Control node, so the vector backend can return from a cycle and run it
+    # again; RF and DM writes before that point write the same values the
+    # second time.
+    lanes = range(1, width + 1)
+    later = range(2, width + 1)
+
+    forward_waits = []
+    for lane in lanes:
+        # lanes past the second follow the second lane's paths
+        path = min(lane, 2)
+        if f'M{path}' not in forwarding_paths:
+            forward_waits.append(f'(dst_E{lane} if E{lane}.reg_write else 0)')
+        if f'W{path}' not in forwarding_paths:
+            forward_waits.append(f'written_M{lane}')
+    dst_E = joined([f'dst_E{lane}' for lane in lanes] + ['dst_M'])
+    stall = f'LOAD_USE_STALL if loads_E & src_D else JR_STALL if jr_D & ({dst_E}) else '
+    if forward_waits:
+        stall += f'FORWARD_STALL if ({" | ".join(forward_waits)}) & src_D else 0'
+    else:
+        stall += '0'
+
+    # Forwarding sources in priority order, every MEM lane and then every WB
+    # lane. With two lanes, M2 and W2 are also blocked by the lane 1 MEM
+    # destination, as in the RTL.
+    sources = [f'M{lane}' for lane in lanes] + [f'W{lane}' for lane in lanes]
+    from_sources = []
+    for idx, source in enumerate(sources):
+        masked = [f'written_{higher}' for higher in sources[:idx]]
+        if width == 2 and idx & 1:
+            masked.append('dst_M1')
+        from_sources.append(Wire(f'from_{source}', f'written_{source} & ~({" | ".join(masked)})'
+                                 if masked else f'written_{source}'))
+    mux_sources = tuple(f'M{lane}.alu_result' for lane in lanes) + tuple(f'WB_data{lane}' for lane in lanes)
+
+    def branch_source(lane, side, field):
+        # the youngest older lane writing the branch comparator's register;
+        # this path does match register 0
+        older_lanes = range(1, lane)
+        writes = [f'M{older}.reg_write and M{older}.write_register == M{lane}.{field}' for older in older_lanes]
+        return Wire(f'forward_branch_{side}{lane}', f'({youngest(older_lanes, writes, "0")}) if M{lane}.branch else 0')
+
+    def comparator(lane, side):
+        return f'M1.forward_{side}_mux_out' if lane == 1 else f'comp_source_mux_{side}{lane}'
+
+    def store(lane):
+        # the oldest storing lane writes memory
+        if lane > width:
+            return ()
+        return (If(f'M{lane}.mem_write', (Do(f'write_dm(M{lane}.alu_result, M{lane}.forward_B_mux_out)'),),
+                   store(lane + 1)),)
+
+    def packet_pc(offset):
+        # the PCs of a packet are latched with lane 1 only
+        return {0: 'M1.pc', 1: 'M1.pc_plus_1', 2: 'M1.pc_plus_2'}.get(offset, f'(M1.pc + {offset}) & pc_mask')
+
+    def link(lane):
+        # a jal in lane `lane` links to the instruction after it
+        return '(W1.pc_plus_2 - 1) & pc_mask' if lane == 1 else \
+            'W1.pc_plus_2' if lane == 2 else f'(W1.pc_plus_2 + {lane - 2}) & pc_mask'
+
+    pc_src = [f'control_signals{lane}.pc_src' for lane in lanes]
+    mispredicts = [f'mispredict{lane}' for lane in lanes]
+
+    stages = (
+        Stage('WB', tuple(
+            # a write to r0 is dropped and never forwarded, so it is not computed
+            If(f'W{lane}.reg_write == 1 and W{lane}.write_register', (
+                Mux(f'WB_data{lane}', f'W{lane}.mem_to_reg',
+                    (f'W{lane}.alu_result', f'W{lane}.memory_read_data', link(lane))),
+                Do(f'write_rf(W{lane}.write_register, WB_data{lane})'),
+            ), (
+                Wire(f'WB_data{lane}', '0'),
+            )) for lane in lanes)),
+        Stage('FORWARDING',
+              tuple(Wire(f'dst_M{lane}', f'REG_BIT[M{lane}.write_register]') for lane in lanes) +
+              (Wire('dst_M', joined([f'dst_M{lane}' for lane in lanes])),) +
+              tuple(Wire(f'written_M{lane}', f'dst_M{lane} if M{lane}.reg_write else 0') for lane in lanes) +
+              tuple(Wire(f'written_W{lane}', f'REG_BIT[W{lane}.write_register] if W{lane}.reg_write else 0')
+                    for lane in lanes) +
+              tuple(from_sources) +
+              tuple(node for lane in lanes for node in (
+                  forward_select(f'REG_BIT[E{lane}.rs]', f'forwardA{lane}', sources),
+                  forward_select(f'REG_BIT[E{lane}.rt]', f'forwardB{lane}', sources),
+              )) +
+              tuple(node for lane in later for node in (branch_source(lane, 'A', 'rs'), branch_source(lane, 'B', 'rt')))),
+        Stage('MEM', store(1) + tuple(
+            Latch(f'mem_wb{lane}', (('memory_read_data', f'read_dm(M{lane}.alu_result) if M{lane}.mem_read else 0'),))
+            for lane in lanes) + tuple(node for lane in later for node in (
+                Mux(f'comp_source_mux_A{lane}', f'forward_branch_A{lane}',
+                    (f'M{lane}.forward_A_mux_out',) + tuple(f'M{older}.alu_result' for older in range(1, lane))),
+                Mux(f'comp_source_mux_B{lane}', f'forward_branch_B{lane}',
+                    (f'M{lane}.forward_B_mux_out',) + tuple(f'M{older}.alu_result' for older in range(1, lane))),
+            )) + tuple(
+            # branch & ~(I_26 ^ ~zero) of Simulator.step()
+            Control(f'branch_taken{lane}', f'M{lane}.branch & (({comparator(lane, "A")} == {comparator(lane, "B")}) '
+                                           f'^ M{lane}.I_26)')
+            for lane in lanes) + tuple(node for lane in lanes for node in (
+                Wire(f'mispredict{lane}', f'(branch_taken{lane} ^ M{lane}.prediction) & M{lane}.branch'),
+                Wire(f'corrected_pc{lane}', f'M{lane}.branch_adder_result if mispredict{lane} and branch_taken{lane} '
+                                            f'else {packet_pc(lane)}'),
+            )) + (
+            Wire('cpc_signal', joined(mispredicts)),
+        ) + tuple(
+            Latch(f'mem_wb{lane}', (
+                ('reg_write', f'M{lane}.reg_write'),
+                ('mem_to_reg', f'M{lane}.mem_to_reg'),
+                ('alu_result', f'M{lane}.alu_result'),
+                ('write_register', f'M{lane}.write_register'),
+                ('instruction', f'M{lane}.instruction'),
+            ) + ((('pc_plus_2', 'M1.pc_plus_2'),) if lane == 1 else ()))
+            for lane in lanes)),
+        # a NOP or flushed lane has r0 for every register field and reads 0,
+        # so every mux and the ALU give 0
+        Stage('EX', tuple(ex_lane(lane, mux_sources) for lane in lanes) + tuple(
+            Latch(f'ex_mem{lane}', ((
+                ('pc', 'E1.pc'),
+                ('pc_plus_1', 'E1.pc_plus_1'),
+                ('pc_plus_2', 'E1.pc_plus_2'),
+            ) if lane == 1 else ()) + (
+                ('branch_adder_result', f'E{lane}.branch_adder_result'),
+                ('reg_write', f'E{lane}.reg_write'),
+                ('mem_to_reg', f'E{lane}.mem_to_reg'),
+                ('mem_write', f'E{lane}.mem_write'),
+                ('mem_read', f'E{lane}.mem_read'),
+            ) + ((
+                ('rs', f'E{lane}.rs'),
+                ('rt', f'E{lane}.rt'),
+            ) if lane > 1 else ()) + (
+                ('branch', f'E{lane}.branch'),
+                ('I_26', f'E{lane}.I_26'),
+                ('prediction', f'E{lane}.prediction'),
+                ('alu_result', f'alu_result{lane}'),
+                ('forward_B_mux_out', f'forward_mux_B{lane}_out'),
+                ('forward_A_mux_out', f'forward_mux_A{lane}_out'),
+                ('write_register', f'reg_dst_mux{lane}'),
+                ('instruction', f'E{lane}.instruction'),
+            )) for lane in lanes)),
+        # stall is ForwardingUnit.stall()
+        Stage('ID', tuple(Wire(f'decoded{lane}', f'D{lane}.instruction') for lane in lanes) + tuple(
+            Wire(f'dst_E{lane}', f'REG_BIT[reg_dst_mux{lane}]') for lane in lanes) + (
+            Wire('loads_E', joined([f'(dst_E{lane} if E{lane}.mem_read else 0)' for lane in lanes])),
+            Wire('src_D', joined([f'REG_BIT[decoded{lane}.rs] | REG_BIT[decoded{lane}.rt]' for lane in lanes])),
+            Wire('jr_D', joined([f'(REG_BIT[decoded{lane}.rs] if decoded{lane}.is_jr else 0)' for lane in lanes])),
+            Wire('stall', stall),
+        ) + tuple(Wire(f'control_signals{lane}', f'STALL_SIGNALS if stall else decoded{lane}.control')
+                  for lane in lanes) + tuple(
+            If(f'decoded{lane} is NOP', (
+                Wire(f'read_data{2 * lane - 1}', '0'),
+                Wire(f'read_data{2 * lane}', '0'),
+            ), (
+                Wire(f'read_data{2 * lane - 1}', f'read_rf(decoded{lane}.rs)'),
+                Wire(f'read_data{2 * lane}', f'read_rf(decoded{lane}.rt)'),
+            )) for lane in lanes) + tuple(
+            # only a jr jumps to a register value
+            Control(f'jr_target{lane}', f'read_data{2 * lane - 1} & pc_mask if decoded{lane}.is_jr else 0')
+            for lane in lanes) + tuple(
+            Latch(f'id_ex{lane}', ((('branch_adder_result', f'D{lane}.branch_adder_result'),) +
+                                   id_ex_fields(lane, f'decoded{lane}', f'control_signals{lane}',
+                                                (f'read_data{2 * lane - 1}', f'read_data{2 * lane}')) +
+                                   ((('pc', 'D1.pc'), ('pc_plus_1', 'D1.pc_plus_1'), ('pc_plus_2', 'D1.pc_plus_2'))
+                                    if lane == 1 else ())))
+            for lane in lanes)),
+        Stage('IF', tuple(
+            # the MEM stage branches train the predictor before it predicts
+            If(f'M{lane}.branch', (
+                Do(f'update({packet_pc(lane - 1)}, branch_taken{lane}, M{lane}.branch_adder_result)'),
+            )) for lane in lanes) + (
+            Wire('pc_plus_1', '(cur_pc + 1) & pc_mask'),
+            Wire('pc_plus_2', '(cur_pc + 2) & pc_mask'),
+        ) + fetch_lane(1, width) + tuple(
+            If(f'instruction{lane}.word', (Do('instruction_count += 1'),)) for lane in lanes) + tuple(
+            Mux(f'jump_mux{lane}', f'control_signals{lane}.jump', (f'jr_target{lane}', f'decoded{lane}.target'))
+            for lane in lanes) + (
+            # the youngest jump and the youngest misprediction pick the PC
+            Wire('jump_mux', youngest([f'jump_mux{lane}' for lane in later], pc_src[1:], 'jump_mux1')),
+            Wire('jumped', joined(pc_src)),
+            Mux('pc_mux', 'jumped', ('branch_mux', 'jump_mux')),
+            Wire('cpc_mux', youngest([f'corrected_pc{lane}' for lane in later], mispredicts[1:], 'corrected_pc1')),
+            Mux('next_pc_mux', 'cpc_signal', ('pc_mux', 'cpc_mux')),
+            If('self.dump_interval and not cycle % self.dump_interval', (
+                Do("logger.warning(f'cycle: {cycle}, PC: {cur_pc}')"),
+                Do('data_mem.persist()'),
+            )),
+            Wire('enable_pc_IF_ID', '(not stall) and enable or cpc_signal'),
+            If('enable_pc_IF_ID', (
+                Latch('if_id1', (
+                    ('pc_plus_2', 'pc_plus_2'),
+                    ('pc_plus_1', 'pc_plus_1'),
+                    ('pc', 'cur_pc'),
+                )),
+            ) + tuple(
+                Latch(f'if_id{lane}', (
+                    ('branch_adder_result', f'branch_adder_result{lane}'),
+                    ('prediction', f'prediction{lane}'),
+                    ('instruction', f'instruction{lane}'),
+                )) for lane in lanes) + (
+                Do('pc.cur_pc = next_pc_mux'),
+            ), tuple(Do(f'new_if_id{lane}.copy_from(if_id{lane})') for lane in lanes)),
+            If('self.hash_interval and not cycle % self.hash_interval', (
+                Do("logger.info(f'STATE_HASH cycle: {cycle}, PC: {cur_pc}, "
+                   "hash: {self.state_hash.digest(cur_pc):016x}')"),
+            )),
+            If('self.tracer is not None', (
+                Do(f'self.tracer.cycle(cycle, cur_pc, [{", ".join(f"instruction{lane}.word" for lane in lanes)}])'),
+            )),
+        )),
+        Stage('HAZARDS', (
+            If('cpc_signal | jumped', tuple(Do(f'new_if_id{lane}.reset()') for lane in lanes)),
+            # a misprediction flushes EX and ID, a jump the younger lanes of
+            # its packet in ID
+            If('cpc_signal', tuple(Do(f'new_{latch}{lane}.reset()') for latch in ('id_ex', 'ex_mem') for lane in lanes),
+               tuple(If(joined(pc_src[:lane - 1]), (Do(f'new_id_ex{lane}.reset()'),)) for lane in later)),
+        ) + tuple(
+            # a misprediction squashes the younger lanes of its packet in MEM
+            If(joined(mispredicts[:lane - 1]), (Do(f'new_mem_wb{lane}.reset()'),)) for lane in later) + (
+            If('self.counters is not None', (
+                Do(f'self.counters.record_cycle(stall, [{", ".join(f"decoded{lane}.word" for lane in lanes)}], '
+                   f'HDU([{", ".join(f"M{lane}.branch" for lane in lanes)}], '
+                   f'[{", ".join(f"M{lane}.prediction" for lane in lanes)}], '
+                   f'[{", ".join(f"branch_taken{lane}" for lane in lanes)}], [{", ".join(pc_src)}]))'),
+            )),
+        )),
+    )
+    return Datapath(width, stages)
+
+
+class Generator:
+    # vector: emit the NumPy backend used by lockstep.py, where data values
+    # are arrays with one entry per instance. Its namespace must supply
+    # alu(), uniform() and first().
+    def __init__(self, vector=False):
+        self.vector = vector
+        self.lines = []
+        self.reads = set()
+        self.temps = 0
+
+    def expr(self, text):
+        def local(match):
+            self.reads.add((match.group(1), int(match.group(2)), match.group(3)))
+            return f'{match.group(1)}{match.group(2)}_{match.group(3)}'
+        return LATCH_READ.sub(local, text)
+
+    def emit(self, nodes, indent):
+        pad = '    ' * indent
+        for node in nodes:
+            if isinstance(node, Stage):
+                self.lines.append(f'{pad}# {"-" * 20}{node.name} STAGE{"-" * 18} #')
+                self.emit(node.nodes, indent)
+            elif isinstance(node, Wire):
+                self.lines.append(f'{pad}{node.out} = {self.expr(node.expr)}')
+            elif isinstance(node, Mux):
+                sel = self.expr(node.sel)
+                if not IDENTIFIER.match(sel):
+                    self.lines.append(f'{pad}{node.out}_sel = {sel}')
+                    sel = f'{node.out}_sel'
+                inputs = [f'({self.expr(value)})' for value in node.inputs]
+                if len(inputs) == 2:
+                    value = f'{inputs[1]} if {sel} else {inputs[0]}'
+                else:
+                    value = ' else '.join(f'{value} if {sel} == {idx}' for idx, value in enumerate(inputs[:-1]))
+                    value += f' else {inputs[-1]}'
+                self.lines.append(f'{pad}{node.out} = {value}')
+            elif isinstance(node, Control):
+                self.lines.append(f'{pad}{node.out} = {self.expr(node.expr)}')
+                if self.vector:
+                    self.lines.append(f'{pad}if not uniform({node.out}):')
+                    self.lines.append(f'{pad}    return {node.out}')
+                    self.lines.append(f'{pad}{node.out} = first({node.out})')
+            elif isinstance(node, Alu) and self.vector:
+                self.lines.append(f'{pad}{node.out} = alu({self.expr(node.operand1)}, {self.expr(node.operand2)}, '
+                                  f'{self.expr(node.shamt)}, {self.expr(node.op_sel)})')
+            elif isinstance(node, Alu):
+                operands = {'a': f'{node.out}_a', 'b': f'{node.out}_b', 'shamt': f'{node.out}_shamt'}
+                self.lines.append(f'{pad}{node.out}_a = {self.expr(node.operand1)}')
+                self.lines.append(f'{pad}{node.out}_b = {self.expr(node.operand2)}')
+                self.lines.append(f'{pad}{node.out}_shamt = {self.expr(node.shamt)}')
+                self.lines.append(f'{pad}{node.out}_op = {self.expr(node.op_sel)}')
+                value = ' else '.join(f'({expression.format(**operands)}) if {node.out}_op == {op}'
+                                      for op, expression in sorted(ALU_EXPRESSIONS.items()))
+                self.lines.append(f'{pad}{node.out} = {value} else 0')
+            elif isinstance(node, Latch):
+                for field, value in node.fields:
+                    self.lines.append(f'{pad}new_{node.latch}.{field} = {self.expr(value)}')
+            elif isinstance(node, If):
+                self.lines.append(f'{pad}if {self.expr(node.cond)}:')
+                self.emit(node.then, indent + 1)
+                if node.otherwise:
+                    self.lines.append(f'{pad}else:')
+                    self.emit(node.otherwise, indent + 1)
+            elif isinstance(node, Do):
+                self.lines.append(f'{pad}{self.expr(node.statement)}')
+            else:
+                raise TypeError(f'unknown datapath node {node!r}')
+
+
+def generate(description, vector=False):
+    # returns the source of `def step(self)` for a datapath description
+    generator = Generator(vector)
+    generator.emit(description.stages, 1)
+    loads = [f'    {prefix}{lane}_{field} = {LATCHES[prefix]}{lane}.{field}'
+             for prefix, lane, field in sorted(generator.reads)]
+    backend = 'vector' if vector else 'scalar'
+    return '\n'.join([f'# generated by step_codegen.py (version {GENERATOR_VERSION}, {backend}, '
+                      f'width {description.width}); do not edit',
+                      '',
+                      '',
+                      'def step(self):'] +
+                     [f'    {line}' for line in prologue(description.width)] + loads + generator.lines +
+                     [f'    {line}' for line in EPILOGUE]) + '\n'
+
+
+def description_key(description, vector=False):
+    return hashlib.sha256(f'{GENERATOR_VERSION} {vector} {description!r}'.encode()).hexdigest()[:16]
+
+
+def load_step(description, namespace, cache_dir=CACHE_DIR, vector=False):
+    # The generated source is written once per description to
+    # cache_dir/step_<key>.py and imported from there, so later runs skip
+    # generation and reuse the byte code Python caches next to it. namespace
+    # supplies the globals the description refers to (NOP, HDU, ...).
+    path = os.path.join(cache_dir, f'step_{description_key(description, vector)}.py')
+    if path in LOADED:
+        return LOADED[path]
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        # written under a temporary name so a concurrent run never imports a
+        # half-written file
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(generate(description, vector))
+        os.replace(temp_path, path)
+    spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(path))[0], path)
+    module = importlib.util.module_from_spec(spec)
+    module.__dict__.update(namespace)
+    spec.loader.exec_module(module)
+    LOADED[path] = module.step
+    return module.step
@@ -0,0 +1,160 @@
+import argparse
+import csv
+import glob
+import hashlib
+import itertools
+import json
+import os
+import sys
+
+import batch
+from main import SimConfig
+
+RESULT_COLUMNS = [column for column in batch.COLUMNS if column != 'name']
+
+
+def file_hash(*paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+        digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+# Every source of the simulator, so a change to the datapath, the predictors
+# or anything else in this directory invalidates the cached results
+SIMULATOR_VERSION = file_hash(*sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))))
+
+
+def config_hash(config):
+    # defaults are filled in first, so an omitted field and its default value
+    # share one cache entry
+    limits = {key: config[key] for key in ('max_cycles', 'timeout') if key in config}
+    fields = {key: value for key, value in config.items() if key not in limits}
+    if 'forwarding' in fields:
+        fields['forwarding'] = sorted(fields['forwarding'])
+    full = {**SimConfig(**fields)._asdict(), **limits}
+    return hashlib.sha256(json.dumps(full, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def expand(space):
+    # {"field": [values, ...]} -> one config per point of the cartesian product
+    fields = sorted(space)
+    return [dict(zip(fields, values)) for values in itertools.product(*(space[field] for field in fields))]
+
+
+class ResultCache:
+    # one JSON file per (simulator version, program hash, config hash); only
+    # finished runs are kept
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, '_'.join(key) + '.json')
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, result):
+        if result['status'] == 'ok':
+            with open(self.path(key), 'w') as f:
+                json.dump(result, f)
+
+
+def sweep(programs, space, cache, workers=None, limits=None):
+    # Returns one row per (program, config). Points found in the cache are not
+    # run again; the rest go through batch.run_batch() in one pool.
+    rows = []
+    pending = []
+    for program in programs:
+        try:
+            program_key = file_hash(program['ins_mem'], program['data_mem'])
+        except OSError as e:
+            # as batch.run_job() reports it; the other programs still run
+            program_key = None
+            error = f'error: {e}'
+        for config in expand(space):
+            config = {**(limits or {}), **config}
+            row = {'program': program['name'], **config}
+            rows.append(row)
+            if program_key is None:
+                row['status'] = error
+                continue
+            key = (SIMULATOR_VERSION, program_key, config_hash(config))
+            result = cache.get(key)
+            if result is None:
+                pending.append((row, key, {'name': program['name'], 'ins_mem': program['ins_mem'],
+                                           'data_mem': program['data_mem'], 'config': config}))
+            else:
+                row.update(result)
+
+    results = batch.run_batch([job for _, _, job in pending], workers=workers) if pending else []
+    for (row, key, _), result in zip(pending, results):
+        del result['name']
+        cache.put(key, result)
+        row.update(result)
+    return rows
+
+
+def sort_rows(rows, key):
+    # '-field' sorts descending; rows missing the field (failed runs) go last
+    descending = key.startswith('-')
+    field = key.lstrip('-')
+    present = [row for row in rows if row.get(field) is not None]
+    missing = [row for row in rows if row.get(field) is None]
+    return sorted(present, key=lambda row: row[field], reverse=descending) + missing
+
+
+def write_rows(rows, space, out, fmt):
+    if fmt == 'json':
+        json.dump(rows, out, indent=4)
+        out.write('\n')
+        return
+    columns = ['program'] + sorted(space) + RESULT_COLUMNS
+    writer = csv.DictWriter(out, fieldnames=columns, extrasaction='ignore')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow({key: ' '.join(value) if isinstance(value, list) else value
+                         for key, value in row.items()})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='evaluate every combination of CAS parameters')
+    parser.add_argument('programs', help='batch.py manifest of programs (config entries are ignored)')
+    parser.add_argument('space', help='JSON object mapping SimConfig fields to lists of values')
+    parser.add_argument('-o', '--output', help='result file (default: stdout)')
+    parser.add_argument('--format', choices=('csv', 'json'),
+                        help='output format (default: from the output extension, else csv)')
+    parser.add_argument('--sort', default='program', metavar='FIELD',
+                        help='column to sort by; --sort=-FIELD sorts descending (default: %(default)s)')
+    parser.add_argument('-j', '--workers', type=int, help='worker processes (default: one per core)')
+    parser.add_argument('--cache', default='.sweep_cache', metavar='DIR',
+                        help='result cache directory (default: %(default)s)')
+    parser.add_argument('--timeout', type=float, help='per-run wall-clock limit in seconds')
+    parser.add_argument('--max-cycles', type=int, help='per-run cycle limit')
+    args = parser.parse_args()
+
+    programs = batch.load_manifest(args.programs, {})
+    with open(args.space, 'r') as f:
+        space = json.load(f)
+    limits = {}
+    if args.timeout is not None:
+        limits['timeout'] = args.timeout
+    if args.max_cycles is not None:
+        limits['max_cycles'] = args.max_cycles
+
+    rows = sort_rows(sweep(programs, space, ResultCache(args.cache), args.workers, limits), args.sort)
+    fmt = args.format or ('json' if args.output and args.output.endswith('.json') else 'csv')
+    if args.output is None:
+        write_rows(rows, space, sys.stdout, fmt)
+    else:
+        with open(args.output, 'w', newline='') as f:
+            write_rows(rows, space, f, fmt)
+    if any(row['status'] != 'ok' for row in rows):
+        sys.exit(1)
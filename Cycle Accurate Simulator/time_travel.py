@@ -0,0 +1,148 @@
+import bisect
+from array import array
+from collections import deque
+
+import checkpoint
+
+
+class Snapshot:
+    __slots__ = ('cycle', 'instruction_count', 'nop_count', 'pc', 'latches', 'registers', 'bpu',
+                 'counters', 'pages', 'last_dm_write', 'last_rf_change')
+
+
+class TimeTravel:
+    # Takes an in-memory snapshot every `interval` cycles and keeps the last
+    # `capacity` of them. Data memory is split into pages and a snapshot only
+    # copies the pages written since the previous one; unchanged pages are
+    # shared. goto() restores the nearest earlier snapshot and replays
+    # forward, which gives the same state because the simulator is
+    # deterministic.
+    def __init__(self, simulator, decode, interval=10000, capacity=64, page_words=256):
+        self.simulator = simulator
+        self.decode = decode
+        self.interval = interval
+        self.page_words = page_words
+        self.page_shift = page_words.bit_length() - 1
+        n_words = len(simulator.data_mem.data_mem_array)
+        self.n_pages = (n_words + page_words - 1) // page_words
+        self.snapshots = {}
+        self.cycles = deque(maxlen=capacity)
+        self.pages = [None] * self.n_pages
+        self.dirty = set(range(self.n_pages))
+        # cycle of the last DM write / RF value change per address, -1 if none
+        self.last_dm_write = array('q', [-1] * n_words)
+        self.last_rf_change = array('q', [-1] * 32)
+
+    def attach(self):
+        simulator = self.simulator
+        rf = simulator.rf
+        data_mem = simulator.data_mem
+        write_rf = rf.write_rf
+        write_dm = data_mem.write_dm
+        step = simulator.step
+        dirty = self.dirty
+        last_dm_write = self.last_dm_write
+        last_rf_change = self.last_rf_change
+        page_shift = self.page_shift
+
+        def logged_write_rf(reg_num, write_data):
+            if reg_num != 0 and rf.registers[reg_num] != write_data:
+                last_rf_change[reg_num] = simulator.cycle
+            write_rf(reg_num, write_data)
+
+        def logged_write_dm(address, data):
+            last_dm_write[address] = simulator.cycle
+            dirty.add(address >> page_shift)
+            write_dm(address, data)
+
+        def snapshotting_step():
+            step()
+            if not simulator.cycle % self.interval:
+                self.snapshot()
+
+        rf.write_rf = logged_write_rf
+        data_mem.write_dm = logged_write_dm
+        simulator.step = snapshotting_step
+        self.snapshot()
+
+    def snapshot(self):
+        simulator = self.simulator
+        if simulator.cycle in self.snapshots:  # taken already before a goto()
+            return
+        dm = simulator.data_mem.data_mem_array
+        pages = list(self.pages)
+        for page in self.dirty:
+            start = page * self.page_words
+            pages[page] = bytes(dm[start:start + self.page_words])
+        self.dirty.clear()
+        self.pages = pages
+
+        snap = Snapshot()
+        snap.cycle = simulator.cycle
+        snap.instruction_count = simulator.instruction_count
+        snap.nop_count = simulator.nop_count
+        snap.pc = simulator.pc.cur_pc
+        snap.latches = checkpoint.latch_words(simulator.state)
+        snap.registers = array('q', simulator.rf.registers)
+        snap.bpu = simulator.branch_predictor.state_words()
+        snap.counters = simulator.counters.state_words() if simulator.counters is not None else None
+        snap.pages = pages
+        snap.last_dm_write = array('q', self.last_dm_write)
+        snap.last_rf_change = array('q', self.last_rf_change)
+
+        if len(self.cycles) == self.cycles.maxlen:
+            del self.snapshots[self.cycles[0]]
+        self.cycles.append(snap.cycle)
+        self.snapshots[snap.cycle] = snap
+
+    def restore(self, snap):
+        simulator = self.simulator
+        dm = simulator.data_mem.data_mem_array
+        for page, words in enumerate(snap.pages):
+            start = page * self.page_words
+            dm[start:start + self.page_words] = array('q', words)
+        self.pages = snap.pages
+        self.dirty.clear()
+
+        simulator.cycle = snap.cycle
+        simulator.instruction_count = snap.instruction_count
+        simulator.nop_count = snap.nop_count
+        simulator.pc.cur_pc = snap.pc
+        checkpoint.load_latch_words(simulator.state, snap.latches, self.decode)
+        simulator.rf.registers[:] = snap.registers
+        simulator.branch_predictor.load_state_words(snap.bpu)
+        if simulator.counters is not None:
+            if snap.counters is None:
+                raise ValueError('snapshot was taken without perf counters')
+            simulator.counters.load_state_words(snap.counters)
+        self.last_dm_write[:] = snap.last_dm_write
+        self.last_rf_change[:] = snap.last_rf_change
+        if simulator.state_hash is not None:
+            simulator.state_hash.reset()
+
+    def goto(self, cycle):
+        # leaves the simulator at the start of `cycle`
+        simulator = self.simulator
+        if cycle < simulator.cycle:
+            # replaying after a goto() finds its snapshots already taken, so
+            # the ring stays in cycle order
+            cycles = list(self.cycles)
+            idx = bisect.bisect_right(cycles, cycle)
+            if not idx:
+                raise ValueError(f'cycle {cycle} is older than the oldest snapshot')
+            self.restore(self.snapshots[cycles[idx - 1]])
+        simulator.run(cycle - simulator.cycle)
+        return simulator.cycle
+
+    def last_dm_write_cycle(self, address, before=None):
+        # cycle in which DM[address] was last written, -1 if never; with
+        # `before`, as seen at the start of that cycle
+        if before is not None:
+            self.goto(before)
+        return self.last_dm_write[address]
+
+    def last_rf_change_cycle(self, reg_num, before=None):
+        # cycle in which RF[reg_num] last changed value, -1 if never
+        if before is not None:
+            self.goto(before)
+        return self.last_rf_change[reg_num]
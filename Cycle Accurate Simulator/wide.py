@@ -0,0 +1,38 @@
+import argparse
+import sys
+
+import batch
+import check_step
+from main import DataMem, SimConfig, Simulator
+
+WIDTHS = (1, 2, 4)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='IPC of a program at several issue widths')
+    parser.add_argument('ins_mem', nargs='?', default='ins_mem.txt')
+    parser.add_argument('data_mem', nargs='?', default='data_mem.txt')
+    parser.add_argument('--widths', type=int, nargs='+', default=WIDTHS, metavar='N')
+    parser.add_argument('--predictor', default='bimodal', metavar='SPEC')
+    parser.add_argument('--check', action='store_true',
+                        help='first compare the generated step() with Simulator.step() at every width')
+    args = parser.parse_args()
+
+    instructions = batch.read_instructions(args.ins_mem)
+    data = DataMem.read_text(args.data_mem)
+    results = {}
+    for width in args.widths:
+        config = SimConfig(predictor=args.predictor, width=width)
+        if args.check:
+            mismatch = check_step.check(instructions, data, config)
+            if mismatch is not None:
+                print(f'width {width}: cycle {mismatch[0]}: {mismatch[1]} differs from the generated step()')
+                sys.exit(1)
+        simulator = Simulator(instructions=instructions, data=data, config=config)
+        stats = simulator.run()
+        results[width] = (list(simulator.rf.registers), list(simulator.data_mem.data_mem_array))
+        print(f'width {width}: {stats.cycles} cycles, {stats.instruction_count} fetched, IPC {stats.ipc:.4f}')
+    # every width must compute the same final registers and memory
+    if len(set(map(repr, results.values()))) > 1:
+        print('final RF/DM differ between widths')
+        sys.exit(1)
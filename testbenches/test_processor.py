@@ -3,12 +3,35 @@ from cocotb.clock import Clock
 from cocotb.triggers import RisingEdge, FallingEdge, Timer
 import ctypes
 
+# cycles between STATE_HASH lines; must match --state-hash of the CAS run
+HASH_INTERVAL = 1000
+MASK64 = (1 << 64) - 1
+# per-cycle dump of the pipe registers, in the format of main.py --pipe-dump;
+# compare the two with Cycle Accurate Simulator/packed_pipes.py. None: off
+PIPE_DUMP = None
+PIPES = ('IF_ID', 'ID_EX_1', 'ID_EX_2', 'EX_MEM', 'EX_MEM_2', 'MEM_WB1', 'MEM_WB2')
+
 def to_signed_16bit(value):
     return ctypes.c_int16(value).value
 
 def to_int(array):
     return [ctypes.c_int32(int(x)).value for x in array]
 
+def mix(x):
+    # splitmix64 finalizer, as in Cycle Accurate Simulator/state_hash.py
+    x = ((x ^ (x >> 30)) * 0xbf58476d1ce4e5b9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94d049bb133111eb) & MASK64
+    return x ^ (x >> 31)
+
+def state_hash(pc, registers, dm_values):
+    # sum of one term per PC (tag 0), register (tag 1) and memory word (tag 2)
+    total = mix(pc & 0xffffffff)
+    for idx, value in enumerate(registers):
+        total += mix((1 << 56) | (idx << 32) | (value & 0xffffffff))
+    for idx, value in enumerate(dm_values):
+        total += mix((2 << 56) | (idx << 32) | (value & 0xffffffff))
+    return total & MASK64
+
 def decode_instruction(instruction):
     opcode = (instruction >> 26) & 0x3F
     rs = (instruction >> 21) & 0x1F
@@ -80,6 +103,8 @@ async def processor_test(dut):
     total_instructions_executed = 0
     total_cycles = 0
 
+    pipe_dump = open(PIPE_DUMP, 'w') if PIPE_DUMP else None
+
     cycle = 0
     while True:
         await RisingEdge(dut.clk)
@@ -87,6 +112,8 @@ async def processor_test(dut):
         total_cycles = cycle - max_nops + 1
         instr1 = dut.instMem.q_a.value
         instr2 = dut.instMem.q_b.value
+        if pipe_dump is not None:
+            pipe_dump.write(f"{cycle} " + " ".join(f"{int(getattr(dut, pipe).Q.value):x}" for pipe in PIPES) + "\n")
         await FallingEdge(dut.clk)
         await Timer(1, units="ns")
         registers = to_int(dut.RegFile.registers.value)
@@ -98,7 +125,10 @@ async def processor_test(dut):
             RF: {to_int(registers)}\n\
             DM: {to_int(dm_values[2600:3896])}\n\
             CYCLE_END")
-        
+        if cycle % HASH_INTERVAL == 0:
+            pc = int(dut.PC.value)
+            cocotb.log.warning(f"STATE_HASH cycle: {cycle}, PC: {pc}, hash: {state_hash(pc, registers, dm_values):016x}")
+
 
         # Count non-NOP instructions
         if instr1 != 0x00000000:
@@ -116,6 +146,8 @@ async def processor_test(dut):
             nop_count = 0
         cycle += 1  # Increment cycle count manually
 
+    if pipe_dump is not None:
+        pipe_dump.close()
 
     if total_cycles > 0:
         ipc = total_instructions_executed / total_cycles
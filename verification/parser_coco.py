@@ -4,16 +4,22 @@ import re
 class Library:
     def __init__(self, path_str):
         self.cycles = []
+        # cycle -> (PC, digest) from STATE_HASH lines
+        self.hashes = {}
         self.parse(path_str)
 
     def parse(self, path_str):
         in_cycle = False
         start_pattern = re.compile(r'CYCLE_START')
         end_pattern = re.compile(r'CYCLE_END')
+        hash_pattern = re.compile(r'STATE_HASH cycle: (\d+), PC: (\d+), hash: ([0-9a-f]{16})')
 
         cycle_block = []
         with open(path_str, 'r') as file_handler:
             for line in file_handler:
+                match = hash_pattern.search(line)
+                if match is not None:
+                    self.hashes[int(match.group(1))] = (match.group(2), match.group(3))
                 match = start_pattern.search(line)
                 if match is not None:
                     in_cycle = True
@@ -22,6 +22,17 @@ def main():
             mismatch = coco_lib.cycles[idx].cycle
             break
 
+    # STATE_HASH digests, when both runs logged them at the same interval
+    for cycle in sorted(coco_lib.hashes.keys() & cas_lib.hashes.keys()):
+        if not test_passed and cycle >= int(mismatch):
+            break
+        if cas_lib.hashes[cycle] != coco_lib.hashes[cycle]:
+            logging.warning(f'State hash mismatch at cycle {cycle}: CAS {cas_lib.hashes[cycle]}, '
+                            f'cocoTB {coco_lib.hashes[cycle]}')
+            test_passed = False
+            mismatch = cycle
+            break
+
     if test_passed:
         logging.warning('All cycles are identical; BENCHMARK PASSED')
     else: